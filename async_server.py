@@ -0,0 +1,460 @@
+"""Production server for the web interface: an ASGI front end over the Flask app
+
+Usage:
+    python async_server.py [--host HOST] [--port PORT] [--threads N] [--cpu-workers N] [--server asyncio|uvicorn]
+
+The Flask app runs unchanged behind WsgiAdapter, an ASGI application that
+hands each request to a thread pool and streams request and response
+bodies through the event loop. PDF work is moved to worker processes
+(cpu_pool.CpuPool), so many uploads, downloads and status polls are
+served while merges and edits run. The adapter can be served by uvicorn
+(`uvicorn async_server:app`) or, with no extra packages, by the small
+asyncio HTTP/1.1 server below.
+"""
+import argparse
+import asyncio
+import io
+import signal
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import web_pdf_merger
+from cpu_pool import CpuPool
+
+# Try to import uvicorn (optional)
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# Requests handled at the same time by the Flask app
+DEFAULT_THREADS = 32
+# Bytes read from the client per receive() call
+READ_SIZE = 64 * 1024
+# Most request headers accepted before a request is refused
+MAX_HEADERS = 100
+# Seconds open requests get to finish when the server stops
+SHUTDOWN_TIMEOUT = 30
+
+
+class ClientDisconnected(OSError):
+    """Raised to the app when the client goes away while its body is read"""
+
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input for a worker thread, reading the body from ASGI receive()"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.chunk = b''
+        self.more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and self.more:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected("Client disconnected")
+            self.chunk = message.get('body', b'')
+            self.more = message.get('more_body', False)
+        count = min(len(buffer), len(self.chunk))
+        buffer[:count] = self.chunk[:count]
+        self.chunk = self.chunk[count:]
+        return count
+
+
+class WsgiAdapter:
+    """ASGI application running a WSGI app on a thread pool
+
+    Each request runs in a worker thread; the body is pulled from the
+    event loop as the app reads it, and every chunk the app yields is sent
+    before the next is produced, so slow clients apply backpressure
+    instead of filling memory. on_startup and on_shutdown run with the
+    ASGI lifespan events.
+    """
+
+    def __init__(self, wsgi_app, threads=DEFAULT_THREADS, on_startup=None, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.on_startup is not None:
+                        await asyncio.get_running_loop().run_in_executor(None, self.on_startup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.on_shutdown is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self.on_shutdown)
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def environ(scope, body):
+        """Build the WSGI environ of an ASGI http scope"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BufferedReader(body, READ_SIZE),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        if 'CONTENT_LENGTH' not in environ:
+            # Chunked bodies end where the client says
+            environ['wsgi.input_terminated'] = True
+        return environ
+
+    async def http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="wsgi")
+        environ = self.environ(scope, _RequestBody(receive, loop))
+        response = {}
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                send_now({'type': 'http.response.start', 'status': response['status'],
+                          'headers': response['headers']})
+
+        def run():
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        start()
+                        send_now({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                start()
+                send_now({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        try:
+            await loop.run_in_executor(self.executor, run)
+        except Exception:
+            if response.get('started'):
+                # Too late for an error page; the server drops the connection
+                raise
+            traceback.print_exc()
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'text/plain'), (b'content-length', b'21')]})
+            await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+
+
+class _Connection:
+    """One client connection of HttpServer, serving requests until it closes"""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.app = server.app
+        self.reader = reader
+        self.writer = writer
+        # Waiting for the next request, so safe to close on shutdown
+        self.idle = True
+
+    async def read_request(self):
+        """Read a request head; returns (method, target, version, headers) or None at EOF"""
+        line = await self.reader.readline()
+        if not line.strip():
+            return None
+        method, target, version = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        headers = []
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise ValueError("Too many headers")
+            name, value = line.decode('latin-1').split(':', 1)
+            headers.append((name.strip().lower(), value.strip()))
+        return method, target, version, headers
+
+    async def serve(self):
+        try:
+            while not self.server.closing and await self.serve_request():
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def serve_request(self):
+        """Serve one request; returns whether the connection can be reused"""
+        try:
+            request = await self.read_request()
+            if request is None:
+                return False
+            method, target, version, headers = request
+            fields = dict(headers)
+            chunked = 'chunked' in fields.get('transfer-encoding', '').lower()
+            remaining = 0 if chunked else int(fields.get('content-length') or 0)
+            if remaining < 0:
+                raise ValueError("Negative content length")
+        except ValueError:
+            self.writer.write(b"HTTP/1.1 400 Bad Request\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+            return False
+        self.idle = False
+        keep_alive = version == 'HTTP/1.1' and fields.get('connection', '').lower() != 'close'
+        path, _, query = target.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version[5:],
+            'method': method, 'scheme': 'http', 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'), 'root_path': '',
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            'client': self.writer.get_extra_info('peername'),
+            'server': self.writer.get_extra_info('sockname'),
+        }
+        state = {'body_done': not chunked and not remaining, 'continue': fields.get('expect') == '100-continue',
+                 'chunked_response': False, 'close': not keep_alive}
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal remaining
+            if state['body_done']:
+                # Nothing left to read; wait until the response is sent
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+            if state['continue']:
+                state['continue'] = False
+                self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            if chunked:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    state['body_done'] = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                data = await self.reader.readexactly(size)
+                await self.reader.readline()
+                return {'type': 'http.request', 'body': data, 'more_body': True}
+            data = await self.reader.read(min(remaining, READ_SIZE))
+            if not data:
+                return {'type': 'http.disconnect'}
+            remaining -= len(data)
+            state['body_done'] = not remaining
+            return {'type': 'http.request', 'body': data, 'more_body': bool(remaining)}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                names = {name.lower() for name, _ in message['headers']}
+                head = [f"HTTP/1.1 {message['status']} {http_reason(message['status'])}".encode()]
+                head += [name + b': ' + value for name, value in message['headers']]
+                if b'content-length' not in names and method != 'HEAD':
+                    if version == 'HTTP/1.1':
+                        state['chunked_response'] = True
+                        head.append(b'transfer-encoding: chunked')
+                    else:
+                        state['close'] = True
+                if state['close']:
+                    head.append(b'connection: close')
+                self.writer.write(b'\r\n'.join(head) + b'\r\n\r\n')
+            elif message['type'] == 'http.response.body':
+                body = message.get('body', b'')
+                if method != 'HEAD':
+                    if state['chunked_response']:
+                        if body:
+                            self.writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                        if not message.get('more_body', False):
+                            self.writer.write(b'0\r\n\r\n')
+                    elif body:
+                        self.writer.write(body)
+                # Wait for slow clients before the app produces more
+                await self.writer.drain()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+            self.idle = True
+        if state['close']:
+            return False
+        # Skip whatever the app left unread so the next request lines up
+        while not state['body_done']:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return False
+        return True
+
+
+def http_reason(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ''
+
+
+class HttpServer:
+    """Minimal asyncio HTTP/1.1 server for an ASGI application
+
+    Supports keep-alive, chunked request and response bodies and
+    "Expect: 100-continue", which is all the web interface needs; run
+    uvicorn for TLS or HTTP/2.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=8000):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = {}
+        self.closing = False
+        self.lifespan_queue = None
+        self.lifespan_replies = None
+        self.lifespan_task = None
+
+    async def _lifespan(self, event):
+        """Send a lifespan event to the app and wait for it to complete"""
+        if self.lifespan_task is None:
+            self.lifespan_queue = asyncio.Queue()
+            self.lifespan_replies = asyncio.Queue()
+            self.lifespan_task = asyncio.ensure_future(self.app(
+                {'type': 'lifespan', 'asgi': {'version': '3.0'}},
+                self.lifespan_queue.get, self.lifespan_replies.put
+            ))
+        await self.lifespan_queue.put({'type': event})
+        reply = await self.lifespan_replies.get()
+        if reply['type'] != f'{event}.complete':
+            raise RuntimeError(f"Application {event} failed: {reply.get('message', '')}")
+
+    async def start(self):
+        """Run the app's startup and begin accepting connections"""
+        await self._lifespan('lifespan.startup')
+        self.server = await asyncio.start_server(self._connected, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _connected(self, reader, writer):
+        connection = _Connection(self, reader, writer)
+        self.connections[connection] = asyncio.current_task()
+        try:
+            await connection.serve()
+        finally:
+            del self.connections[connection]
+
+    async def stop(self):
+        """Stop accepting connections, finish open requests and run the app's shutdown"""
+        self.closing = True
+        self.server.close()
+        await self.server.wait_closed()
+        for connection in list(self.connections):
+            if connection.idle:
+                connection.writer.close()
+        if self.connections:
+            await asyncio.wait(list(self.connections.values()), timeout=SHUTDOWN_TIMEOUT)
+        await self._lifespan('lifespan.shutdown')
+
+    async def serve_forever(self):
+        """Serve until SIGINT or SIGTERM, then shut the app down"""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.server.close)
+            except (NotImplementedError, RuntimeError):
+                # No signal handlers on Windows event loops
+                pass
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.stop()
+
+
+def create_app(threads=DEFAULT_THREADS, cpu_workers=None):
+    """Wrap the web app for ASGI, with a CPU pool for the server's lifetime"""
+    def startup():
+        web_pdf_merger.cpu_pool = CpuPool(cpu_workers)
+
+    def shutdown():
+        if web_pdf_merger.cpu_pool is not None:
+            web_pdf_merger.cpu_pool.close()
+            web_pdf_merger.cpu_pool = None
+
+    return WsgiAdapter(web_pdf_merger.app, threads=threads, on_startup=startup, on_shutdown=shutdown)
+
+
+# For ASGI servers: uvicorn async_server:app
+app = create_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the PDF Merger web interface")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="requests handled at the same time")
+    parser.add_argument("--cpu-workers", type=int, default=None,
+                        help="processes for merges and edits (default: number of CPU cores)")
+    parser.add_argument("--server", choices=("asyncio", "uvicorn"), default="asyncio")
+    args = parser.parse_args()
+
+    asgi_app = create_app(args.threads, args.cpu_workers)
+    if args.server == "uvicorn":
+        if uvicorn is None:
+            parser.error("uvicorn is not installed (pip install uvicorn)")
+        uvicorn.run(asgi_app, host=args.host, port=args.port, lifespan="on")
+        return 0
+
+    server = HttpServer(asgi_app, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}", flush=True)
+    asyncio.run(server.serve_forever())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
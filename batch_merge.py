@@ -0,0 +1,234 @@
+"""Non-interactive command-line merging of one job or a manifest of many jobs
+
+Usage:
+    python pdf_merger.py --cli -o out.pdf a.pdf:1-3,-1 b.pdf 'scans/*.pdf'
+    python pdf_merger.py --cli --manifest jobs.jsonl --jobs 4
+
+Each manifest line is a JSON object such as
+    {"output": "out.pdf", "inputs": ["a.pdf", "dir/*.pdf"], "strategy": "stream"}
+which may also set strict, optimize, stamp, images, dedupe, memory_limit
+and workers. Exit status: 0 when every job succeeded, 1 when some inputs
+were skipped, 2 for usage errors and 3 when a job wrote no output.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from merge_engine import STRATEGIES, MergeJob, MergeSource, options_from_config
+from page_ranges import split_spec
+from pdf_optimizer import LEVELS
+
+EXIT_OK = 0
+# Every output was written but some inputs were skipped
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+# At least one job wrote no output
+EXIT_FAILED = 3
+
+# Manifest keys that map onto merge_<key> config settings
+MANIFEST_OPTIONS = ("strategy", "optimize", "stamp", "images", "dedupe", "memory_limit", "workers")
+
+
+class ManifestError(Exception):
+    """Raised for an invalid job description"""
+
+
+def expand_inputs(patterns):
+    """Expand glob patterns in order
+
+    Matches of one pattern are sorted and keep its page ranges, so
+    "scans/*.pdf:1" takes the first page of every scan. Patterns that match
+    nothing are kept as they are so the merge reports them as missing.
+    """
+    paths = []
+    for pattern in patterns:
+        path, spec = split_spec(pattern)
+        matches = sorted(glob.glob(path)) if glob.has_magic(path) else []
+        if spec is not None:
+            matches = [f"{match}:{spec}" for match in matches]
+        paths.extend(matches or [pattern])
+    return paths
+
+
+class BatchJob:
+    """One output file, its MergeSource inputs and the merge options used to build it"""
+
+    def __init__(self, output, inputs, options, strict=False):
+        self.output = output
+        self.inputs = inputs
+        self.options = options
+        self.strict = strict
+
+
+def make_job(entry, config):
+    """Build a BatchJob from a manifest entry (or parsed arguments) and the config"""
+    if not entry.get("output"):
+        raise ManifestError("missing output")
+    if not isinstance(entry.get("inputs"), list) or not entry["inputs"]:
+        raise ManifestError("inputs must be a non-empty list")
+    if entry.get("strategy") not in (None, *STRATEGIES):
+        raise ManifestError(f"unknown strategy: {entry['strategy']}")
+    if entry.get("optimize") not in (None, *LEVELS):
+        raise ManifestError(f"unknown optimization level: {entry['optimize']}")
+
+    settings = dict(config)
+    for key in MANIFEST_OPTIONS:
+        if entry.get(key) is not None:
+            settings[f"merge_{key}"] = entry[key]
+    try:
+        options = options_from_config(settings)
+        sources = [MergeSource.from_value(path) for path in expand_inputs(entry["inputs"])]
+    except (TypeError, ValueError) as e:
+        raise ManifestError(str(e))
+    return BatchJob(entry["output"], sources, options, bool(entry.get("strict")))
+
+
+def read_manifest(path, config, defaults=None):
+    """Read a JSON-lines manifest; blank lines and lines starting with # are skipped
+
+    defaults holds entry keys used by lines that do not set them.
+    """
+    jobs = []
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry, dict):
+                    raise ManifestError("expected a JSON object")
+                jobs.append(make_job(dict(defaults or {}, **entry), config))
+            except (ValueError, ManifestError) as e:
+                raise ManifestError(f"{path}:{number}: {e}")
+    return jobs
+
+
+def run_job(job):
+    """Run one job and return a summary dict; runs in worker processes"""
+    started = time.perf_counter()
+    merge_job = MergeJob(job.inputs, job.output, strict=job.strict, **job.options)
+    try:
+        merge_job.run()
+        write_error = None
+    except Exception as e:
+        write_error = str(e)
+    result = merge_job.result
+    return {
+        'output': job.output,
+        'inputs': len(job.inputs),
+        'pages': result.total_pages,
+        'errors': result.error_files,
+        'written': result.written and write_error is None,
+        'write_error': write_error,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def job_status(summary):
+    if not summary['written']:
+        return "failed"
+    return "partial" if summary['errors'] else "ok"
+
+
+def report(summary):
+    """Print the outcome and timing of a finished job"""
+    status = job_status(summary)
+    if status == "failed":
+        outcome = "no output written"
+    else:
+        outcome = (f"{summary['pages']} pages from "
+                   f"{summary['inputs'] - len(summary['errors'])}/{summary['inputs']} files")
+    print(f"[{status}] {summary['output']}: {outcome} in {summary['seconds']:.2f}s")
+    for name, error in summary['errors']:
+        print(f"    skipped {name}: {error}")
+    if summary['write_error']:
+        print(f"    {summary['write_error']}")
+
+
+def run_jobs(jobs, workers=None, on_done=report):
+    """Run jobs over a process pool and return their summaries in input order"""
+    if len(jobs) == 1 or workers == 1:
+        summaries = []
+        for job in jobs:
+            summaries.append(run_job(job))
+            on_done(summaries[-1])
+        return summaries
+
+    summaries = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = {pool.submit(run_job, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                summaries[i] = {
+                    'output': jobs[i].output, 'inputs': len(jobs[i].inputs), 'pages': 0,
+                    'errors': [], 'written': False, 'write_error': str(e), 'seconds': 0.0,
+                }
+            on_done(summaries[i])
+    return summaries
+
+
+def exit_status(summaries):
+    """Return the process exit status for finished jobs"""
+    statuses = {job_status(summary) for summary in summaries}
+    if "failed" in statuses:
+        return EXIT_FAILED
+    if "partial" in statuses:
+        return EXIT_PARTIAL
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pdf_merger.py --cli",
+        description="Merge PDF files without prompting. Input patterns may be globs."
+    )
+    parser.add_argument("inputs", nargs="*",
+                        help="input PDF files or glob patterns, optionally with page ranges (file.pdf:1-3,10,-1)")
+    parser.add_argument("-o", "--output", default="merged_output.pdf", help="output file")
+    parser.add_argument("--manifest", help="JSON-lines file describing one merge job per line")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of jobs merged at once (default: number of CPU cores)")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), help="merge strategy")
+    parser.add_argument("--optimize", choices=LEVELS, help="output optimization level")
+    parser.add_argument("--strict", action="store_true", help="write nothing if any input fails")
+    return parser
+
+
+def main(argv, config):
+    """Run the batch CLI with argv (without --cli) and return the exit status"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if bool(args.manifest) == bool(args.inputs):
+        parser.print_usage()
+        print("error: give either input files or --manifest")
+        return EXIT_USAGE
+
+    # Command-line options also apply to manifest lines that do not set them
+    defaults = {"strict": args.strict, "strategy": args.strategy, "optimize": args.optimize}
+    try:
+        if args.manifest:
+            jobs = read_manifest(args.manifest, config, defaults)
+        else:
+            jobs = [make_job(dict(defaults, output=args.output, inputs=args.inputs), config)]
+    except (OSError, ManifestError) as e:
+        print(f"error: {e}")
+        return EXIT_USAGE
+    if not jobs:
+        print("error: the manifest contains no jobs")
+        return EXIT_USAGE
+
+    started = time.perf_counter()
+    summaries = run_jobs(jobs, args.jobs)
+    counts = {status: 0 for status in ("ok", "partial", "failed")}
+    for summary in summaries:
+        counts[job_status(summary)] += 1
+    print(f"{len(summaries)} jobs in {time.perf_counter() - started:.2f}s: "
+          f"{counts['ok']} ok, {counts['partial']} partial, {counts['failed']} failed")
+    return exit_status(summaries)
@@ -0,0 +1,411 @@
+"""Performance benchmarks for the PDF Merger Tool
+
+Usage:
+    python benchmark.py edit [--pages N] [--repeat N]
+    python benchmark.py optimize [--corpus DIR] [--files N] [--pages N] [--strategy NAME] [--repeat N]
+    python benchmark.py pages [--pages N] [--fanout N] [--repeat N]
+    python benchmark.py input [--pages N] [--repeat N]
+    python benchmark.py load [--url URL] [--concurrency N] [--requests N] [--pages N]
+"""
+import argparse
+import glob
+import http.client
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from merge_engine import DEFAULT_STRATEGY, STRATEGIES, merge
+from input_source import open_input, stream_sha256
+from page_index import PageIndex
+from page_ranges import select_pages
+from pdf_metadata import metadata_from_stream
+from stream_writer import build_fragment
+from pdf_editor import edit_pdf
+from pdf_optimizer import LEVELS
+
+
+def create_document(path, pages, compress=True, title="Benchmark"):
+    """Create a text-heavy synthetic PDF with the given number of pages"""
+    c = canvas.Canvas(path, pageCompression=int(compress))
+    for page in range(pages):
+        for line in range(40):
+            c.drawString(50, 800 - line * 18, f"{title} line {line} on page {page}")
+        c.showPage()
+    c.save()
+
+
+def create_page_tree(path, pages, fanout=32):
+    """Write a PDF of many tiny pages under a balanced page tree of the given fanout
+
+    The pages share one content stream and inherit their resources and
+    media box from the root, so even 50,000 pages take a few seconds to
+    write and only a few MB.
+    """
+    offsets = []
+
+    def add(f, body):
+        offsets.append(f.tell())
+        f.write(f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+        return len(offsets)
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        font = add(f, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        content = b"BT /F1 24 Tf 72 720 Td (Synthetic page) Tj ET"
+        contents = add(f, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        # Object numbers of the nodes are reserved top-down so every kid
+        # can name its parent: count the nodes of each level first
+        sizes = [pages]
+        while sizes[-1] > 1:
+            sizes.append(-(-sizes[-1] // fanout))
+        first = len(offsets) + 1
+        starts = {}
+        for level in range(len(sizes) - 1, -1, -1):
+            starts[level] = first
+            first += sizes[level]
+        root = starts[len(sizes) - 1]
+
+        bodies = {}
+        for level in range(len(sizes)):
+            for i in range(sizes[level]):
+                number = starts[level] + i
+                parent = b"" if number == root else b" /Parent %d 0 R" % (starts[level + 1] + i // fanout)
+                if level == 0:
+                    bodies[number] = b"<< /Type /Page%s /Contents %d 0 R >>" % (parent, contents)
+                    continue
+                kids = range(i * fanout, min((i + 1) * fanout, sizes[level - 1]))
+                count = min((i + 1) * fanout ** level, pages) - i * fanout ** level
+                extra = b""
+                if number == root:
+                    extra = b" /Resources << /Font << /F1 %d 0 R >> >> /MediaBox [0 0 612 792]" % font
+                bodies[number] = b"<< /Type /Pages%s /Kids [%s] /Count %d%s >>" % (
+                    parent, b" ".join(b"%d 0 R" % (starts[level - 1] + kid) for kid in kids), count, extra
+                )
+        for number in sorted(bodies):
+            add(f, bodies[number])
+        catalog = add(f, b"<< /Type /Catalog /Pages %d 0 R >>" % root)
+
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        f.writelines(b"%010d 00000 n \n" % offset for offset in offsets)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                % (len(offsets) + 1, catalog, xref))
+
+
+def best_time(func, repeat):
+    """Return the fastest of repeat runs of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_edit(args):
+    """Compare full rewrites with incremental updates for single-page edits"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        output = os.path.join(tmp, "output.pdf")
+        create_document(source, args.pages)
+        print(f"Document: {args.pages} pages, {os.path.getsize(source) / 1024:.0f} KB")
+        print(f"{'edit':<10}{'mode':<14}{'seconds':>10}{'output KB':>12}")
+
+        edits = {
+            'rotate': [{'op': 'rotate', 'pages': args.pages // 2, 'degrees': 90}],
+            'text': [{'op': 'text', 'text': 'APPROVED', 'pages': args.pages // 2}],
+        }
+        for name, operations in edits.items():
+            for mode, incremental in (('full', False), ('incremental', True)):
+                seconds = best_time(lambda: edit_pdf(source, operations, output, incremental=incremental), args.repeat)
+                print(f"{name:<10}{mode:<14}{seconds:>10.3f}{os.path.getsize(output) / 1024:>12.0f}")
+
+
+def bench_optimize(args):
+    """Compare output size and merge time at every optimization level"""
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.corpus:
+            sources = sorted(glob.glob(os.path.join(args.corpus, "*.pdf")))
+            if not sources:
+                print(f"No PDF files in {args.corpus}")
+                return
+        else:
+            # Mix producers that do and do not compress their content streams
+            sources = []
+            for i in range(args.files):
+                path = os.path.join(tmp, f"source{i}.pdf")
+                create_document(path, args.pages, compress=i % 2 == 0, title=f"Document {i}")
+                sources.append(path)
+        total = sum(os.path.getsize(path) for path in sources)
+        print(f"Corpus: {len(sources)} files, {total / 1024:.0f} KB, strategy '{args.strategy}'")
+        print(f"{'level':<10}{'seconds':>10}{'output KB':>12}{'vs none':>10}")
+
+        baseline = None
+        for level in LEVELS:
+            sizes = []
+
+            def run():
+                output = io.BytesIO()
+                merge(sources, output, strategy=args.strategy, optimize=level)
+                sizes.append(len(output.getvalue()))
+
+            seconds = best_time(run, args.repeat)
+            size = sizes[-1]
+            baseline = baseline or size
+            print(f"{level:<10}{seconds:>10.3f}{size / 1024:>12.0f}{size / baseline:>10.0%}")
+
+
+def bench_pages(args):
+    """Compare the lazy page index with reader.pages on one huge document"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "huge.pdf")
+        create_page_tree(source, args.pages, args.fanout)
+        print(f"Document: {args.pages} pages, fanout {args.fanout}, {os.path.getsize(source) / 1024:.0f} KB")
+        print(f"{'task':<26}{'reader.pages':>14}{'PageIndex':>12}")
+
+        def last_page(pages):
+            reader = PdfReader(source)
+            return pages(reader)[len(pages(reader)) - 1]
+
+        def iterate(pages):
+            for _ in pages(PdfReader(source)):
+                pass
+
+        eager = lambda reader: reader.pages
+        tasks = {
+            'count pages': lambda pages: len(pages(PdfReader(source))),
+            'open last page': last_page,
+            'iterate every page': iterate,
+        }
+        for name, task in tasks.items():
+            times = [best_time(lambda: task(pages), args.repeat) for pages in (eager, PageIndex)]
+            print(f"{name:<26}{times[0]:>14.3f}{times[1]:>12.3f}")
+
+        # The engine selects pages through the index
+        for spec in ("1-10", "-10-"):
+            seconds = best_time(lambda: merge([f"{source}:{spec}"], io.BytesIO(), strategy="stream"), args.repeat)
+            print(f"{'merge pages ' + spec:<26}{'':>14}{seconds:>12.3f}")
+
+
+def read_into_memory(path):
+    """Open a file the way PdfReader(path) does, by reading all of it"""
+    with open(path, 'rb') as f:
+        return io.BytesIO(f.read())
+
+
+def bench_input(args):
+    """Compare memory-mapped input with file objects and in-memory copies"""
+    openers = {
+        'file': lambda path: open(path, 'rb'),
+        'mmap': open_input,
+        'memory': read_into_memory,
+    }
+
+    def metadata(stream):
+        metadata_from_stream(stream)
+
+    def last_pages(stream):
+        reader = PdfReader(stream)
+        build_fragment(reader, select_pages(reader, "-10-"))
+
+    def every_page(stream):
+        reader = PdfReader(stream)
+        build_fragment(reader, select_pages(reader, None))
+
+    tasks = {'metadata': metadata, 'copy last 10 pages': last_pages, 'copy every page': every_page,
+             'sha256': stream_sha256}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        documents = {
+            'page tree': os.path.join(tmp, "tree.pdf"),
+            'text': os.path.join(tmp, "text.pdf"),
+        }
+        create_page_tree(documents['page tree'], args.pages)
+        create_document(documents['text'], max(1, args.pages // 25), compress=False)
+        for label, path in documents.items():
+            print(f"Document '{label}': {os.path.getsize(path) / 1024:.0f} KB")
+        print(f"{'document':<12}{'task':<22}" + "".join(f"{name:>10}" for name in openers))
+
+        for label, path in documents.items():
+            for name, task in tasks.items():
+                times = []
+                for opener in openers.values():
+                    def run():
+                        with opener(path) as stream:
+                            task(stream)
+                    times.append(best_time(run, args.repeat))
+                print(f"{label:<12}{name:<22}" + "".join(f"{seconds:>10.3f}" for seconds in times))
+
+
+def start_server(tmp):
+    """Start async_server.py on a free port in tmp and return (process, url)"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "async_server.py")
+    process = subprocess.Popen([sys.executable, script, "--port", str(port)], cwd=tmp,
+                               stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_load(args):
+    """Measure throughput and latency of uploads, queued and streamed merges and edits under concurrent load"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        create_document(source, args.pages)
+        with open(source, 'rb') as f:
+            content = f.read()
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(tmp)
+        address = urlsplit(url)
+        local = threading.local()
+
+        def request(method, path, body=None, headers=None):
+            # One keep-alive connection per client thread
+            if getattr(local, 'conn', None) is None:
+                local.conn = http.client.HTTPConnection(address.hostname, address.port, timeout=300)
+            try:
+                local.conn.request(method, path, body, headers or {})
+                response = local.conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                local.conn.close()
+                local.conn = None
+                raise
+            if response.status >= 400:
+                raise RuntimeError(f"{method} {path} returned {response.status}")
+            return data
+
+        def upload():
+            boundary = uuid.uuid4().hex
+            body = (f'--{boundary}\r\nContent-Disposition: form-data; name="files[]"; filename="source.pdf"\r\n'
+                    f'Content-Type: application/pdf\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+            data = request('POST', '/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+            return json.loads(data)['files'][0]
+
+        def merge(stream):
+            data = request('POST', '/merge', json.dumps({
+                'files': [uploaded, uploaded], 'stream': stream,
+                'stamp': {'bates_prefix': 'LOAD', 'bates_start': next(counter) + 1},
+            }), {'Content-Type': 'application/json'})
+            if stream:
+                return
+            # Queued merges run in the CPU pool; the latency includes waiting for the job
+            status_url = json.loads(data)['status_url']
+            while True:
+                state = json.loads(request('GET', status_url))['state']
+                if state not in ('queued', 'running'):
+                    break
+                time.sleep(0.01)
+            if state != 'done':
+                raise RuntimeError(f"Merge job {state}")
+
+        try:
+            uploaded = upload()
+            counter = iter(range(10 ** 9))
+            # Each merge and edit differs, so no result comes from the result store
+            tasks = {
+                'upload': upload,
+                'merge': lambda: merge(False),
+                'stream': lambda: merge(True),
+                'edit': lambda: request('POST', '/edit/rotate_page', json.dumps({
+                    'pdf_path': uploaded['path'], 'page_num': next(counter) % args.pages,
+                }), {'Content-Type': 'application/json'}),
+            }
+            print(f"Server: {url}, document: {args.pages} pages, {len(content) / 1024:.0f} KB, "
+                  f"{args.concurrency} clients")
+            print(f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+            for name, task in tasks.items():
+                def timed(_):
+                    start = time.perf_counter()
+                    try:
+                        task()
+                    except (OSError, RuntimeError, http.client.HTTPException):
+                        return None
+                    return time.perf_counter() - start
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    latencies = list(pool.map(timed, range(args.requests)))
+                elapsed = time.perf_counter() - start
+                ok = [latency * 1000 for latency in latencies if latency is not None]
+                p50 = percentile(ok, 0.5) if ok else 0
+                p95 = percentile(ok, 0.95) if ok else 0
+                print(f"{name:<10}{args.requests:>10}{args.requests - len(ok):>8}"
+                      f"{len(ok) / elapsed:>10.1f}{p50:>10.0f}{p95:>10.0f}")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF Merger Tool benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    edit = subparsers.add_parser("edit", help="full rewrite vs incremental update")
+    edit.add_argument("--pages", type=int, default=2000)
+    edit.add_argument("--repeat", type=int, default=3)
+    edit.set_defaults(func=bench_edit)
+
+    optimize = subparsers.add_parser("optimize", help="output size vs time per optimization level")
+    optimize.add_argument("--corpus", help="directory of PDFs to merge (default: synthetic files)")
+    optimize.add_argument("--files", type=int, default=20)
+    optimize.add_argument("--pages", type=int, default=20)
+    optimize.add_argument("--strategy", choices=sorted(STRATEGIES), default=DEFAULT_STRATEGY)
+    optimize.add_argument("--repeat", type=int, default=3)
+    optimize.set_defaults(func=bench_optimize)
+
+    pages = subparsers.add_parser("pages", help="lazy page index vs flattening the page tree")
+    pages.add_argument("--pages", type=int, default=50000)
+    pages.add_argument("--fanout", type=int, default=32)
+    pages.add_argument("--repeat", type=int, default=3)
+    pages.set_defaults(func=bench_pages)
+
+    input_ = subparsers.add_parser("input", help="memory-mapped vs file object vs in-memory input")
+    input_.add_argument("--pages", type=int, default=20000)
+    input_.add_argument("--repeat", type=int, default=3)
+    input_.set_defaults(func=bench_input)
+
+    load = subparsers.add_parser("load", help="requests/sec and latency of the web server under load")
+    load.add_argument("--url", help="server to test (default: start async_server.py)")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--pages", type=int, default=20)
+    load.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Run CPU-heavy PDF work in worker processes for the web server"""
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from merge_engine import MergeJob
+
+# Seconds between checks for progress reports from a merge worker
+REPORT_INTERVAL = 0.1
+
+
+class ReportedProgress:
+    """The latest progress a worker reported for a merge
+
+    Stands in for a MergeProgress on a job_queue Job; info holds
+    MergeProgress.to_dict() as sent by the worker.
+    """
+
+    def __init__(self, total_files):
+        self.info = {
+            'files_done': 0, 'total_files': total_files, 'pages_processed': 0,
+            'bytes_written': 0, 'fraction': 0.0, 'eta': None,
+        }
+
+    def to_dict(self):
+        return dict(self.info)
+
+
+def _merge(sources, output, options, reports, cancel):
+    """Run a merge in a worker process, sending its progress to reports"""
+    # The job checks the shared cancel event between pages and while writing
+    job = MergeJob(sources, output, cancel_event=cancel, **options)
+    job.on_progress = lambda progress: reports.put(progress.to_dict())
+    return job.run()
+
+
+class CpuPool:
+    """Process pool for PDF parsing and writing
+
+    Requests and merge jobs run on threads, and PDF work holds the GIL
+    while it runs, so a few large merges or edits slow every other request
+    down. Handing that work to worker processes keeps the serving threads
+    free for uploads, downloads and status queries. Work is passed by file
+    path, so files held in a memory pool must still be handled in-process.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # Spawned workers never inherit the server's threads and sockets
+        self.context = multiprocessing.get_context("spawn")
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context)
+        # Started on the first merge; merges arrive on several job threads
+        self.manager = None
+        self.manager_lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker and return its result"""
+        return self.pool.submit(func, *args, **kwargs).result()
+
+    def merge(self, job, sources, output, options):
+        """Run a merge for a job_queue Job in a worker and return its MergeResult
+
+        job.progress follows the worker's reports and job.cancel() stops
+        the worker's merge, which then raises MergeCancelled here.
+        """
+        with self.manager_lock:
+            if self.manager is None:
+                self.manager = self.context.Manager()
+            reports = self.manager.Queue()
+            cancel = self.manager.Event()
+        progress = ReportedProgress(len(sources))
+        job.progress = progress
+        job.on_cancel = cancel.set
+        if job.cancel_requested:
+            cancel.set()
+
+        future = self.pool.submit(_merge, sources, output, options, reports, cancel)
+        while not future.done() or not reports.empty():
+            try:
+                progress.info = reports.get(timeout=REPORT_INTERVAL)
+            except queue.Empty:
+                pass
+        return future.result()
+
+    def close(self):
+        """Stop the workers, dropping work that has not started"""
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        with self.manager_lock:
+            if self.manager is not None:
+                self.manager.shutdown()
+                self.manager = None
@@ -0,0 +1,121 @@
+"""Replace identical objects in a PyPDF2 PdfWriter with references to one copy"""
+import hashlib
+import io
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NullObject
+
+# Objects of these types stay distinct even when they are identical
+UNIQUE_TYPES = ("/Page", "/Pages", "/Catalog", "/Annot")
+
+
+def _references(obj):
+    """Yield every indirect reference held directly inside obj"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            yield value
+        elif isinstance(value, DictionaryObject):
+            stack.extend(value.values())
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+
+
+def _replace_references(obj, canonical, writer):
+    """Point references inside obj at the canonical copies, in place"""
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, DictionaryObject):
+            items = list(container.items())
+        elif isinstance(container, ArrayObject):
+            items = list(enumerate(container))
+        else:
+            continue
+        for key, value in items:
+            if isinstance(value, IndirectObject):
+                if value.idnum in canonical:
+                    container[key] = IndirectObject(canonical[value.idnum], 0, writer)
+            elif isinstance(value, (DictionaryObject, ArrayObject)):
+                stack.append(value)
+
+
+def _unique_numbers(writer):
+    """Object numbers that must never be merged with another object"""
+    unique = {writer._root.idnum, writer._info.idnum}
+    for number, obj in enumerate(writer._objects, 1):
+        if not isinstance(obj, DictionaryObject):
+            continue
+        if obj.get("/Type") in UNIQUE_TYPES or "/Parent" in obj:
+            unique.add(number)
+        if obj.get("/Type") == "/Page":
+            # Each annotation belongs to exactly one page
+            annotations = obj.get("/Annots")
+            if isinstance(annotations, ArrayObject):
+                unique.update(ref.idnum for ref in annotations if isinstance(ref, IndirectObject))
+    return unique
+
+
+def dedupe_writer(writer):
+    """Merge identical objects of writer and return (objects removed, bytes saved)
+
+    Objects are compared after the objects they refer to have been merged,
+    so identical fonts or images whose descriptors point at identical
+    streams collapse into one. Duplicates are replaced by null objects so
+    object numbering stays intact.
+    """
+    if writer._root is None:
+        writer._root = writer._add_object(writer._root_object)
+    objects = writer._objects
+    unique = _unique_numbers(writer)
+    # Duplicate number -> number of the copy that is kept
+    canonical = {}
+    seen = {}
+    done = set()
+    removed = 0
+    saved = 0
+
+    def children(number):
+        return [
+            ref.idnum for ref in _references(objects[number - 1])
+            if ref.pdf is writer and 0 < ref.idnum <= len(objects)
+        ]
+
+    for root in range(1, len(objects) + 1):
+        stack = [(root, False)]
+        expanded = set()
+        while stack:
+            number, ready = stack.pop()
+            if number in done:
+                continue
+            if not ready:
+                if number in expanded:
+                    continue
+                expanded.add(number)
+                stack.append((number, True))
+                stack.extend((child, False) for child in children(number) if child not in expanded)
+                continue
+
+            done.add(number)
+            obj = objects[number - 1]
+            if obj is None:
+                continue
+            _replace_references(obj, canonical, writer)
+            if number in unique:
+                continue
+            buffer = io.BytesIO()
+            obj.write_to_stream(buffer, None)
+            digest = hashlib.sha256(buffer.getvalue()).digest()
+            if digest in seen:
+                canonical[number] = seen[digest]
+                objects[number - 1] = NullObject()
+                removed += 1
+                saved += buffer.tell()
+            else:
+                seen[digest] = number
+
+    # Objects visited before their duplicates were found still need updating
+    for obj in objects:
+        if obj is not None:
+            _replace_references(obj, canonical, writer)
+    return removed, saved
@@ -0,0 +1,272 @@
+"""File list model and virtualized list view for the GUI"""
+import os
+import tkinter as tk
+from array import array
+from tkinter import font as tkfont
+from tkinter import ttk
+
+from page_ranges import resolve_ranges, split_spec
+
+# Page counts of entries whose file is still being read, or cannot be read
+UNKNOWN = -1
+UNREADABLE = -2
+
+# Rows scrolled per mouse wheel step
+WHEEL_ROWS = 3
+
+
+class FileListModel:
+    """The entries of the merge list and their cached page counts
+
+    Entries are "path" or "path:ranges" strings in merge order. counts
+    holds the pages each entry contributes (UNKNOWN or UNREADABLE), and
+    info the metadata of every listed file. Bulk operations take a
+    collection of indices and rebuild the lists in one pass, so they stay
+    O(n) however many entries they touch.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.counts = array('l')
+        self.info = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def _count(self, entry):
+        path, spec = split_spec(entry)
+        metadata = self.info.get(path)
+        if metadata is None:
+            return UNKNOWN
+        if 'error' in metadata:
+            return UNREADABLE
+        count = metadata.get('page_count', 0)
+        if spec is not None:
+            try:
+                count = len(resolve_ranges(spec, count))
+            except ValueError:
+                count = 0
+        return count
+
+    def paths(self):
+        """Return the set of listed file paths"""
+        return {split_spec(entry)[0] for entry in self.entries}
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        self.counts.extend(self._count(entry) for entry in entries)
+
+    def clear(self):
+        self.entries = []
+        self.counts = array('l')
+        self.info = {}
+
+    def update_info(self, results):
+        """Store {path: metadata} and recount the entries of those files"""
+        self.info.update(results)
+        for index, entry in enumerate(self.entries):
+            if split_spec(entry)[0] in results:
+                self.counts[index] = self._count(entry)
+
+    def _reorder(self, order):
+        self.entries = [self.entries[i] for i in order]
+        self.counts = array('l', (self.counts[i] for i in order))
+
+    def remove(self, indices):
+        """Remove the entries at indices and forget files no longer listed"""
+        removed = set(indices)
+        self._reorder([i for i in range(len(self.entries)) if i not in removed])
+        listed = self.paths()
+        self.info = {path: metadata for path, metadata in self.info.items() if path in listed}
+
+    def move(self, indices, offset):
+        """Move the entries at indices one place up (offset -1) or down (+1)
+
+        Runs of entries blocked by the start or end of the list stay put.
+        Returns the new indices of the moved entries.
+        """
+        selected = bytearray(len(self.entries))
+        for i in indices:
+            selected[i] = 1
+        order = list(range(len(self.entries)))
+        positions = range(1, len(order)) if offset < 0 else range(len(order) - 2, -1, -1)
+        for i in positions:
+            j = i + offset
+            if selected[i] and not selected[j]:
+                order[i], order[j] = order[j], order[i]
+                selected[i], selected[j] = 0, 1
+        self._reorder(order)
+        return [i for i, flag in enumerate(selected) if flag]
+
+    def sort(self, key="name", indices=()):
+        """Sort entries by file "name", full "path" or "pages" (a stable sort)
+
+        Returns the new positions of the entries at indices.
+        """
+        keys = {
+            "name": lambda i: os.path.basename(split_spec(self.entries[i])[0]).lower(),
+            "path": lambda i: self.entries[i].lower(),
+            "pages": lambda i: self.counts[i],
+        }
+        order = sorted(range(len(self.entries)), key=keys[key])
+        self._reorder(order)
+        position = {old: new for new, old in enumerate(order)}
+        return sorted(position[i] for i in indices)
+
+    def set_pages(self, indices, spec):
+        """Set the page-range spec of the entries at indices (None or "" for all pages)"""
+        for i in indices:
+            path = split_spec(self.entries[i])[0]
+            self.entries[i] = f"{path}:{spec}" if spec else path
+            self.counts[i] = self._count(self.entries[i])
+
+    def totals(self):
+        """Return (pages known so far, entries still being read)"""
+        pages = reading = 0
+        for count in self.counts:
+            if count >= 0:
+                pages += count
+            elif count == UNKNOWN:
+                reading += 1
+        return pages, reading
+
+    def row_text(self, index):
+        """Text of one row: the entry and its page count once known"""
+        count = self.counts[index]
+        if count == UNKNOWN:
+            return f"{self.entries[index]}   (reading...)"
+        if count == UNREADABLE:
+            return f"{self.entries[index]}   (unreadable)"
+        return f"{self.entries[index]}   ({count} page{'' if count == 1 else 's'})"
+
+
+class VirtualListView:
+    """A listbox that only holds the rows on screen
+
+    The selection lives here as model indices; the listbox is refilled
+    with the visible window of rows whenever it scrolls or the model
+    changes, so it never holds more than a screenful however long the
+    list is.
+    """
+
+    def __init__(self, parent, model):
+        self.model = model
+        self.top = 0
+        self.visible = 1
+        self.selected = set()
+        self.anchor = None
+
+        self.listbox = tk.Listbox(parent, selectmode=tk.EXTENDED, activestyle='none', exportselection=False)
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.yview)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        bindings = {
+            '<Button-1>': lambda e: self.click(e, extend=False, toggle=False),
+            '<Shift-Button-1>': lambda e: self.click(e, extend=True, toggle=False),
+            '<Control-Button-1>': lambda e: self.click(e, extend=False, toggle=True),
+            '<B1-Motion>': lambda e: self.click(e, extend=True, toggle=False),
+            '<MouseWheel>': lambda e: self.scroll(-WHEEL_ROWS if e.delta > 0 else WHEEL_ROWS),
+            '<Button-4>': lambda e: self.scroll(-WHEEL_ROWS),
+            '<Button-5>': lambda e: self.scroll(WHEEL_ROWS),
+            '<Up>': lambda e: self.step(-1),
+            '<Down>': lambda e: self.step(1),
+            '<Prior>': lambda e: self.scroll(-self.visible),
+            '<Next>': lambda e: self.scroll(self.visible),
+            '<Control-a>': lambda e: self.select_all(),
+        }
+        for sequence, handler in bindings.items():
+            self._bind(sequence, handler)
+        self.listbox.bind('<Configure>', self.resize)
+
+    def _bind(self, sequence, handler):
+        def callback(event):
+            handler(event)
+            # Skip the listbox's own selection handling
+            return "break"
+        self.listbox.bind(sequence, callback)
+
+    def resize(self, event):
+        linespace = tkfont.Font(root=self.listbox, font=self.listbox.cget('font')).metrics('linespace')
+        self.visible = max(1, event.height // (linespace + 1))
+        self.render()
+
+    def selection(self):
+        """Return the selected model indices in order"""
+        return sorted(self.selected)
+
+    def select(self, indices):
+        self.selected = set(indices)
+        self.anchor = min(self.selected) if self.selected else None
+        if self.selected:
+            self.see(min(self.selected))
+        self.render()
+
+    def select_all(self):
+        self.selected = set(range(len(self.model)))
+        self.render()
+
+    def see(self, index):
+        """Scroll so that index is on screen"""
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.visible:
+            self.top = index - self.visible + 1
+
+    def click(self, event, extend, toggle):
+        if not len(self.model):
+            return
+        self.listbox.focus_set()
+        index = min(self.top + self.listbox.nearest(event.y), len(self.model) - 1)
+        if extend and self.anchor is not None:
+            low, high = sorted((self.anchor, index))
+            self.selected = set(range(low, high + 1))
+        elif toggle:
+            self.selected ^= {index}
+            self.anchor = index
+        else:
+            self.selected = {index}
+            self.anchor = index
+        self.see(index)
+        self.render()
+
+    def step(self, offset):
+        if not len(self.model):
+            return
+        current = self.anchor if self.anchor is not None else -1
+        index = min(max(current + offset, 0), len(self.model) - 1)
+        self.selected = {index}
+        self.anchor = index
+        self.see(index)
+        self.render()
+
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+
+    def yview(self, *args):
+        """Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"/"pages")"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.model))
+        elif args[0] == 'scroll':
+            self.top += int(args[1]) * (self.visible if args[2] == 'pages' else 1)
+        self.render()
+
+    def render(self):
+        """Refill the listbox with the rows on screen"""
+        count = len(self.model)
+        self.top = max(0, min(self.top, count - self.visible))
+        end = min(count, self.top + self.visible)
+        self.listbox.delete(0, tk.END)
+        if end > self.top:
+            self.listbox.insert(tk.END, *(self.model.row_text(i) for i in range(self.top, end)))
+        for index in self.selected:
+            if self.top <= index < end:
+                self.listbox.select_set(index - self.top)
+        if count:
+            self.scrollbar.set(self.top / count, end / count)
+        else:
+            self.scrollbar.set(0, 1)
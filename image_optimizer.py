@@ -0,0 +1,376 @@
+"""Downsample and recompress the images of merged documents with Pillow"""
+import hashlib
+import io
+import math
+import os
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    ContentStream,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+)
+
+# Images are only resampled when this much larger than the target size
+RESAMPLE_THRESHOLD = 1.1
+
+# Nesting depth of form XObjects searched for image placements
+MAX_FORM_DEPTH = 4
+
+# Bytes of recompressed images an optimizer keeps for reuse
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Option sets a merge worker keeps an optimizer for
+MAX_WORKER_OPTIMIZERS = 4
+
+_COMPONENTS = {'/DeviceGray': 1, '/CalGray': 1, '/DeviceRGB': 3, '/CalRGB': 3}
+
+# Filters decoded before the pixels (or JPEG data) are read
+_DECODABLE = ('/ASCII85Decode', '/ASCIIHexDecode', '/FlateDecode', '/LZWDecode')
+
+
+class ImageOptions:
+    """Target resolution and encoding for recompressed images
+
+    Images drawn at more than target_dpi are downsampled; images are
+    re-encoded as JPEG at quality, or with Flate when lossless is set, and
+    kept only if the result is smaller. workers is the process pool size.
+    """
+
+    def __init__(self, target_dpi=150, quality=75, lossless=False, workers=None):
+        self.target_dpi = target_dpi
+        self.quality = quality
+        self.lossless = lossless
+        self.workers = workers
+
+    FIELDS = ("target_dpi", "quality", "lossless", "workers")
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build options from a dict of their fields, or return None if data is empty"""
+        if not data:
+            return None
+        return cls(**{key: data[key] for key in cls.FIELDS if key in data})
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+
+def _multiply(m, n):
+    """Return the matrix product m x n of two PDF matrices"""
+    return [
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def _xobjects(resources):
+    resources = resources.get_object() if resources is not None else None
+    if not isinstance(resources, DictionaryObject) or '/XObject' not in resources:
+        return {}
+    return dict(resources['/XObject'].get_object().items())
+
+
+def _scan(contents, resources, pdf, ctm, sizes, depth=0):
+    """Record the drawn size of every image placed by a content stream"""
+    names = _xobjects(resources)
+    stack = []
+    for operands, operator in ContentStream(contents, pdf).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else ctm
+        elif operator == b'cm':
+            ctm = _multiply([float(v) for v in operands], ctm)
+        elif operator == b'Do' and operands[0] in names:
+            reference = names[operands[0]]
+            xobject = reference.get_object()
+            if xobject.get('/Subtype') == '/Image' and isinstance(reference, IndirectObject):
+                size = (math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3]))
+                key = (reference.generation, reference.idnum)
+                old = sizes.get(key, (0, 0))
+                sizes[key] = (max(old[0], size[0]), max(old[1], size[1]))
+            elif xobject.get('/Subtype') == '/Form' and depth < MAX_FORM_DEPTH:
+                matrix = [float(v) for v in xobject.get('/Matrix', [1, 0, 0, 1, 0, 0])]
+                _scan(xobject, xobject.get('/Resources'), pdf, _multiply(matrix, ctm), sizes, depth + 1)
+
+
+def page_images(page):
+    """Return {(generation, idnum): (reference, (width, height))} for a page
+
+    Sizes are the largest drawn size in points. Images the content cannot
+    be traced for are assumed to fill the page.
+    """
+    names = _xobjects(page.get('/Resources'))
+    images = {
+        (ref.generation, ref.idnum): ref for ref in names.values()
+        if isinstance(ref, IndirectObject) and ref.get_object().get('/Subtype') == '/Image'
+    }
+    if not images:
+        return {}
+    sizes = {}
+    try:
+        if '/Contents' in page:
+            _scan(page['/Contents'].get_object(), page.get('/Resources'), page.pdf, [1, 0, 0, 1, 0, 0], sizes)
+    except Exception:
+        sizes = {}
+    box = page.mediabox
+    fallback = (float(box.width), float(box.height))
+    return {key: (ref, sizes.get(key, fallback)) for key, ref in images.items()}
+
+
+def _plain(value):
+    """Convert a decode parameter value to plain Python data"""
+    value = value.get_object() if isinstance(value, IndirectObject) else value
+    if isinstance(value, DictionaryObject):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, ArrayObject):
+        return [_plain(item) for item in value]
+    if isinstance(value, NullObject):
+        return None
+    if isinstance(value, BooleanObject):
+        return value.value
+    return value if isinstance(value, (bool, str)) or value is None else int(value)
+
+
+def _pdf(value):
+    """Convert plain decode parameter data back to PDF objects"""
+    if isinstance(value, dict):
+        return DictionaryObject({NameObject(key): _pdf(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return ArrayObject(_pdf(item) for item in value)
+    if value is None:
+        return NullObject()
+    if isinstance(value, bool):
+        return BooleanObject(value)
+    if isinstance(value, str):
+        return NameObject(value)
+    return NumberObject(value)
+
+
+def _decode(data, filters, parms):
+    """Undo the given filters with PyPDF2's decoders"""
+    from PyPDF2.filters import decode_stream_data
+
+    stream = EncodedStreamObject()
+    stream[NameObject('/Filter')] = ArrayObject(NameObject(name) for name in filters)
+    if parms is not None:
+        stream[NameObject('/DecodeParms')] = _pdf(parms)
+    stream._data = data
+    return decode_stream_data(stream)
+
+
+def _describe(image):
+    """Return the picklable description of an image stream, or None if unsupported"""
+    if image.get('/ImageMask') or '/Mask' in image or '/Decode' in image:
+        return None
+    if image.get('/BitsPerComponent') != 8:
+        return None
+    colorspace = image.get('/ColorSpace')
+    if isinstance(colorspace, ArrayObject):
+        if colorspace[0] != '/ICCBased':
+            return None
+        components = colorspace[1].get_object().get('/N')
+    else:
+        components = _COMPONENTS.get(colorspace)
+    if components not in (1, 3):
+        return None
+    filters = image.get('/Filter', [])
+    filters = [filters] if isinstance(filters, str) else [str(name) for name in filters]
+    parms = _plain(image.get('/DecodeParms'))
+    jpeg = bool(filters) and filters[-1] == '/DCTDecode'
+    if jpeg:
+        filters = filters[:-1]
+        if isinstance(parms, list):
+            parms = parms[:-1]
+    if any(name not in _DECODABLE for name in filters):
+        return None
+    return {
+        'jpeg': jpeg,
+        'filters': filters,
+        'parms': parms,
+        'width': int(image['/Width']),
+        'height': int(image['/Height']),
+        'components': components,
+    }
+
+
+def recompress_image(data, info, target, quality, lossless):
+    """Resample and re-encode one image; runs in worker processes
+
+    Returns (data, filter, width, height), or None when the image cannot be
+    decoded or the result would not be smaller than data.
+    """
+    from PIL import Image
+
+    try:
+        raw = _decode(data, info['filters'], info['parms']) if info['filters'] else data
+        mode = 'L' if info['components'] == 1 else 'RGB'
+        if info['jpeg']:
+            image = Image.open(io.BytesIO(raw))
+            # Let the JPEG decoder scale down by a power of two on its own
+            image.draft(mode, target)
+            image = image.convert(mode)
+        else:
+            image = Image.frombytes(mode, (info['width'], info['height']), raw)
+    except Exception:
+        return None
+
+    if image.width > target[0] * RESAMPLE_THRESHOLD and image.height > target[1] * RESAMPLE_THRESHOLD:
+        image = image.resize(target, Image.LANCZOS)
+    if lossless:
+        encoded, filters = zlib.compress(image.tobytes(), 9), '/FlateDecode'
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True)
+        encoded, filters = buffer.getvalue(), '/DCTDecode'
+    if len(encoded) >= len(data):
+        return None
+    return encoded, filters, image.width, image.height
+
+
+class ImageOptimizer:
+    """Recompress images across a process pool, each distinct image only once
+
+    Results are memoized by a hash of the image stream and its target size,
+    so images shared by many pages or inputs are processed a single time;
+    the least recently used results are dropped past max_cache_bytes.
+    With workers=0 images are processed in the calling process.
+    """
+
+    def __init__(self, options, workers=None, max_cache_bytes=DEFAULT_CACHE_BYTES):
+        self.options = options
+        self.workers = options.workers if workers is None else workers
+        self.pool = None
+        # (digest, target) -> (data, filter, width, height) or None
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.max_cache_bytes = max_cache_bytes
+        self.images_optimized = 0
+        self.bytes_saved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _target(self, info, size):
+        """Pixel size an image needs to be shown at size points and target_dpi"""
+        scale = self.options.target_dpi / 72
+        return (
+            min(info['width'], max(1, math.ceil(size[0] * scale))),
+            min(info['height'], max(1, math.ceil(size[1] * scale))),
+        )
+
+    def _run(self, jobs):
+        """Process jobs {key: args}, in the pool when there is more than one"""
+        options = (self.options.quality, self.options.lossless)
+        if self.workers == 0 or len(jobs) < 2:
+            return {key: recompress_image(*args, *options) for key, args in jobs.items()}
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers or os.cpu_count() or 1)
+        futures = {key: self.pool.submit(recompress_image, *args, *options) for key, args in jobs.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _remember(self, cache_key, result):
+        self.cache[cache_key] = result
+        self.cache_bytes += len(result[0]) if result is not None else 0
+        while self.cache_bytes > self.max_cache_bytes and self.cache:
+            _, dropped = self.cache.popitem(last=False)
+            self.cache_bytes -= len(dropped[0]) if dropped is not None else 0
+
+    def optimize(self, images):
+        """Return {key: replacement stream} for {key: (image stream, (width, height))}
+
+        Images that are unsupported or would not shrink are left out.
+        """
+        uses = {}
+        results = {}
+        jobs = {}
+        for key, (image, size) in images.items():
+            info = _describe(image)
+            if info is None:
+                continue
+            data = image._data
+            target = self._target(info, size)
+            digest = hashlib.sha256(data).digest() + repr(sorted(info.items())).encode()
+            cache_key = (digest, target)
+            uses[key] = (image, cache_key)
+            if cache_key in self.cache:
+                self.cache.move_to_end(cache_key)
+                results[cache_key] = self.cache[cache_key]
+            elif cache_key not in jobs:
+                jobs[cache_key] = (data, info, target)
+
+        for cache_key, result in self._run(jobs).items():
+            results[cache_key] = result
+            self._remember(cache_key, result)
+            if result is not None:
+                self.images_optimized += 1
+
+        replacements = {}
+        for key, (image, cache_key) in uses.items():
+            result = results[cache_key]
+            if result is None:
+                continue
+            data, filters, width, height = result
+            replacement = EncodedStreamObject()
+            for name, value in image.items():
+                if name not in ('/Filter', '/DecodeParms', '/Length'):
+                    replacement[NameObject(name)] = value
+            replacement[NameObject('/Filter')] = NameObject(filters)
+            replacement[NameObject('/Width')] = NumberObject(width)
+            replacement[NameObject('/Height')] = NumberObject(height)
+            replacement._data = data
+            replacements[key] = replacement
+            self.bytes_saved += len(image._data) - len(data)
+        return replacements
+
+    def optimize_pages(self, pages):
+        """Return {(generation, idnum): replacement stream} for images on pages"""
+        images = {}
+        for page in pages:
+            for key, (reference, size) in page_images(page).items():
+                if key in images:
+                    old = images[key][1]
+                    size = (max(old[0], size[0]), max(old[1], size[1]))
+                images[key] = (reference.get_object(), size)
+        return self.optimize(images)
+
+    def optimize_writer(self, writer):
+        """Replace the images of a PyPDF2 PdfWriter in place"""
+        for (_, idnum), replacement in self.optimize_pages(writer.pages).items():
+            writer._objects[idnum - 1] = replacement
+
+
+# Inline optimizers of merge worker processes, by options, so images shared
+# by the inputs a worker handles are processed once; the least recently used
+# option sets are dropped past MAX_WORKER_OPTIMIZERS
+_worker_optimizers = OrderedDict()
+
+
+def worker_optimizer(options):
+    """Return the in-process ImageOptimizer of a worker for options"""
+    key = tuple(sorted(options.to_dict().items()))
+    if key in _worker_optimizers:
+        _worker_optimizers.move_to_end(key)
+    else:
+        _worker_optimizers[key] = ImageOptimizer(options, workers=0)
+        while len(_worker_optimizers) > MAX_WORKER_OPTIMIZERS:
+            _worker_optimizers.popitem(last=False)
+    return _worker_optimizers[key]
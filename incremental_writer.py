@@ -0,0 +1,133 @@
+"""Save PDF changes as an incremental update appended to the original file"""
+import io
+import os
+import re
+import shutil
+
+from PyPDF2.generic import (
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+)
+
+from input_source import memory_file, open_input
+from pdf_optimizer import compress_stream
+
+
+class IncrementalUpdateError(Exception):
+    """Raised when a file cannot be updated incrementally"""
+
+
+def find_startxref(path):
+    """Return the offset of the last cross-reference section of a PDF"""
+    with open_input(path) as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 1024))
+        tail = f.read()
+    matches = re.findall(rb'startxref\s+(\d+)', tail)
+    if not matches:
+        raise IncrementalUpdateError("startxref not found")
+    return int(matches[-1])
+
+
+class IncrementalWriter:
+    """Collect changed and new objects for a reader and append them to its file
+
+    Changed objects keep their number and generation; new objects are
+    numbered from the original trailer's /Size. Only those objects and a new
+    xref section are written, so the cost depends on the size of the change
+    rather than the size of the document.
+    """
+
+    def __init__(self, reader, path, compress=False):
+        self.reader = reader
+        self.path = path
+        # Deflate unfiltered streams before they are written
+        self.compress = compress
+        if reader.is_encrypted:
+            raise IncrementalUpdateError("Encrypted files are rewritten in full")
+        self.startxref = find_startxref(path)
+        with open_input(path) as f:
+            f.seek(self.startxref)
+            if not f.read(4) == b'xref':
+                # Files indexed by xref streams need a stream-based update
+                raise IncrementalUpdateError("Cross-reference streams are not supported")
+        self.next_number = reader.trailer['/Size']
+        # (number, generation) -> object to write
+        self.objects = {}
+
+    def update_object(self, reference, obj):
+        """Replace the object behind reference (from the original reader)"""
+        self.objects[(reference.idnum, reference.generation)] = obj
+
+    def add_object(self, obj):
+        """Add a new object and return a reference to it"""
+        number = self.next_number
+        self.next_number += 1
+        self.objects[(number, 0)] = obj
+        return IndirectObject(number, 0, None)
+
+    def _trailer(self, size):
+        trailer = DictionaryObject()
+        trailer[NameObject('/Size')] = NumberObject(size)
+        for key in ('/Root', '/Info', '/ID'):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+        trailer[NameObject('/Prev')] = NumberObject(self.startxref)
+        return trailer
+
+    def write_update(self, stream):
+        """Append the update to a stream positioned at the end of the original file"""
+        start = stream.tell()
+        buffer = io.BytesIO()
+        buffer.write(b'\n')
+        offsets = {}
+        for (number, generation), obj in sorted(self.objects.items()):
+            if self.compress:
+                obj = compress_stream(obj)
+            offsets[number] = (start + buffer.tell(), generation)
+            buffer.write(f'{number} {generation} obj\n'.encode())
+            obj.write_to_stream(buffer, None)
+            buffer.write(b'\nendobj\n')
+
+        xref_position = start + buffer.tell()
+        buffer.write(b'xref\n')
+        numbers = sorted(offsets)
+        # One subsection per run of consecutive object numbers
+        run_start = 0
+        for i in range(1, len(numbers) + 1):
+            if i == len(numbers) or numbers[i] != numbers[i - 1] + 1:
+                run = numbers[run_start:i]
+                buffer.write(f'{run[0]} {len(run)}\n'.encode())
+                for number in run:
+                    offset, generation = offsets[number]
+                    buffer.write(f'{offset:010} {generation:05} n \n'.encode())
+                run_start = i
+        buffer.write(b'trailer\n')
+        self._trailer(max(self.next_number, numbers[-1] + 1)).write_to_stream(buffer, None)
+        buffer.write(f'\nstartxref\n{xref_position}\n%%EOF\n'.encode())
+        stream.write(buffer.getvalue())
+
+    def save(self, output):
+        """Write the original file plus the update to output (a path or stream)
+
+        If output is the original file on disk the update is appended in
+        place. The original is read through input_source, so files held in
+        a memory pool are copied from memory.
+        """
+        if not self.objects:
+            raise IncrementalUpdateError("Nothing to update")
+        if hasattr(output, 'write'):
+            with open_input(self.path) as f:
+                shutil.copyfileobj(f, output)
+            self.write_update(output)
+            return
+        if os.path.abspath(output) == os.path.abspath(self.path) and memory_file(self.path) is None:
+            with open(output, 'ab') as f:
+                self.write_update(f)
+            return
+        with open_input(self.path) as original, open(output, 'wb') as f:
+            shutil.copyfileobj(original, f)
+            self.write_update(f)
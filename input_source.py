@@ -0,0 +1,73 @@
+"""Memory-mapped reading of input PDFs"""
+import hashlib
+import io
+import mmap
+import os
+
+# memory_pool.MemoryPool instances whose files are read in place of the
+# files at the same paths
+memory_pools = []
+
+
+def memory_file(path):
+    """Return the bytes of path if a registered memory pool holds it, else None"""
+    for pool in memory_pools:
+        data = pool.get(path)
+        if data is not None:
+            return data
+    return None
+
+
+def input_exists(path):
+    """Check whether path can be opened, from memory or from disk"""
+    return memory_file(path) is not None or os.path.exists(path)
+
+
+def input_size(path):
+    """Return the size of path in bytes; raises OSError if it does not exist"""
+    data = memory_file(path)
+    if data is not None:
+        return len(data)
+    return os.path.getsize(path)
+
+
+def open_input(path):
+    """Open a file for reading, memory-mapped when possible
+
+    Returns a seekable binary stream (an mmap or, as a fallback, the file
+    object) that works as a context manager. Reads from a mapping come
+    straight from the page cache, without a read buffer or a system call
+    per seek, so a reader that only resolves the objects it needs never
+    touches the rest of the file. Empty files, pipes and file systems
+    that do not support mapping fall back to a plain file object.
+
+    Files held by a registered memory pool are read from memory instead.
+    """
+    data = memory_file(path)
+    if data is not None:
+        return io.BytesIO(data)
+    f = open(path, 'rb')
+    try:
+        stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return f
+    # The mapping keeps its own handle on the file
+    f.close()
+    return stream
+
+
+def is_mapped(stream):
+    return isinstance(stream, mmap.mmap)
+
+
+def stream_sha256(stream, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of an open input stream
+
+    Mapped files are hashed in place, without copying them into chunks.
+    """
+    if is_mapped(stream):
+        return hashlib.sha256(stream).hexdigest()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,162 @@
+"""In-process background job queue used by the web app"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# States a job never leaves
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Defaults for the web app's merge queue
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 100
+# Number of finished jobs kept around for status queries
+DEFAULT_KEEP_FINISHED = 1000
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a full queue"""
+
+
+class Job:
+    """A unit of background work and its status"""
+
+    def __init__(self, target):
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Set by the target while running (e.g. a merge_engine MergeProgress)
+        self.progress = None
+        # Value returned by the target on success
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        # Set by the target while running to stop its work (e.g. MergeJob.cancel)
+        self.on_cancel = None
+
+    @property
+    def elapsed(self):
+        """Seconds spent running so far (0 while still queued)"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def done(self):
+        return self.state in FINISHED
+
+    def cancel(self):
+        """Cancel the job: a queued job never runs, a running one is asked to stop
+
+        Returns False if the job had already finished.
+        """
+        if self.done:
+            return False
+        self.cancel_requested = True
+        on_cancel = self.on_cancel
+        if on_cancel is not None:
+            on_cancel()
+        return True
+
+    def to_dict(self):
+        """Describe the job for status queries"""
+        info = {
+            'job_id': self.id,
+            'state': self.state,
+            'elapsed': round(self.elapsed, 3),
+        }
+        if self.progress is not None:
+            info.update(self.progress.to_dict())
+        if self.state == DONE and self.result is not None:
+            info['result'] = self.result
+        if self.state == FAILED:
+            info['error'] = self.error
+        return info
+
+
+class JobQueue:
+    """Run jobs on a fixed pool of worker threads
+
+    target callables receive their Job and return a JSON-serializable
+    result; an exception marks the job as failed with its message.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED,
+                 keep_finished=DEFAULT_KEEP_FINISHED):
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        """Start the worker threads (called lazily on first submit)"""
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, target):
+        """Queue target for execution and return its Job"""
+        self.start()
+        job = Job(target)
+        with self.lock:
+            self.jobs[job.id] = job
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job.id]
+            raise QueueFull("Too many jobs are waiting; try again later")
+        return job
+
+    def get(self, job_id):
+        """Return the job with job_id, or None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.done]
+            for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            if job.cancel_requested:
+                job.state = CANCELLED
+                job.finished = time.time()
+                self.pending.task_done()
+                self._forget_old_jobs()
+                continue
+            job.state = RUNNING
+            job.started = time.time()
+            try:
+                job.result = job.target(job)
+                job.state = DONE
+            except Exception as e:
+                if job.cancel_requested:
+                    job.state = CANCELLED
+                else:
+                    job.error = str(e)
+                    job.state = FAILED
+            finally:
+                job.finished = time.time()
+                self.pending.task_done()
+            self._forget_old_jobs()
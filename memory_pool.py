@@ -0,0 +1,104 @@
+"""Size-capped in-memory storage for small files that spills to disk"""
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# Default total size of the files kept in memory
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Default size above which a file always goes to disk
+DEFAULT_SPILL_BYTES = 16 * 1024 * 1024
+
+
+class MemoryPool:
+    """Keep the bytes of small files in memory in place of files on disk
+
+    Entries are keyed by the path the file would have on disk. Once the
+    pool is registered with input_source, every reader that opens that
+    path gets the bytes from memory. When the pool grows past max_bytes,
+    the least recently used files are written to their paths and dropped
+    (spilled). Files larger than spill_bytes are never kept. Stored bytes
+    are immutable, so BytesIO readers share them without copying.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_bytes=DEFAULT_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_bytes = min(spill_bytes, max_bytes)
+        self.files = OrderedDict()
+        self.total = 0
+        self.spilled = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, path):
+        with self.lock:
+            return os.path.abspath(path) in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def accepts(self, size):
+        return size <= self.spill_bytes
+
+    def get(self, path):
+        """Return the bytes of path, or None if it is not in memory"""
+        key = os.path.abspath(path)
+        with self.lock:
+            data = self.files.get(key)
+            if data is not None:
+                self.files.move_to_end(key)
+            return data
+
+    def put(self, path, data):
+        """Keep data as the contents of path
+
+        Returns False, keeping nothing, if data is larger than spill_bytes;
+        the caller then writes it to disk itself.
+        """
+        data = bytes(data)
+        if not self.accepts(len(data)):
+            return False
+        key = os.path.abspath(path)
+        with self.lock:
+            old = self.files.pop(key, None)
+            if old is not None:
+                self.total -= len(old)
+            self.files[key] = data
+            self.total += len(data)
+        self._spill_over()
+        return True
+
+    def _spill_over(self):
+        while True:
+            with self.lock:
+                if self.total <= self.max_bytes or not self.files:
+                    return
+                key, data = next(iter(self.files.items()))
+            # Written before it is dropped, so readers always find the file
+            self._write(key, data)
+            with self.lock:
+                if self.files.get(key) is data:
+                    del self.files[key]
+                    self.total -= len(data)
+                    self.spilled += 1
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def discard(self, path):
+        """Drop path from memory without writing it; returns True if it was there"""
+        with self.lock:
+            data = self.files.pop(os.path.abspath(path), None)
+            if data is None:
+                return False
+            self.total -= len(data)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.files = OrderedDict()
+            self.total = 0
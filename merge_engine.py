@@ -0,0 +1,631 @@
+"""Shared PDF merge engine used by the GUI, CLI and web front ends"""
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+import PyPDF2
+
+from dedupe import dedupe_writer
+from image_optimizer import ImageOptimizer, ImageOptions, worker_optimizer
+from input_source import input_size, open_input
+from page_index import PageIndex
+from page_ranges import parse_ranges, resolve_ranges, select_pages, split_spec
+from pdf_optimizer import DEFAULT_LEVEL, LEVELS, check_level, compresses, write_pdf
+from stamper import Stamp
+from stream_writer import DEFAULT_MEMORY_LIMIT, OutputError, StreamingPdfWriter, build_fragment
+
+
+class MergeSource:
+    """A single input file for a merge job"""
+
+    def __init__(self, path, name=None, pages=None):
+        self.path = path
+        # Name used when reporting errors (defaults to the path itself)
+        self.name = name if name is not None else path
+        # Pages to take from this file: None for all pages, zero-based
+        # indices or a page_ranges spec such as "1-3,10,-1"
+        if isinstance(pages, str):
+            parse_ranges(pages)
+        self.pages = pages
+
+    @classmethod
+    def from_value(cls, value):
+        """Build a source from a path, a "path:ranges" spec or an existing MergeSource"""
+        if isinstance(value, MergeSource):
+            return value
+        path, spec = split_spec(value)
+        return cls(path, name=value, pages=spec)
+
+    @contextmanager
+    def open(self):
+        """Open the source file for reading"""
+        with open_input(self.path) as f:
+            yield f
+
+    def select_pages(self, reader):
+        """Return the pages of reader selected by this source"""
+        return select_pages(reader, self.pages)
+
+    def size(self):
+        """Return the size of the source file in bytes (0 if it cannot be read)"""
+        try:
+            return input_size(self.path)
+        except OSError:
+            return 0
+
+    def page_indices(self, reader):
+        """Return the zero-based indices selected by this source, or None for all"""
+        if isinstance(self.pages, str):
+            return resolve_ranges(self.pages, len(PageIndex(reader)))
+        return self.pages
+
+
+class MergeResult:
+    """Outcome of a merge job"""
+
+    def __init__(self, output):
+        self.output = output
+        self.total_pages = 0
+        self.error_files = []
+        self.written = False
+        # Identical objects written only once, and the bytes that saved
+        self.objects_deduplicated = 0
+        self.bytes_saved = 0
+        # Images downsampled or recompressed, and the bytes that saved
+        self.images_optimized = 0
+        self.image_bytes_saved = 0
+        # Set when the job was cancelled; nothing is written then
+        self.cancelled = False
+
+
+class MergeCancelled(Exception):
+    """Raised by MergeJob.run when the job is cancelled"""
+
+
+# Minimum seconds between progress callbacks while pages are copied
+PROGRESS_INTERVAL = 0.1
+# Bytes of output written between cancellation checks
+CANCEL_CHECK_BYTES = 1024 * 1024
+
+
+class MergeProgress:
+    """Running counters of a merge job, safe to read from other threads
+
+    Progress is measured in input bytes: finished sources count with their
+    file size and the source being copied with the share of its pages done,
+    so the estimate moves smoothly even through one very large file.
+    """
+
+    def __init__(self, total_files, total_bytes=0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.pages_copied = 0
+        self.bytes_written = 0
+        # Input bytes of finished sources and of the source in progress
+        self.bytes_read = 0
+        self.current_bytes = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def fraction(self):
+        """Share of the job done, from 0.0 to 1.0"""
+        if self.total_bytes:
+            return min(1.0, (self.bytes_read + self.current_bytes) / self.total_bytes)
+        return self.files_done / self.total_files if self.total_files else 1.0
+
+    @property
+    def eta(self):
+        """Estimated seconds left, or None until there is something to go by"""
+        fraction = self.fraction
+        if not fraction:
+            return None
+        return self.elapsed * (1 - fraction) / fraction
+
+    def to_dict(self):
+        eta = self.eta
+        return {
+            'files_done': self.files_done,
+            'total_files': self.total_files,
+            'pages_processed': self.pages_copied,
+            'bytes_written': self.bytes_written,
+            'fraction': round(self.fraction, 4),
+            'eta': None if eta is None else round(eta, 1),
+        }
+
+
+class _TrackedPages:
+    """Pages of one source that report progress and honour cancellation as they are read"""
+
+    def __init__(self, job, source, pages):
+        self.job = job
+        self.pages = pages
+        self.size = source.size()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        total = len(self.pages)
+        progress = self.job.progress
+        for done, page in enumerate(self.pages):
+            self.job.check_cancelled()
+            if total:
+                # Several passes (e.g. image optimization) never move it back
+                progress.current_bytes = max(progress.current_bytes, self.size * done // total)
+                self.job._notify(force=False)
+            yield page
+        self.job.check_cancelled()
+
+
+class _TrackedIndices(list):
+    """Page numbers for PdfWriter.append, which only takes a list, read through job.track"""
+
+    def __init__(self, tracked):
+        super().__init__(tracked.pages)
+        self.tracked = tracked
+
+    def __iter__(self):
+        return iter(self.tracked)
+
+
+class _CountingStream:
+    """Wrap a writable stream, count the bytes written to it and honour cancellation"""
+
+    def __init__(self, stream, job):
+        self.stream = stream
+        self.job = job
+        self.unchecked = 0
+
+    def write(self, data):
+        self.unchecked += len(data)
+        if self.unchecked >= CANCEL_CHECK_BYTES:
+            self.unchecked = 0
+            self.job.check_cancelled()
+        written = self.stream.write(data)
+        self.job.progress.bytes_written += len(data)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class PageCopyStrategy:
+    """Copy pages one at a time into a single in-memory writer"""
+
+    name = "pages"
+    options = ("dedupe",)
+
+    def __init__(self, dedupe=True):
+        self.dedupe = dedupe
+
+    def write(self, job, result, writer):
+        """Optimize images, stamp, deduplicate and write out the collected pages"""
+        if job.images is not None:
+            with ImageOptimizer(job.images) as images:
+                images.optimize_writer(writer)
+            result.images_optimized = images.images_optimized
+            result.image_bytes_saved = images.bytes_saved
+        if job.stamp is not None:
+            job.stamp.stamp_writer(writer)
+        if self.dedupe:
+            result.objects_deduplicated, result.bytes_saved = dedupe_writer(writer)
+        with job.open_output() as f:
+            write_pdf(writer, f, job.optimize)
+        result.written = True
+
+    def merge(self, job, result):
+        writer = PyPDF2.PdfWriter()
+
+        for source in job.sources:
+            try:
+                with source.open() as f:
+                    reader = PyPDF2.PdfReader(f)
+                    pages = job.track(source, source.select_pages(reader))
+                    for page in pages:
+                        writer.add_page(page)
+                    job.record_pages(len(pages))
+            except MergeCancelled:
+                raise
+            except Exception as e:
+                job.record_error(source, e)
+
+        job.check_cancelled()
+        if job.should_write(result):
+            self.write(job, result, writer)
+
+
+class AppendStrategy(PageCopyStrategy):
+    """Append whole documents, keeping outlines and named destinations"""
+
+    name = "append"
+
+    def merge(self, job, result):
+        writer = PyPDF2.PdfWriter()
+
+        for source in job.sources:
+            try:
+                with source.open() as f:
+                    reader = PyPDF2.PdfReader(f)
+                    page_count = len(writer.pages)
+                    indices = source.page_indices(reader)
+                    if indices is None:
+                        indices = range(len(PageIndex(reader)))
+                    pages = job.track(source, indices)
+                    writer.append(reader, pages=_TrackedIndices(pages))
+                    job.record_pages(len(writer.pages) - page_count)
+            except MergeCancelled:
+                raise
+            except Exception as e:
+                job.record_error(source, e)
+
+        job.check_cancelled()
+        if job.should_write(result):
+            self.write(job, result, writer)
+
+
+class StreamingStrategy:
+    """Write each source to the output as soon as it is read
+
+    Peak memory is bounded by the largest single source (and by
+    memory_limit for the write buffer) instead of the whole job.
+    """
+
+    name = "stream"
+    options = ("memory_limit", "dedupe")
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, dedupe=True):
+        self.memory_limit = memory_limit
+        self.dedupe = dedupe
+
+    def image_optimizer(self, job, stack):
+        """Return the ImageOptimizer the writer runs on each source, if any"""
+        if job.images is None:
+            return None
+        return stack.enter_context(ImageOptimizer(job.images))
+
+    def open_writer(self, job, stack):
+        """Open the output and create the streaming writer"""
+        sink = stack.enter_context(job.open_output())
+        return StreamingPdfWriter(
+            sink, memory_limit=self.memory_limit, stamp=job.stamp, dedupe=self.dedupe,
+            optimize=job.optimize, images=self.image_optimizer(job, stack)
+        )
+
+    def finish(self, job, result, writer):
+        """Mark the result written, or drop output that must not be kept"""
+        if writer is None:
+            return
+        result.objects_deduplicated = writer.objects_deduplicated
+        result.bytes_saved = writer.bytes_saved
+        if writer.images is not None:
+            result.images_optimized = writer.images.images_optimized
+            result.image_bytes_saved = writer.images.bytes_saved
+        # Output that strict mode rejected is dropped by MergeJob.run()
+        if job.should_write(result):
+            result.written = True
+
+    def merge(self, job, result):
+        with ExitStack() as stack:
+            writer = None
+
+            for source in job.sources:
+                try:
+                    with source.open() as f:
+                        reader = PyPDF2.PdfReader(f)
+                        pages = job.track(source, source.select_pages(reader))
+                        # Open the output only once there is something to write
+                        if writer is None:
+                            writer = self.open_writer(job, stack)
+                        job.record_pages(writer.add_pages(reader, pages))
+                except (OutputError, MergeCancelled):
+                    raise
+                except Exception as e:
+                    job.record_error(source, e)
+                finally:
+                    # Release the reader before the next source is opened
+                    reader = None
+
+            if writer is not None:
+                writer.close()
+
+        self.finish(job, result, writer)
+
+
+def parse_source(source, memory_limit=DEFAULT_MEMORY_LIMIT, stamp=None, compress=False, images=None):
+    """Parse a source and serialize its selected pages into a fragment
+
+    Runs in worker processes, so it returns (fragment, error) instead of
+    raising. Stamped pages only refer to placeholders; the writer fills in
+    Bates numbers once the pages' final positions are known. Streams and
+    images (with images, an ImageOptions) are compressed here so the work
+    is spread across the pool.
+    """
+    try:
+        with source.open() as f:
+            reader = PyPDF2.PdfReader(f)
+            pages = source.select_pages(reader)
+            replacements = None
+            if images is not None:
+                optimizer = worker_optimizer(images)
+                optimized, saved = optimizer.images_optimized, optimizer.bytes_saved
+                replacements = optimizer.optimize_pages(pages)
+            fragment = build_fragment(reader, pages, memory_limit, stamp, compress, replacements)
+            if images is not None:
+                fragment.images_optimized = optimizer.images_optimized - optimized
+                fragment.image_bytes_saved = optimizer.bytes_saved - saved
+            return fragment, None
+    except Exception as e:
+        return None, str(e)
+
+
+class ParallelStrategy(StreamingStrategy):
+    """Parse and serialize sources across a process pool
+
+    Workers turn each source into a locally numbered fragment; the single
+    writer renumbers and appends fragments in the user-specified order.
+    """
+
+    name = "parallel"
+    options = ("memory_limit", "workers", "dedupe")
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, workers=None, dedupe=True):
+        super().__init__(memory_limit=memory_limit, dedupe=dedupe)
+        self.workers = workers or os.cpu_count() or 1
+
+    def image_optimizer(self, job, stack):
+        # Images are optimized by the workers along with their source
+        return None
+
+    def merge(self, job, result):
+        with ExitStack() as stack:
+            writer = None
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=self.workers))
+            sources = iter(job.sources)
+            window = deque()
+
+            def submit(source):
+                window.append((source, pool.submit(
+                    parse_source, source, self.memory_limit, job.stamp, compresses(job.optimize),
+                    job.images
+                )))
+
+            # Keep only a few fragments in flight to bound memory
+            for source in islice(sources, self.workers * 2):
+                submit(source)
+
+            try:
+                while window:
+                    job.check_cancelled()
+                    source, future = window.popleft()
+                    next_source = next(sources, None)
+                    if next_source is not None:
+                        submit(next_source)
+
+                    try:
+                        fragment, error = future.result()
+                    except Exception as e:
+                        fragment, error = None, str(e)
+
+                    if error is not None:
+                        job.record_error(source, error)
+                        continue
+                    if writer is None:
+                        writer = self.open_writer(job, stack)
+                    result.images_optimized += fragment.images_optimized
+                    result.image_bytes_saved += fragment.image_bytes_saved
+                    job.record_pages(writer.add_fragment(fragment))
+
+                if writer is not None:
+                    writer.close()
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+        self.finish(job, result, writer)
+
+
+# Registered merge strategies, keyed by name
+STRATEGIES = {
+    PageCopyStrategy.name: PageCopyStrategy,
+    AppendStrategy.name: AppendStrategy,
+    StreamingStrategy.name: StreamingStrategy,
+    ParallelStrategy.name: ParallelStrategy,
+}
+
+DEFAULT_STRATEGY = PageCopyStrategy.name
+
+
+def register_strategy(strategy_class):
+    """Register a merge strategy class under its name"""
+    STRATEGIES[strategy_class.name] = strategy_class
+    return strategy_class
+
+
+class MergeJob:
+    """A merge of several sources into one output file or stream"""
+
+    def __init__(self, sources, output, strategy=DEFAULT_STRATEGY, strict=False,
+                 on_progress=None, stamp=None, optimize=DEFAULT_LEVEL, images=None,
+                 cancel_event=None, **options):
+        self.sources = [MergeSource.from_value(source) for source in sources]
+        # Output is either a file path or a writable binary file object
+        self.output = output
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown merge strategy: {strategy}")
+        self.strategy = strategy
+        # In strict mode nothing is written if any source fails
+        self.strict = strict
+        # Extra keyword options passed to the strategy (e.g. memory_limit)
+        self.options = options
+        # Called with the MergeProgress after every source, and while pages
+        # are copied at most every PROGRESS_INTERVAL seconds
+        self.on_progress = on_progress
+        # Optional stamper.Stamp applied to every output page
+        self.stamp = stamp
+        # pdf_optimizer level used when writing the output
+        self.optimize = check_level(optimize)
+        # Optional image_optimizer.ImageOptions for downsampling images
+        self.images = images
+        self.result = MergeResult(output)
+        self.sizes = [source.size() for source in self.sources]
+        self.progress = MergeProgress(len(self.sources), sum(self.sizes))
+        # Set to cancel the job; another process can pass a shared event
+        self._cancel = cancel_event if cancel_event is not None else threading.Event()
+        self._notified = 0.0
+        # Temporary file the output path is written to, once created
+        self.temp_output = None
+
+    def _notify(self, force=True):
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        if force or now - self._notified >= PROGRESS_INTERVAL:
+            self._notified = now
+            self.on_progress(self.progress)
+
+    def cancel(self):
+        """Ask the job to stop; safe to call from any thread
+
+        The running merge stops at the next page or source, closes its
+        readers and removes the partial output, and run() raises
+        MergeCancelled.
+        """
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Raise MergeCancelled if the job was cancelled"""
+        if self._cancel.is_set():
+            raise MergeCancelled("Merge cancelled")
+
+    def track(self, source, pages):
+        """Wrap the selected pages of source to report progress while they are copied"""
+        return _TrackedPages(self, source, pages)
+
+    def _source_done(self):
+        # Every strategy finishes its sources in order
+        progress = self.progress
+        progress.bytes_read += self.sizes[progress.files_done]
+        progress.current_bytes = 0
+        progress.files_done += 1
+        self._notify()
+
+    def record_pages(self, count):
+        """Record a source whose pages were copied"""
+        self.result.total_pages += count
+        self.progress.pages_copied += count
+        self._source_done()
+
+    def record_error(self, source, error):
+        """Record a source that could not be merged"""
+        self.result.error_files.append((source.name, str(error)))
+        self._source_done()
+
+    def should_write(self, result):
+        """Check whether the collected pages should be written out"""
+        if not result.error_files:
+            return True
+        if self.strict:
+            return False
+        # Skip writing when every source failed
+        return len(result.error_files) < len(self.sources)
+
+    @contextmanager
+    def open_output(self):
+        """Open the output sink for writing
+
+        A path is written through a uniquely named temporary file beside it
+        that run() moves into place once the output is complete, so the
+        output may also be one of the sources, and concurrent jobs writing
+        the same path never share a file.
+        """
+        if hasattr(self.output, 'write'):
+            yield _CountingStream(self.output, self)
+        else:
+            temp_output = f'{self.output}.{uuid.uuid4().hex}.tmp'
+            with open(temp_output, 'xb') as f:
+                self.temp_output = temp_output
+                yield _CountingStream(f, self)
+
+    def run(self):
+        """Run the merge and return its result
+
+        Per-file errors are collected in result.error_files; errors raised
+        while writing the output propagate to the caller. An output path is
+        only replaced when the result is written; a cancelled job leaves it
+        untouched and raises MergeCancelled.
+        """
+        self.result = MergeResult(self.output)
+        self.progress.started = time.monotonic()
+        self.temp_output = None
+        try:
+            self.check_cancelled()
+            STRATEGIES[self.strategy](**self.options).merge(self, self.result)
+            if self.temp_output is not None and self.result.written:
+                os.replace(self.temp_output, self.output)
+        except MergeCancelled:
+            self.result.cancelled = True
+            self.result.written = False
+            raise
+        finally:
+            if self.temp_output is not None:
+                try:
+                    os.remove(self.temp_output)
+                except OSError:
+                    pass
+        return self.result
+
+
+def merge(sources, output, strategy=DEFAULT_STRATEGY, strict=False, **options):
+    """Merge sources into output and return a MergeResult"""
+    return MergeJob(sources, output, strategy=strategy, strict=strict, **options).run()
+
+
+def options_from_config(config):
+    """Read the merge strategy and its options from a front end config
+
+    Uses the optional keys merge_strategy, merge_memory_limit, merge_workers
+    and merge_dedupe; options the chosen strategy does not take are ignored.
+    merge_stamp holds watermark / Bates numbering fields (see stamper.Stamp),
+    merge_optimize the output optimization level (see pdf_optimizer) and
+    merge_images image downsampling settings (see image_optimizer.ImageOptions).
+    """
+    strategy = config.get("merge_strategy", DEFAULT_STRATEGY)
+    if strategy not in STRATEGIES:
+        strategy = DEFAULT_STRATEGY
+    options = {"strategy": strategy}
+    for option in STRATEGIES[strategy].options:
+        if f"merge_{option}" in config:
+            options[option] = config[f"merge_{option}"]
+    stamp = Stamp.from_dict(config.get("merge_stamp"))
+    if stamp is not None:
+        options["stamp"] = stamp
+    if config.get("merge_optimize") in LEVELS:
+        options["optimize"] = config["merge_optimize"]
+    images = ImageOptions.from_dict(config.get("merge_images"))
+    if images is not None:
+        options["images"] = images
+    return options
+
+
+def format_errors(error_files, limit=3, header="Errors occurred with the following files:\n\n"):
+    """Build a user-facing summary of per-file merge errors"""
+    message = header
+    for name, error in error_files[:limit]:
+        message += f"{os.path.basename(name)}: {error}\n"
+    if len(error_files) > limit:
+        message += f"\n... and {len(error_files) - limit} more files."
+    return message
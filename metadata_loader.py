@@ -0,0 +1,125 @@
+"""Read PDF metadata in worker processes and hand it to a GUI event loop"""
+import multiprocessing
+import os
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from pdf_metadata import load_entry
+
+# Milliseconds between checks for finished files
+POLL_INTERVAL = 50
+
+# Results handed to the event loop per check, so a burst of finished files
+# never blocks it for long
+BATCH_SIZE = 200
+
+
+class MetadataLoader:
+    """Look up metadata for many files without blocking the event loop
+
+    schedule(delay_ms, callback) must run callback later on the event loop
+    (Tk's root.after); every callback below runs there. Files in the cache
+    are answered from it and the others are read in a process pool, so
+    large files are parsed in parallel and never hold the GUI thread.
+    on_results({path: metadata}) receives results in batches as they
+    arrive, and on_idle() is called once nothing is pending.
+    """
+
+    def __init__(self, cache, schedule, on_results, on_idle=None, workers=None):
+        self.cache = cache
+        self.schedule = schedule
+        self.on_results = on_results
+        self.on_idle = on_idle
+        # Leave a core for the GUI by default
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.pool = None
+        # path -> token of the lookup in progress: the worker's Future, or
+        # a plain object for cache hits. Results whose token is no longer
+        # here were cancelled and are dropped.
+        self.pending = {}
+        # (path, token, signature, metadata) filled by pool threads
+        self.results = queue.Queue()
+        self.polling = False
+
+    def _pool(self):
+        if self.pool is None:
+            # Workers are spawned so they never inherit the GUI's state
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.pool
+
+    def request(self, paths):
+        """Start loading paths that are not already being loaded"""
+        for path in paths:
+            if path in self.pending:
+                continue
+            metadata = self.cache.lookup(path)
+            if metadata is not None:
+                token = object()
+                self.pending[path] = token
+                self.results.put((path, token, None, metadata))
+                continue
+            future = self._pool().submit(load_entry, path)
+            self.pending[path] = future
+            future.add_done_callback(lambda future, path=path: self._finished(path, future))
+        self._poll_later(0)
+
+    def _finished(self, path, future):
+        # Runs on a pool thread; only the queue is touched here
+        if future.cancelled():
+            return
+        try:
+            signature, metadata = future.result()
+        except Exception as e:
+            signature, metadata = None, {'page_count': 0, 'error': str(e)}
+        self.results.put((path, future, signature, metadata))
+
+    def cancel(self, paths=None):
+        """Stop loading paths (all pending paths if None); their results are dropped"""
+        for path in list(self.pending) if paths is None else paths:
+            token = self.pending.pop(path, None)
+            if isinstance(token, Future):
+                token.cancel()
+
+    def retain(self, paths):
+        """Cancel every pending path that is not in paths"""
+        paths = set(paths)
+        self.cancel([path for path in self.pending if path not in paths])
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def _poll_later(self, delay):
+        if not self.polling:
+            self.polling = True
+            self.schedule(delay, self._poll)
+
+    def _poll(self):
+        self.polling = False
+        batch = {}
+        while len(batch) < BATCH_SIZE:
+            try:
+                path, token, signature, metadata = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.pending.get(path) is not token:
+                continue
+            del self.pending[path]
+            if signature is not None:
+                self.cache.store(path, metadata, signature)
+            batch[path] = metadata
+        if batch:
+            self.on_results(batch)
+        if self.pending:
+            self._poll_later(0 if not self.results.empty() else POLL_INTERVAL)
+        elif self.on_idle is not None:
+            self.on_idle()
+
+    def close(self):
+        """Cancel pending work and stop the worker processes"""
+        self.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
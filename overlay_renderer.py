@@ -0,0 +1,130 @@
+"""Render text overlays once and reuse them across pages and documents"""
+import io
+import threading
+from collections import OrderedDict
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+)
+
+# Default number of rendered overlays kept in memory
+DEFAULT_MAX_OVERLAYS = 256
+
+
+def _inline(obj):
+    """Return a copy of obj with every indirect reference resolved in place"""
+    if isinstance(obj, IndirectObject):
+        return _inline(obj.get_object())
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        for key, value in obj.items():
+            copy[NameObject(key)] = _inline(value)
+        return copy
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_inline(value) for value in obj)
+    return obj
+
+
+class Overlay:
+    """A rendered overlay that does not depend on any reader
+
+    Holds the compiled content stream and its (inlined) resources, so the
+    same overlay can be stamped into any number of documents and threads.
+    """
+
+    def __init__(self, data, filters, resources, box):
+        self.data = data
+        self.filters = filters
+        self.resources = resources
+        self.box = box
+
+    def form_xobject(self):
+        """Return a new form XObject stream that draws the overlay"""
+        form = EncodedStreamObject() if self.filters is not None else DecodedStreamObject()
+        form._data = self.data
+        if self.filters is not None:
+            form[NameObject('/Filter')] = self.filters
+        form[NameObject('/Type')] = NameObject('/XObject')
+        form[NameObject('/Subtype')] = NameObject('/Form')
+        form[NameObject('/BBox')] = ArrayObject(FloatObject(v) for v in self.box)
+        form[NameObject('/Resources')] = self.resources
+        return form
+
+
+class OverlayRenderer:
+    """LRU cache of text overlays keyed by (text, font, size, position, page box)"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_OVERLAYS):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def check(text, x, y, font, size):
+        """Raise ValueError if render() could not draw text with these options"""
+        from reportlab.pdfbase import pdfmetrics
+
+        if not isinstance(text, str):
+            raise ValueError("Text must be a string")
+        for name, value in (('x', x), ('y', y), ('size', size)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{name} must be a number")
+        if size <= 0:
+            raise ValueError("size must be positive")
+        try:
+            pdfmetrics.getFont(font)
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown font: {font}")
+
+    @staticmethod
+    def _render(text, x, y, box, font, size):
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        overlay = canvas.Canvas(buffer, pagesize=(box[2], box[3]))
+        overlay.setFont(font, size)
+        overlay.drawString(x, y, text)
+        overlay.save()
+
+        page = PdfReader(io.BytesIO(buffer.getvalue())).pages[0]
+        contents = page['/Contents']
+        return Overlay(
+            contents._data,
+            _inline(contents.raw_get('/Filter')) if '/Filter' in contents else None,
+            _inline(page.raw_get('/Resources')),
+            box
+        )
+
+    def render(self, text, x, y, box, font="Helvetica", size=12):
+        """Return the Overlay drawing text at (x, y) on a page with the given box
+
+        box is the page's (llx, lly, urx, ury) media box.
+        """
+        key = (text, font, size, x, y, tuple(box))
+        with self.lock:
+            overlay = self.entries.get(key)
+            if overlay is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return overlay
+            self.misses += 1
+
+        overlay = self._render(text, x, y, tuple(box), font, size)
+        with self.lock:
+            self.entries[key] = overlay
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return overlay
+
+
+# Shared by all editors unless they are given their own renderer
+default_renderer = OverlayRenderer()
@@ -0,0 +1,127 @@
+"""Lazy access to the pages of a PdfReader without flattening its page tree"""
+from bisect import bisect_right
+
+from PyPDF2 import PageObject
+from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import IndirectObject, NameObject
+
+# Page attributes a page inherits from its ancestors in the page tree
+INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+# Deeper page trees are treated as broken (or cyclic)
+MAX_DEPTH = 64
+
+
+class PageIndex:
+    """Sequence of the pages of a reader, read from the page tree on demand
+
+    reader.pages parses every page object and builds a PageObject for each
+    on first use. Here len() comes from the /Count of the tree root, a page
+    is found by walking down through the intermediate nodes only, and
+    iterating reads one page at a time. Page contents and resources stay
+    indirect until a writer copies the page.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._count = None
+        # (idnum, generation) of a page tree node -> (kids, first page index
+        # of each kid), or (kids, None) when every kid holds one page
+        self._nodes = {}
+
+    def _root(self):
+        return self.reader.trailer['/Root'].raw_get('/Pages')
+
+    def __len__(self):
+        if self.reader.flattened_pages is not None:
+            return len(self.reader.flattened_pages)
+        if self._count is None:
+            self._count = int(self._root().get_object().get('/Count', 0))
+        return self._count
+
+    def _children(self, reference, node):
+        # Keyed by reference rather than by object, since the reader may
+        # resolve a node again; direct nodes are not cached
+        key = (reference.idnum, reference.generation) if isinstance(reference, IndirectObject) else None
+        if key in self._nodes:
+            return self._nodes[key]
+        kids = node['/Kids']
+        starts = None
+        if int(node.get('/Count', -1)) != len(kids):
+            starts = []
+            total = 0
+            for kid in kids:
+                starts.append(total)
+                kid_node = kid.get_object()
+                total += int(kid_node.get('/Count', 0)) if '/Kids' in kid_node else 1
+        if key is not None:
+            self._nodes[key] = (kids, starts)
+        return kids, starts
+
+    @staticmethod
+    def _inherit(node, inherited):
+        inherited = dict(inherited)
+        for key in INHERITABLE:
+            if key in node:
+                inherited[key] = node.raw_get(key)
+        return inherited
+
+    def _page(self, reference, node, inherited):
+        page = PageObject(self.reader, reference if isinstance(reference, IndirectObject) else None)
+        page.update(node)
+        for key, value in inherited.items():
+            if key not in page:
+                page[NameObject(key)] = value
+        return page
+
+    def __getitem__(self, index):
+        if self.reader.flattened_pages is not None:
+            return self.reader.flattened_pages[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Page index out of range")
+
+        reference = self._root()
+        inherited = {}
+        for _ in range(MAX_DEPTH):
+            node = reference.get_object()
+            if '/Kids' not in node:
+                if index:
+                    raise IndexError("Page index out of range")
+                return self._page(reference, node, inherited)
+            inherited = self._inherit(node, inherited)
+            kids, starts = self._children(reference, node)
+            if starts is None:
+                position, index = index, 0
+            else:
+                position = bisect_right(starts, index) - 1
+                index -= starts[position]
+            if not 0 <= position < len(kids):
+                raise IndexError("Page index out of range")
+            reference = kids[position]
+        raise PdfReadError("Page tree is too deep")
+
+    def __iter__(self):
+        if self.reader.flattened_pages is not None:
+            yield from self.reader.flattened_pages
+            return
+
+        count = 0
+        stack = [(iter([self._root()]), {})]
+        while stack:
+            kids, inherited = stack[-1]
+            reference = next(kids, None)
+            if reference is None:
+                stack.pop()
+                continue
+            node = reference.get_object()
+            if '/Kids' in node:
+                if len(stack) > MAX_DEPTH:
+                    raise PdfReadError("Page tree is too deep")
+                stack.append((iter(node['/Kids']), self._inherit(node, inherited)))
+            else:
+                count += 1
+                yield self._page(reference, node, inherited)
+        # The pages actually found win over a wrong /Count
+        self._count = count
@@ -0,0 +1,75 @@
+"""Page-range specs for merge inputs
+
+A spec lists 1-based pages and ranges separated by commas, e.g. "1-3,10,-1".
+Negative numbers count from the end (-1 is the last page), "5-" runs to the
+last page and "5-3" selects pages in reverse order.
+"""
+import os
+import re
+
+from page_index import PageIndex
+
+_ITEM = re.compile(r'^(-?\d+)(?:-(-?\d*))?$')
+_SPEC = re.compile(r'^[-\d,\s]+$')
+
+
+def parse_ranges(spec):
+    """Return a spec as (first, last) pairs, raising ValueError if it is malformed
+
+    last is None for ranges that run to the end of the document.
+    """
+    ranges = []
+    for item in spec.split(','):
+        match = _ITEM.match(item.strip())
+        if match is None:
+            raise ValueError(f"Invalid page range: {item.strip()!r}")
+        first = int(match.group(1))
+        last = match.group(2)
+        last = first if last is None else (int(last) if last else None)
+        if first == 0 or last == 0:
+            raise ValueError("Page numbers start at 1")
+        ranges.append((first, last))
+    return ranges
+
+
+def resolve_ranges(spec, count):
+    """Return the zero-based page indices a spec selects in a document of count pages"""
+    def index(number):
+        position = number - 1 if number > 0 else count + number
+        if not 0 <= position < count:
+            raise ValueError(f"Page {number} is out of range (document has {count} pages)")
+        return position
+
+    indices = []
+    for first, last in parse_ranges(spec):
+        start = index(first)
+        end = count - 1 if last is None else index(last)
+        step = 1 if end >= start else -1
+        indices.extend(range(start, end + step, step))
+    return indices
+
+
+def split_spec(value):
+    """Split "file.pdf:1-3" into ("file.pdf", "1-3"); plain paths give (value, None)
+
+    An existing file whose name merely looks like a spec is taken as a path.
+    """
+    path, sep, spec = value.rpartition(':')
+    if not sep or not path or not _SPEC.match(spec) or os.path.exists(value):
+        return value, None
+    return path, spec
+
+
+def select_pages(reader, pages):
+    """Return the selected pages of reader
+
+    pages is None for every page (a lazy PageIndex), a list of zero-based
+    indices or a spec string; selected pages are looked up individually, so
+    the cost depends on the selection rather than on the size of the document.
+    """
+    index = PageIndex(reader)
+    if pages is None:
+        return index
+    if isinstance(pages, str):
+        pages = resolve_ranges(pages, len(index))
+    return [index[i] for i in pages]
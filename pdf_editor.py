@@ -0,0 +1,271 @@
+"""Apply many page edits to a PDF in a single read/write pass"""
+import os
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DictionaryObject, NameObject, NumberObject
+
+from incremental_writer import IncrementalUpdateError, IncrementalWriter
+from input_source import open_input
+from overlay_renderer import default_renderer
+from page_index import PageIndex
+from page_ranges import resolve_ranges
+from pdf_optimizer import DEFAULT_LEVEL, LEVELS, compresses, write_pdf
+from stamper import make_stream, overlay_page, page_box
+
+
+class EditError(Exception):
+    """Raised for an invalid edit operation"""
+
+
+class _PageSlot:
+    """A page of the edited document and the changes queued for it"""
+
+    def __init__(self, pages, index):
+        # PageIndex of the document the page comes from
+        self.pages = pages
+        self.index = index
+        self.rotation = 0
+        # (text, x, y, font, size) overlays drawn on top of the page
+        self.texts = []
+
+    @property
+    def touched(self):
+        return bool(self.rotation or self.texts)
+
+
+def resolve_pages(pages, count):
+    """Turn a page selection into zero-based indices
+
+    pages may be None (every page), a zero-based index, a page-range spec
+    string as taken by merge inputs (1-based, e.g. "1-3,10,-1"; see
+    page_ranges) or a list of these. Negative indices count from the end.
+    """
+    if pages is None:
+        return list(range(count))
+    if isinstance(pages, (int, str)):
+        pages = [pages]
+
+    indices = []
+    for value in pages:
+        if isinstance(value, str):
+            try:
+                indices.extend(resolve_ranges(value, count))
+            except ValueError as e:
+                raise EditError(str(e))
+        else:
+            indices.append(_page_index(int(value), count))
+    return indices
+
+
+def _page_index(value, count):
+    index = value + count if value < 0 else value
+    if not 0 <= index < count:
+        raise EditError(f"Page {value} is out of range (document has {count} pages)")
+    return index
+
+
+def stamp_overlays(page, overlays, forms, add_object):
+    """Draw overlays on top of page, which is updated in place
+
+    forms maps overlays already added to the output to their references,
+    so each overlay is written once per document however many pages use
+    it.
+    """
+    xobjects = []
+    draw = b'Q\n'
+    for overlay in overlays:
+        if overlay not in forms:
+            forms[overlay] = add_object(overlay.form_xobject())
+        name = f'/PdfEditText{forms[overlay].idnum}'
+        xobjects.append((name, forms[overlay]))
+        draw += f'q {name} Do Q\n'.encode()
+    overlay_page(page, add_object(make_stream(b'q\n')), add_object(make_stream(draw)), xobjects)
+
+
+class PdfEditor:
+    """Queue page edits on a PDF and write the result once
+
+    Operations only rearrange a list of page slots; pages are copied and
+    the per-page work (rotation, overlays) is done for touched pages only
+    when the document is saved. Input files are memory-mapped until close().
+    """
+
+    def __init__(self, path, renderer=None):
+        self.path = path
+        # Text overlays are shared through the renderer's cache
+        self.renderer = renderer or default_renderer
+        # PageIndex of every document pages are taken from, by path; pages
+        # are only read when they are written
+        self.documents = {}
+        self.streams = []
+        pages = self._document(path)
+        self.slots = [_PageSlot(pages, i) for i in range(len(pages))]
+
+    def _document(self, path):
+        if path not in self.documents:
+            stream = open_input(path)
+            self.streams.append(stream)
+            self.documents[path] = PageIndex(PdfReader(stream))
+        return self.documents[path]
+
+    def close(self):
+        """Release the input files"""
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def page_count(self):
+        return len(self.slots)
+
+    def remove(self, pages):
+        """Remove the selected pages"""
+        removed = set(resolve_pages(pages, self.page_count))
+        self.slots = [slot for i, slot in enumerate(self.slots) if i not in removed]
+
+    def rotate(self, pages, degrees=90):
+        """Rotate the selected pages clockwise by a multiple of 90 degrees"""
+        if degrees % 90:
+            raise EditError("Rotation must be a multiple of 90 degrees")
+        for i in resolve_pages(pages, self.page_count):
+            self.slots[i].rotation = (self.slots[i].rotation + degrees) % 360
+
+    def reorder(self, order):
+        """Arrange pages in the given order of current indices"""
+        indices = resolve_pages(order, self.page_count)
+        if sorted(indices) != list(range(self.page_count)):
+            raise EditError("Order must list every page exactly once")
+        self.slots = [self.slots[i] for i in indices]
+
+    def insert(self, at, path, pages=None):
+        """Insert pages of another PDF before index at (None = append)"""
+        document = self._document(path)
+        slots = [_PageSlot(document, i) for i in resolve_pages(pages, len(document))]
+        if at is None:
+            at = self.page_count
+        elif not 0 <= at <= self.page_count:
+            raise EditError(f"Insert position {at} is out of range")
+        self.slots[at:at] = slots
+
+    def add_text(self, text, pages=None, x=100, y=750, font="Helvetica", size=12):
+        """Draw text on top of the selected pages"""
+        # Overlays are only rendered when saving, so check the options now
+        try:
+            self.renderer.check(text, x, y, font, size)
+        except ValueError as e:
+            raise EditError(str(e))
+        for i in resolve_pages(pages, self.page_count):
+            self.slots[i].texts.append((text, x, y, font, size))
+
+    def apply(self, operations):
+        """Queue a list of operation dicts, e.g. {"op": "rotate", "pages": [0]}"""
+        handlers = {
+            'remove': lambda op: self.remove(op.get('pages')),
+            'rotate': lambda op: self.rotate(op.get('pages'), op.get('degrees', 90)),
+            'reorder': lambda op: self.reorder(op['order']),
+            'insert': lambda op: self.insert(op.get('at'), op['path'], op.get('pages')),
+            'text': lambda op: self.add_text(
+                op['text'], op.get('pages'), op.get('x', 100), op.get('y', 750),
+                op.get('font', 'Helvetica'), op.get('size', 12)
+            ),
+        }
+        for operation in operations:
+            handler = handlers.get(operation.get('op'))
+            if handler is None:
+                raise EditError(f"Unknown operation: {operation.get('op')}")
+            try:
+                handler(operation)
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                raise EditError(f"Invalid {operation['op']} operation: {e}")
+
+    def _overlays(self, slot, page):
+        box = page_box(page)
+        return [
+            self.renderer.render(text, x, y, box, font, size)
+            for text, x, y, font, size in slot.texts
+        ]
+
+    def _write_pages(self, writer):
+        forms = {}
+        for slot in self.slots:
+            page = writer.add_page(slot.pages[slot.index])
+            if not slot.touched:
+                continue
+            if slot.texts:
+                stamp_overlays(page, self._overlays(slot, page), forms, writer._add_object)
+            if slot.rotation:
+                page.rotate(slot.rotation)
+
+    def _page_tree_unchanged(self):
+        pages = self.documents[self.path]
+        return len(self.slots) == len(pages) and all(
+            slot.pages is pages and slot.index == i for i, slot in enumerate(self.slots)
+        )
+
+    def _save_incremental(self, output, compress=False):
+        """Append the changed pages to the original file"""
+        writer = IncrementalWriter(self.documents[self.path].reader, self.path, compress=compress)
+        forms = {}
+        for slot in self.slots:
+            if not slot.touched:
+                continue
+            page = slot.pages[slot.index]
+            if page.indirect_reference is None:
+                raise IncrementalUpdateError("Page is not an indirect object")
+            copy = DictionaryObject(page)
+            if slot.rotation:
+                copy[NameObject('/Rotate')] = NumberObject((page.get('/Rotate', 0) + slot.rotation) % 360)
+            if slot.texts:
+                stamp_overlays(copy, self._overlays(slot, page), forms, writer.add_object)
+            writer.update_object(page.indirect_reference, copy)
+        writer.save(output)
+
+    def save(self, output, incremental=False, optimize=DEFAULT_LEVEL):
+        """Write the edited document to a path or stream
+
+        With incremental=True, edits that keep the page order (rotations
+        and text overlays) are appended to a copy of the original bytes
+        instead of rewriting every object; other edits fall back to a full
+        rewrite. optimize is a pdf_optimizer level; incremental updates
+        only compress the streams they add.
+        """
+        if optimize not in LEVELS:
+            raise EditError(f"Unknown optimization level: {optimize}")
+        if incremental and self._page_tree_unchanged() and any(slot.touched for slot in self.slots):
+            try:
+                self._save_incremental(output, compresses(optimize))
+                return self.page_count
+            except IncrementalUpdateError:
+                if hasattr(output, 'seek'):
+                    output.seek(0)
+                    output.truncate()
+
+        writer = PdfWriter()
+        self._write_pages(writer)
+        if hasattr(output, 'write'):
+            write_pdf(writer, output, optimize)
+        else:
+            # Write beside the target and move it into place, so an input
+            # being overwritten is never truncated while it is mapped
+            temp = f'{output}.tmp'
+            try:
+                with open(temp, 'wb') as f:
+                    write_pdf(writer, f, optimize)
+                os.replace(temp, output)
+            finally:
+                if os.path.exists(temp):
+                    os.remove(temp)
+        return self.page_count
+
+
+def edit_pdf(path, operations, output, incremental=False, optimize=DEFAULT_LEVEL):
+    """Apply operations to the PDF at path in one pass and return the page count"""
+    with PdfEditor(path) as editor:
+        editor.apply(operations)
+        return editor.save(output, incremental=incremental, optimize=optimize)
@@ -2,10 +2,15 @@ import os
 import sys
 import json
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-import PyPDF2
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import threading
 
+from file_list import FileListModel, VirtualListView
+from merge_engine import MergeCancelled, MergeJob, format_errors, options_from_config
+from metadata_loader import MetadataLoader
+from page_ranges import parse_ranges, split_spec
+from pdf_metadata import MetadataCache
+
 # Try to import drag and drop functionality (optional)
 try:
     from tkinter.dnd import DND_FILES
@@ -14,6 +19,18 @@ except ImportError:
     DND_SUPPORTED = False
 # Configuration file path
 CONFIG_FILE = "pdf_merger_config.json"
+# Page count / metadata cache, stored next to the configuration file
+METADATA_CACHE_FILE = "pdf_metadata_cache.json"
+# Milliseconds between progress bar updates while merging
+PROGRESS_INTERVAL = 100
+
+def load_config():
+    """Load configuration from file"""
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
 
 class PDFMergerGUI:
     def __init__(self, root):
@@ -27,6 +44,19 @@ class PDFMergerGUI:
         self.dark_mode = self.config.get("dark_mode", False)
         self.last_directory = self.config.get("last_directory", ".")
         
+        # Cached page counts so unchanged files are not re-parsed
+        self.metadata_cache = MetadataCache(METADATA_CACHE_FILE)
+        
+        # Listed entries ("path" or "path:ranges") in merge order, with
+        # page counts filled in by the background loader
+        self.files = FileListModel()
+        self.loader = MetadataLoader(
+            self.metadata_cache, self.root.after, self.on_metadata, self.on_metadata_idle
+        )
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # The merge in progress, polled for the progress bar
+        self.merge_job = None
+        
         # Create widgets first
         self.create_widgets()
         
@@ -38,11 +68,7 @@ class PDFMergerGUI:
 
     def load_config(self):
         """Load configuration from file"""
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
+        return load_config()
     
     def save_config(self):
         """Save configuration to file"""
@@ -124,12 +150,9 @@ class PDFMergerGUI:
         main_frame.rowconfigure(2, weight=1)
         main_frame.columnconfigure(0, weight=1)
         
-        self.file_listbox = tk.Listbox(list_frame, selectmode=tk.EXTENDED)
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.file_listbox.yview)
-        self.file_listbox.configure(yscrollcommand=scrollbar.set)
-        
-        self.file_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Only the rows on screen are put in the listbox, so long lists stay fast
+        self.file_view = VirtualListView(list_frame, self.files)
+        self.file_listbox = self.file_view.listbox
         
         # Control buttons
         control_frame = ttk.Frame(main_frame)
@@ -147,17 +170,29 @@ class PDFMergerGUI:
         clear_btn = ttk.Button(control_frame, text="Clear All", command=self.clear_all)
         clear_btn.pack(fill=tk.X, pady=(0, 5))
         
+        sort_btn = ttk.Button(control_frame, text="Sort by Name", command=self.sort_by_name)
+        sort_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        pages_btn = ttk.Button(control_frame, text="Select Pages", command=self.select_pages)
+        pages_btn.pack(fill=tk.X, pady=(0, 5))
+        
         # Status label
         self.status_label = ttk.Label(main_frame, text="Total files: 0 | Total pages: 0")
         self.status_label.grid(row=3, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(0, 10))
         
-        # Progress bar
-        self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
+        # Progress bar, in percent of the input bytes merged
+        self.progress = ttk.Progressbar(main_frame, mode='determinate', maximum=100)
         self.progress.grid(row=4, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(0, 10))
         
-        # Merge button
-        merge_button = ttk.Button(main_frame, text="Merge PDFs", command=self.merge_pdfs_threaded)
-        merge_button.grid(row=5, column=0, columnspan=4, pady=(0, 10))
+        # Merge and cancel buttons
+        merge_frame = ttk.Frame(main_frame)
+        merge_frame.grid(row=5, column=0, columnspan=4, pady=(0, 10))
+        
+        self.merge_button = ttk.Button(merge_frame, text="Merge PDFs", command=self.merge_pdfs_threaded)
+        self.merge_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.cancel_button = ttk.Button(merge_frame, text="Cancel", command=self.cancel_merge, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT)
         
         # Output label
         self.output_label = ttk.Label(main_frame, text="Output: merged.pdf")
@@ -181,10 +216,7 @@ class PDFMergerGUI:
     def on_drop(self, event):
         """Handle file drop event"""
         files = self.root.tk.splitlist(event.data)
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                self.file_listbox.insert(tk.END, file)
-        self.update_status()
+        self.insert_files([file for file in files if file.lower().endswith('.pdf')])
     
     def add_files(self):
         """Add PDF files to the list"""
@@ -199,152 +231,202 @@ class PDFMergerGUI:
             self.last_directory = os.path.dirname(files[0])
             self.save_config()
             
-            # Add files to listbox
-            for file in files:
-                self.file_listbox.insert(tk.END, file)
-            
-            self.update_status()
+            self.insert_files(files)
+    
+    def insert_files(self, entries):
+        """Append entries to the list and read their page counts in the background"""
+        if not entries:
+            return
+        self.files.extend(entries)
+        self.file_view.render()
+        self.loader.request({split_spec(entry)[0] for entry in entries})
+        self.update_status()
+    
+    def on_metadata(self, results):
+        """Show a batch of page counts from the background loader"""
+        self.files.update_info(results)
+        self.file_view.render()
+        self.update_status()
+    
+    def on_metadata_idle(self):
+        """Persist the page counts once every listed file has been read"""
+        self.metadata_cache.save()
+    
+    def list_changed(self, selection=()):
+        """Redraw the list after a bulk change and stop reading removed files"""
+        self.loader.retain(self.files.paths())
+        self.file_view.select(selection)
+        self.update_status()
+    
+    def on_close(self):
+        """Stop background work and close the window"""
+        if self.merge_job is not None:
+            self.merge_job.cancel()
+        self.loader.close()
+        self.metadata_cache.save()
+        self.root.destroy()
     
     def move_up(self):
         """Move selected items up in the list"""
-        selections = self.file_listbox.curselection()
+        selections = self.file_view.selection()
         if not selections:
             return
-            
-        # Check if first item is selected
-        if 0 in selections:
-            return
-            
-        # Move items up
-        for index in selections:
-            text = self.file_listbox.get(index)
-            self.file_listbox.delete(index)
-            self.file_listbox.insert(index - 1, text)
-            
-        # Reselect moved items
-        for index in selections:
-            self.file_listbox.select_set(index - 1)
+        self.file_view.select(self.files.move(selections, -1))
     
     def move_down(self):
         """Move selected items down in the list"""
-        selections = self.file_listbox.curselection()
+        selections = self.file_view.selection()
         if not selections:
             return
-            
-        # Check if last item is selected
-        if self.file_listbox.size() - 1 in selections:
-            return
-            
-        # Move items down (in reverse order to maintain indices)
-        for index in reversed(selections):
-            text = self.file_listbox.get(index)
-            self.file_listbox.delete(index)
-            self.file_listbox.insert(index + 1, text)
-            
-        # Reselect moved items
-        for index in selections:
-            self.file_listbox.select_set(index + 1)
+        self.file_view.select(self.files.move(selections, 1))
+    
+    def sort_by_name(self):
+        """Sort the list by file name, keeping the selection"""
+        self.file_view.select(self.files.sort("name", self.file_view.selection()))
     
     def remove_selected(self):
         """Remove selected items from the list"""
-        selections = self.file_listbox.curselection()
+        selections = self.file_view.selection()
         if not selections:
             return
-            
-        # Delete in reverse order to maintain indices
-        for index in reversed(selections):
-            self.file_listbox.delete(index)
-            
+        self.files.remove(selections)
+        self.list_changed()
+    
+    def select_pages(self):
+        """Ask for the page ranges to take from the selected files"""
+        selections = self.file_view.selection()
+        if not selections:
+            return
+        
+        current = split_spec(self.files[selections[0]])[1] or ""
+        spec = simpledialog.askstring(
+            "Select Pages",
+            "Pages to merge, e.g. 1-3,10,-1 (leave empty for all pages):",
+            initialvalue=current, parent=self.root
+        )
+        if spec is None:
+            return
+        spec = spec.replace(" ", "")
+        if spec:
+            try:
+                parse_ranges(spec)
+            except ValueError as e:
+                messagebox.showerror("Invalid Page Ranges", str(e))
+                return
+        
+        self.files.set_pages(selections, spec)
+        self.file_view.render()
         self.update_status()
     
     def clear_all(self):
         """Clear all items from the list"""
-        self.file_listbox.delete(0, tk.END)
-        self.update_status()
+        self.files.clear()
+        self.list_changed()
     
     def update_status(self):
         """Update status label with file count and page count"""
-        file_count = self.file_listbox.size()
-        page_count = 0
-        
-        # Count pages in each PDF
-        for i in range(file_count):
-            file_path = self.file_listbox.get(i)
-            try:
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    page_count += len(reader.pages)
-            except Exception:
-                # Skip invalid files for page count
-                pass
-        
-        self.status_label.configure(text=f"Total files: {file_count} | Total pages: {page_count}")
+        # Invalid files and ranges count as 0 pages; files still being read
+        # by the loader are added as they arrive
+        page_count, reading = self.files.totals()
+        text = f"Total files: {len(self.files)} | Total pages: {page_count}"
+        if reading:
+            text += f" (reading {reading} files...)"
+        self.status_label.configure(text=text)
     
     def merge_pdfs_threaded(self):
         """Start merging process in a separate thread"""
-        # Disable buttons during merge
-        self.progress.start()
-        thread = threading.Thread(target=self.merge_pdfs)
+        if self.merge_job is not None:
+            return
+        files = list(self.files.entries)
+        if not files:
+            self.show_message("No files selected", "Please add PDF files to merge.", "warning")
+            return
+        
+        # The worker thread gets its own copy of the list; the job is kept
+        # here so the progress bar can follow it and Cancel can stop it
+        self.merge_job = MergeJob(files, "merged.pdf", **options_from_config(self.config))
+        self.merge_button.configure(state=tk.DISABLED)
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.progress.configure(value=0)
+        thread = threading.Thread(target=self.merge_pdfs, args=(files, self.merge_job))
         thread.start()
+        self.watch_merge()
+    
+    def watch_merge(self):
+        """Show the progress of the running merge until it finishes"""
+        if self.merge_job is None:
+            return
+        progress = self.merge_job.progress
+        self.progress.configure(value=100 * progress.fraction)
+        text = (f"Merging: {progress.files_done} of {progress.total_files} files | "
+                f"{progress.pages_copied} pages | {progress.bytes_written / (1024 * 1024):.1f} MB written")
+        eta = progress.eta
+        if eta is not None:
+            text += f" | about {int(eta) + 1}s left"
+        if self.merge_job.cancelled:
+            text = "Cancelling merge..."
+        self.status_label.configure(text=text)
+        self.root.after(PROGRESS_INTERVAL, self.watch_merge)
     
-    def merge_pdfs(self):
+    def cancel_merge(self):
+        """Stop the running merge; the partial output is removed"""
+        if self.merge_job is not None:
+            self.merge_job.cancel()
+            self.cancel_button.configure(state=tk.DISABLED)
+    
+    def merge_finished(self):
+        """Reset the merge controls once the worker thread is done"""
+        self.merge_job = None
+        self.progress.configure(value=0)
+        self.merge_button.configure(state=tk.NORMAL)
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.update_status()
+    
+    def merge_pdfs(self, files=None, job=None):
         """Merge selected PDF files"""
+        try:
+            self._merge_pdfs(files, job)
+        finally:
+            self.root.after(0, self.merge_finished)
+    
+    def _merge_pdfs(self, files, job):
         # Get file list
-        file_count = self.file_listbox.size()
-        if file_count == 0:
+        if files is None:
+            files = list(self.files.entries)
+        if not files:
             self.show_message("No files selected", "Please add PDF files to merge.", "warning")
-            self.progress.stop()
             return
-            
-        files = [self.file_listbox.get(i) for i in range(file_count)]
-        
-        # Create PDF writer
-        writer = PyPDF2.PdfWriter()
-        total_pages = 0
-        error_files = []
         
-        # Process each file
-        for file_path in files:
-            try:
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    # Add all pages to writer
-                    for page in reader.pages:
-                        writer.add_page(page)
-                    total_pages += len(reader.pages)
-            except Exception as e:
-                error_files.append((file_path, str(e)))
+        # Merge through the shared engine
+        if job is None:
+            job = MergeJob(files, "merged.pdf", **options_from_config(self.config))
+        try:
+            job.run()
+            write_error = None
+        except MergeCancelled:
+            self.show_message("Merge Cancelled", "The merge was cancelled; no output was written.", "info")
+            return
+        except Exception as e:
+            write_error = e
+        result = job.result
         
         # Check for errors
-        if error_files:
-            error_msg = "Errors occurred with the following files:\n\n"
-            for file_path, error in error_files[:3]:  # Show first 3 errors
-                error_msg += f"{os.path.basename(file_path)}: {error}\n"
-            if len(error_files) > 3:
-                error_msg += f"\n... and {len(error_files) - 3} more files."
-                
-            self.show_message("Merge Errors", error_msg, "error")
+        if result.error_files:
+            self.show_message("Merge Errors", format_errors(result.error_files), "error")
             
             # If all files failed, stop here
-            if len(error_files) == len(files):
-                self.progress.stop()
+            if len(result.error_files) == len(files):
                 return
         
-        # Write merged PDF
-        try:
-            with open("merged.pdf", 'wb') as f:
-                writer.write(f)
-                
+        if write_error is None:
             # Show success message
             self.show_message(
                 "Success", 
-                f"PDFs merged successfully!\nOutput: merged.pdf\nTotal pages: {total_pages}", 
+                f"PDFs merged successfully!\nOutput: merged.pdf\nTotal pages: {result.total_pages}", 
                 "info"
             )
-        except Exception as e:
-            self.show_message("Merge Failed", f"Failed to save merged PDF:\n{str(e)}", "error")
-        
-        self.progress.stop()
+        else:
+            self.show_message("Merge Failed", f"Failed to save merged PDF:\n{str(write_error)}", "error")
     
     def show_message(self, title, message, msg_type="info"):
         """Show message box in the main thread"""
@@ -367,67 +449,71 @@ def merge_pdfs_cli():
     
     # Get file paths from user
     file_paths = []
-    print("Enter PDF file paths (press Enter with empty input to finish):")
+    print("Enter PDF file paths, optionally with page ranges such as file.pdf:1-3,-1")
+    print("(press Enter with empty input to finish):")
     
     while True:
         path = input("PDF file path: ").strip()
         if not path:
             break
-            
-        if os.path.isfile(path) and path.lower().endswith('.pdf'):
-            file_paths.append(path)
-        else:
+        
+        file_path, spec = split_spec(path)
+        if not (os.path.isfile(file_path) and file_path.lower().endswith('.pdf')):
             print(f"Invalid file or not a PDF: {path}")
+            continue
+        try:
+            if spec is not None:
+                parse_ranges(spec)
+            file_paths.append(path)
+        except ValueError as e:
+            print(f"Invalid page ranges in {path}: {e}")
     
     if not file_paths:
         print("No valid PDF files provided.")
         return
     
     print("\nLoading PDFs...")
-    
-    # Create PDF writer
-    writer = PyPDF2.PdfWriter()
-    total_pages = 0
-    error_files = []
-    
     print("Merging...")
     
-    # Process each file
-    for file_path in file_paths:
-        try:
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                # Add all pages to writer
-                for page in reader.pages:
-                    writer.add_page(page)
-                total_pages += len(reader.pages)
-        except Exception as e:
-            error_files.append((file_path, str(e)))
+    job = MergeJob(file_paths, "merged_output.pdf", **options_from_config(load_config()))
+    try:
+        job.run()
+        write_error = None
+    except Exception as e:
+        write_error = e
+    result = job.result
     
     # Check for errors
-    if error_files:
+    if result.error_files:
         print("\nErrors occurred with the following files:")
-        for file_path, error in error_files:
+        for file_path, error in result.error_files:
             print(f"  {os.path.basename(file_path)}: {error}")
             
         # If all files failed, stop here
-        if len(error_files) == len(file_paths):
+        if len(result.error_files) == len(file_paths):
             print("All files failed to process. Exiting.")
             return
     
-    # Write merged PDF
-    try:
-        with open("merged_output.pdf", 'wb') as f:
-            writer.write(f)
+    if write_error is None:
         print(f"\nDone! File saved as merged_output.pdf")
-        print(f"Total pages merged: {total_pages}")
-    except Exception as e:
-        print(f"\nFailed to save merged PDF: {e}")
+        print(f"Total pages merged: {result.total_pages}")
+        if result.objects_deduplicated:
+            print(f"Shared resources written once: {result.objects_deduplicated} "
+                  f"duplicate objects ({result.bytes_saved / 1024:.1f} KB saved)")
+        if result.images_optimized:
+            print(f"Images downsampled: {result.images_optimized} "
+                  f"({result.image_bytes_saved / 1024:.1f} KB saved)")
+    else:
+        print(f"\nFailed to save merged PDF: {write_error}")
 
 
 def main():
     """Main entry point"""
-    if len(sys.argv) > 1 and sys.argv[1] == "--cli":
+    if len(sys.argv) > 2 and sys.argv[1] == "--cli":
+        # Arguments after --cli run the non-interactive batch mode
+        import batch_merge
+        sys.exit(batch_merge.main(sys.argv[2:], load_config()))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--cli":
         merge_pdfs_cli()
     else:
         # GUI mode
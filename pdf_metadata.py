@@ -0,0 +1,205 @@
+"""PDF metadata extraction with a persistent LRU cache"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+import PyPDF2
+
+from input_source import memory_file, open_input, stream_sha256
+from page_index import PageIndex
+
+logger = logging.getLogger(__name__)
+
+# Default number of files remembered by the cache
+DEFAULT_MAX_ENTRIES = 5000
+# Pages whose sizes are read per file
+MAX_PAGE_SIZES = 10
+
+
+def file_sha256(file_path):
+    """Return the SHA-256 hex digest of a file's contents"""
+    with open_input(file_path) as f:
+        return stream_sha256(f)
+
+
+def read_metadata(file_path, max_page_sizes=MAX_PAGE_SIZES):
+    """Read page count, page sizes, encryption flag and PDF version"""
+    with open_input(file_path) as f:
+        return metadata_from_stream(f, max_page_sizes)
+
+
+def metadata_from_stream(stream, max_page_sizes=MAX_PAGE_SIZES):
+    """Read metadata from an open binary PDF stream
+
+    The page count comes from the root of the page tree; sizes are read
+    for the first max_page_sizes pages only, so the cost of a lookup does
+    not grow with the length of the document.
+    """
+    reader = PyPDF2.PdfReader(stream)
+    encrypted = reader.is_encrypted
+    if encrypted:
+        # Many encrypted files open with an empty user password
+        try:
+            reader.decrypt("")
+        except Exception:
+            pass
+
+    pages = PageIndex(reader)
+    page_count = len(pages)
+    page_sizes = []
+    try:
+        for page in islice(pages, max_page_sizes):
+            box = page.mediabox
+            page_sizes.append([float(box.width), float(box.height)])
+    except Exception:
+        # Pages of encrypted files may be unreadable
+        page_sizes = []
+
+    return {
+        'page_count': page_count,
+        'page_sizes': page_sizes,
+        'encrypted': encrypted,
+        'pdf_version': reader.pdf_header.replace('%PDF-', '', 1),
+    }
+
+
+def file_signature(file_path):
+    """Return the [size, mtime] pair cache entries are validated against"""
+    data = memory_file(file_path)
+    if data is not None:
+        # Files kept in memory never change
+        return [len(data), 0]
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_entry(file_path):
+    """Read a file for the cache and return (signature, metadata)
+
+    Unreadable files get an 'error' entry; the signature is None for
+    missing files, which are not cached because they may appear later.
+    """
+    try:
+        signature = file_signature(file_path)
+    except OSError as e:
+        return None, {'page_count': 0, 'error': str(e)}
+    try:
+        metadata = read_metadata(file_path)
+    except Exception as e:
+        metadata = {'page_count': 0, 'error': str(e)}
+    return signature, metadata
+
+
+class MetadataCache:
+    """LRU cache of PDF metadata keyed by path, size and modification time
+
+    Entries are persisted as JSON in store_path so they survive restarts.
+    Unreadable files are cached too (with an 'error' entry) so they are
+    not re-parsed on every lookup.
+    """
+
+    def __init__(self, store_path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.store_path = store_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """Load cached entries from the store file"""
+        if not self.store_path:
+            return
+        try:
+            with open(self.store_path, 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        with self.lock:
+            self.entries = OrderedDict(entries)
+            self._evict()
+
+    def save(self):
+        """Write the cache to the store file if it changed
+
+        The file is replaced in one step, so a reader or a crash never sees
+        it half written.
+        """
+        if not self.store_path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            temp_path = f'{self.store_path}.tmp'
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(temp_path, self.store_path)
+                self.dirty = False
+            except Exception as e:
+                logger.warning("Could not save metadata cache: %s", e)
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.dirty = True
+
+    @staticmethod
+    def _signature(file_path):
+        return file_signature(file_path)
+
+    def lookup(self, file_path):
+        """Return cached metadata for file_path, or None if missing or stale"""
+        key = os.path.abspath(file_path)
+        try:
+            signature = self._signature(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['signature'] != signature:
+                return None
+            self.entries.move_to_end(key)
+            return entry['metadata']
+
+    def store(self, file_path, metadata, signature=None):
+        """Remember metadata for file_path"""
+        key = os.path.abspath(file_path)
+        if signature is None:
+            signature = self._signature(file_path)
+        with self.lock:
+            self.entries[key] = {'signature': signature, 'metadata': metadata}
+            self.entries.move_to_end(key)
+            self.dirty = True
+            self._evict()
+
+    def get(self, file_path):
+        """Return metadata for file_path, parsing the file only on a miss"""
+        metadata = self.lookup(file_path)
+        if metadata is not None:
+            self.hits += 1
+            return metadata
+
+        self.misses += 1
+        signature, metadata = load_entry(file_path)
+        if signature is not None:
+            self.store(file_path, metadata, signature)
+        return metadata
+
+    def content_hash(self, file_path):
+        """Return the SHA-256 of file_path, hashing only on a miss"""
+        metadata = self.get(file_path)
+        if 'sha256' not in metadata:
+            signature = self._signature(file_path)
+            metadata = dict(metadata, sha256=file_sha256(file_path))
+            self.store(file_path, metadata, signature)
+        return metadata['sha256']
+
+    def page_count(self, file_path):
+        """Return the page count of file_path (0 for unreadable files)"""
+        return self.get(file_path).get('page_count', 0)
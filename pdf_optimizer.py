@@ -0,0 +1,181 @@
+"""Output optimization levels for written PDFs
+
+none writes objects as they are; compress deflates unfiltered streams;
+objstm packs every non-stream object into compressed object streams indexed
+by a cross-reference stream (PDF 1.5); full does both.
+"""
+import io
+import zlib
+
+from PyPDF2.generic import (
+    ArrayObject,
+    EncodedStreamObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+NONE = "none"
+COMPRESS = "compress"
+OBJECT_STREAMS = "objstm"
+FULL = "full"
+LEVELS = (NONE, COMPRESS, OBJECT_STREAMS, FULL)
+DEFAULT_LEVEL = NONE
+
+# Objects per object stream; readers inflate a whole stream to get one object
+OBJECTS_PER_STREAM = 100
+
+# Bytes the /Filter entry adds to a compressed stream
+_FILTER_OVERHEAD = len(b"/Filter /FlateDecode")
+
+
+def check_level(level):
+    """Return level, or raise ValueError if it is not a known level"""
+    if level not in LEVELS:
+        raise ValueError(f"Unknown optimization level: {level}")
+    return level
+
+
+def compresses(level):
+    return level in (COMPRESS, FULL)
+
+
+def packs(level):
+    return level in (OBJECT_STREAMS, FULL)
+
+
+def compress_stream(obj):
+    """Return a Flate-compressed copy of an unfiltered stream
+
+    Anything else, including streams that already have a filter and streams
+    compression would not shrink, is returned unchanged.
+    """
+    if not isinstance(obj, StreamObject) or '/Filter' in obj:
+        return obj
+    data = obj._data
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    compressed = zlib.compress(data)
+    if len(compressed) + _FILTER_OVERHEAD >= len(data):
+        return obj
+    copy = EncodedStreamObject()
+    for key, value in obj.items():
+        if key != '/Length':
+            copy[NameObject(key)] = value
+    copy[NameObject('/Filter')] = NameObject('/FlateDecode')
+    copy._data = compressed
+    return copy
+
+
+def serialize(obj):
+    """Return the bytes of a direct object"""
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+def object_stream(bodies):
+    """Return an object stream holding (number, serialized object) pairs"""
+    offsets = []
+    data = io.BytesIO()
+    for number, body in bodies:
+        offsets.append(f"{number} {data.tell()}")
+        data.write(body)
+        data.write(b"\n")
+    header = " ".join(offsets).encode() + b"\n"
+    stream = EncodedStreamObject()
+    stream[NameObject('/Type')] = NameObject('/ObjStm')
+    stream[NameObject('/N')] = NumberObject(len(bodies))
+    stream[NameObject('/First')] = NumberObject(len(header))
+    stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    stream._data = zlib.compress(header + data.getvalue())
+    return stream
+
+
+def xref_stream(entries, size, largest, trailer):
+    """Return a cross-reference stream
+
+    entries yields (type, field 2, field 3) for object numbers 0 to size - 1:
+    (0, 0, 65535) for free numbers, (1, offset, 0) for objects written at
+    offset and (2, object stream, index) for packed objects. largest is the
+    biggest field 2 value; trailer holds /Root, /Info and /ID.
+    """
+    width = max(1, (largest.bit_length() + 7) // 8)
+    rows = b"".join(
+        kind.to_bytes(1, 'big') + field.to_bytes(width, 'big') + extra.to_bytes(2, 'big')
+        for kind, field, extra in entries
+    )
+    stream = EncodedStreamObject()
+    for key, value in trailer.items():
+        stream[NameObject(key)] = value
+    stream[NameObject('/Type')] = NameObject('/XRef')
+    stream[NameObject('/Size')] = NumberObject(size)
+    stream[NameObject('/W')] = ArrayObject(NumberObject(w) for w in (1, width, 2))
+    stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    stream._data = zlib.compress(rows)
+    return stream
+
+
+def _write_packed(writer, stream):
+    """Write writer with its non-stream objects packed into object streams"""
+    header = writer.pdf_header if writer.pdf_header >= b"%PDF-1.5" else b"%PDF-1.5"
+    stream.write(header + b"\n%\xe2\xe3\xcf\xd3\n")
+    entries = [(0, 0, 65535)]
+    pending = []
+
+    def write_object(number, obj):
+        entries[number] = (1, stream.tell(), 0)
+        stream.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(stream, None)
+        stream.write(b"\nendobj\n")
+
+    def flush_pending():
+        number = len(entries)
+        entries.append(None)
+        for index, (packed, _) in enumerate(pending):
+            entries[packed] = (2, number, index)
+        write_object(number, object_stream(pending))
+        pending.clear()
+
+    for number, obj in enumerate(writer._objects, 1):
+        entries.append((0, 0, 65535))
+        if obj is None or isinstance(obj, NullObject):
+            # Unreferenced after deduplication; the number stays free
+            continue
+        if isinstance(obj, StreamObject):
+            write_object(number, obj)
+            continue
+        pending.append((number, serialize(obj)))
+        if len(pending) >= OBJECTS_PER_STREAM:
+            flush_pending()
+    if pending:
+        flush_pending()
+
+    trailer = {'/Root': writer._root, '/Info': writer._info}
+    if hasattr(writer, '_ID'):
+        trailer['/ID'] = writer._ID
+    number = len(entries)
+    entries.append(None)
+    position = stream.tell()
+    entries[number] = (1, position, 0)
+    write_object(number, xref_stream(entries, len(entries), position, trailer))
+    stream.write(f"startxref\n{position}\n%%EOF\n".encode())
+
+
+def write_pdf(writer, stream, level=DEFAULT_LEVEL):
+    """Write a PyPDF2 PdfWriter to a binary stream at an optimization level"""
+    check_level(level)
+    if level == NONE:
+        writer.write(stream)
+        return
+    if writer._root is None:
+        writer._root = writer._add_object(writer._root_object)
+    # Pull in objects still owned by readers before they are rewritten
+    writer._sweep_indirect_references(writer._root)
+    if compresses(level):
+        writer._objects[:] = [compress_stream(obj) for obj in writer._objects]
+    if packs(level) and not hasattr(writer, '_encrypt'):
+        _write_packed(writer, stream)
+    else:
+        writer.write(stream)
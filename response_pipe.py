@@ -0,0 +1,105 @@
+"""Hand the bytes of a background merge to a streaming HTTP response"""
+import queue
+
+# Bytes collected before a chunk is handed to the response
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Chunks waiting for a slow client before the writer has to wait
+DEFAULT_MAX_CHUNKS = 16
+
+# Seconds between checks whether the other side is still there
+POLL_INTERVAL = 0.5
+
+
+class PipeClosed(OSError):
+    """Raised to the writer when the response was abandoned"""
+
+
+class PipeError(Exception):
+    """Raised to the reader when the writer failed or stopped early"""
+
+
+class _End:
+    """Marks the end of the output, with the writer's error if it failed"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+class ResponsePipe:
+    """Writable stream whose bytes are read back as chunks on another thread
+
+    A merge job writes to the pipe like to a file; the response generator
+    iterates chunks(). At most max_chunks chunks wait in between, so a
+    slow client slows the merge down instead of filling memory. If the
+    client goes away, the next write raises PipeClosed. copy is an
+    optional open file that receives every byte too.
+    """
+
+    def __init__(self, copy=None, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=DEFAULT_MAX_CHUNKS):
+        self.copy = copy
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.buffer = bytearray()
+        self.abandoned = False
+
+    def _put(self, item):
+        while not self.abandoned:
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+        raise PipeClosed("Client disconnected")
+
+    def write(self, data):
+        if self.abandoned:
+            raise PipeClosed("Client disconnected")
+        if self.copy is not None:
+            self.copy.write(data)
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        if self.copy is not None:
+            self.copy.flush()
+
+    def finish(self, error=None):
+        """End the output; with error, the reader raises PipeError instead"""
+        try:
+            if error is None and self.buffer:
+                self._put(bytes(self.buffer))
+            self.buffer.clear()
+            self._put(_End(error))
+        except PipeClosed:
+            pass
+
+    def chunks(self, alive=lambda: True):
+        """Yield the written bytes in chunks until the writer finishes
+
+        alive() tells whether the writer may still write; when it returns
+        False before finish() was called (e.g. the job was cancelled while
+        queued), PipeError is raised.
+        """
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if alive():
+                        continue
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        raise PipeError("Merge stopped before its output was complete")
+                if isinstance(item, _End):
+                    if item.error is not None:
+                        raise PipeError(item.error)
+                    return
+                yield item
+        finally:
+            # Stop the writer if the response ended early
+            self.abandoned = True
@@ -0,0 +1,111 @@
+"""Content-addressed store for merge results"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+# Default total size of stored results before old ones are evicted
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class ResultStore:
+    """Keep merge outputs keyed by a hash of their inputs and options
+
+    Identical requests map to the same key, so an existing artifact can be
+    returned instead of merging again. Outputs are first written to a
+    job-scoped temporary path and moved into place when complete. When the
+    store grows past max_bytes, the least recently used results are removed.
+
+    With a memory_pool.MemoryPool, results passed to put_data are kept
+    there under their path; only results the pool spills count towards
+    max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES, memory=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.memory = memory
+        self.lock = threading.Lock()
+
+    @property
+    def temp_folder(self):
+        return os.path.join(self.folder, 'tmp')
+
+    @staticmethod
+    def key_for(input_hashes, options):
+        """Hash the ordered input hashes together with the merge options"""
+        payload = json.dumps({'inputs': list(input_hashes), 'options': options}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f'{key}.pdf')
+
+    def temp_path(self, job_id):
+        """Return a private path for a job to write its output to"""
+        os.makedirs(self.temp_folder, exist_ok=True)
+        return os.path.join(self.temp_folder, f'{job_id}.pdf')
+
+    def lookup(self, key):
+        """Return the stored path for key, or None"""
+        path = self.path_for(key)
+        if self.memory is not None and self.memory.get(path) is not None:
+            return path
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, temp_path):
+        """Move a finished output into the store and return its path"""
+        path = self.path_for(key)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+        return path
+
+    def put_data(self, key, data):
+        """Store a finished output held in memory and return its path
+
+        The output stays in memory if the pool takes it, and is written to
+        disk otherwise.
+        """
+        path = self.path_for(key)
+        if self.memory is not None and self.memory.put(path, data):
+            return path
+        os.makedirs(self.temp_folder, exist_ok=True)
+        temp_path = os.path.join(self.temp_folder, f'{key}.{uuid.uuid4().hex}.pdf')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return self.put(key, temp_path)
+
+    def discard(self, temp_path):
+        """Remove a job's temporary output if it exists"""
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """Remove least recently used results until under max_bytes"""
+        with self.lock:
+            entries = []
+            for filename in os.listdir(self.folder):
+                path = os.path.join(self.folder, filename)
+                if not filename.endswith('.pdf') or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
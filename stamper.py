@@ -0,0 +1,177 @@
+"""Watermark and Bates-number stamping applied while merged pages are written"""
+import math
+
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+)
+
+# Resource names used on stamped pages
+FONT_NAME = "/PdfStampFont"
+WATERMARK_NAME = "/PdfStampWatermark"
+
+
+def _resolved_copy(value):
+    copy = DictionaryObject()
+    if value is not None:
+        copy.update(value.get_object())
+    return copy
+
+
+def make_stream(data, entries=None):
+    """Return an uncompressed stream object holding data"""
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    for key, value in (entries or {}).items():
+        stream[NameObject(key)] = value
+    return stream
+
+
+def pdf_string(text):
+    """Encode text as a PDF literal string"""
+    data = text.encode('latin-1', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def page_box(page):
+    """Return the (llx, lly, urx, ury) media box of a page as floats"""
+    box = page.mediabox
+    return (float(box.left), float(box.bottom), float(box.right), float(box.top))
+
+
+def overlay_page(page, before, after, xobjects=(), fonts=()):
+    """Add content around the existing content of page, which is updated in place
+
+    before and after are references to content streams; xobjects and fonts
+    are (name, reference) pairs added to the page resources.
+    """
+    resources = _resolved_copy(page.raw_get('/Resources') if '/Resources' in page else None)
+    for category, entries in (('/XObject', xobjects), ('/Font', fonts)):
+        if not entries:
+            continue
+        merged = _resolved_copy(resources.raw_get(category) if category in resources else None)
+        for name, reference in entries:
+            merged[NameObject(name)] = reference
+        resources[NameObject(category)] = merged
+    page[NameObject('/Resources')] = resources
+
+    contents = page.raw_get('/Contents') if '/Contents' in page else ArrayObject()
+    if isinstance(contents.get_object(), ArrayObject):
+        contents = list(contents.get_object())
+    else:
+        contents = [contents]
+    page[NameObject('/Contents')] = ArrayObject([before] + contents + [after])
+
+
+class Stamp:
+    """Watermark text and sequential Bates numbers added to merged pages
+
+    The font and one watermark form per page size are written once per
+    output; each page only gets a few bytes of its own content.
+    """
+
+    def __init__(self, watermark=None, bates_prefix=None, bates_start=1, bates_digits=6,
+                 font="Helvetica", font_size=10, watermark_size=60, margin=36):
+        self.watermark = watermark
+        # Bates numbering is enabled when bates_prefix is not None
+        self.bates_prefix = bates_prefix
+        self.bates_start = bates_start
+        self.bates_digits = bates_digits
+        self.font = font
+        self.font_size = font_size
+        self.watermark_size = watermark_size
+        self.margin = margin
+
+    FIELDS = ("watermark", "bates_prefix", "bates_start", "bates_digits",
+              "font", "font_size", "watermark_size", "margin")
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a stamp from a dict of its fields, or return None if it stamps nothing"""
+        if not data:
+            return None
+        stamp = cls(**{key: data[key] for key in cls.FIELDS if key in data})
+        return stamp if stamp.enabled else None
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    @property
+    def enabled(self):
+        return bool(self.watermark) or self.bates_prefix is not None
+
+    def bates_label(self, index):
+        """Return the Bates number of the page at zero-based output index"""
+        return f"{self.bates_prefix}{self.bates_start + index:0{self.bates_digits}d}"
+
+    def _text_width(self, text, size):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        return stringWidth(text, self.font, size)
+
+    def font_object(self):
+        font = DictionaryObject()
+        font[NameObject('/Type')] = NameObject('/Font')
+        font[NameObject('/Subtype')] = NameObject('/Type1')
+        font[NameObject('/BaseFont')] = NameObject('/' + self.font)
+        font[NameObject('/Encoding')] = NameObject('/WinAnsiEncoding')
+        return font
+
+    def watermark_form(self, box, font_reference):
+        """Return a form XObject drawing the watermark diagonally across box"""
+        llx, lly, urx, ury = box
+        angle = math.atan2(ury - lly, urx - llx)
+        cos, sin = math.cos(angle), math.sin(angle)
+        # Start so that the middle of the text lands on the middle of the box
+        half_width = self._text_width(self.watermark, self.watermark_size) / 2
+        half_height = self.watermark_size / 3
+        x = (llx + urx) / 2 - cos * half_width + sin * half_height
+        y = (lly + ury) / 2 - sin * half_width - cos * half_height
+        content = (
+            f"q 0.75 g BT {FONT_NAME} {self.watermark_size} Tf "
+            f"{cos:.4f} {sin:.4f} {-sin:.4f} {cos:.4f} {x:.2f} {y:.2f} Tm "
+        ).encode() + pdf_string(self.watermark) + b" Tj ET Q"
+
+        resources = DictionaryObject()
+        fonts = DictionaryObject()
+        fonts[NameObject(FONT_NAME)] = font_reference
+        resources[NameObject('/Font')] = fonts
+        return make_stream(content, {
+            '/Type': NameObject('/XObject'),
+            '/Subtype': NameObject('/Form'),
+            '/BBox': ArrayObject(FloatObject(v) for v in box),
+            '/Resources': resources,
+        })
+
+    def page_content(self, index, box):
+        """Return the content drawn on top of the page at output index"""
+        content = b"Q\n"
+        if self.watermark:
+            content += f"q {WATERMARK_NAME} Do Q\n".encode()
+        if self.bates_prefix is not None:
+            label = self.bates_label(index)
+            x = box[2] - self.margin - self._text_width(label, self.font_size)
+            y = box[1] + self.margin
+            content += (
+                f"q 0 g BT {FONT_NAME} {self.font_size} Tf {x:.2f} {y:.2f} Td ".encode()
+                + pdf_string(label) + b" Tj ET Q\n"
+            )
+        return content
+
+    def stamp_writer(self, writer):
+        """Stamp every page of a PyPDF2 PdfWriter, in output order"""
+        add_object = writer._add_object
+        save = add_object(make_stream(b"q\n"))
+        font = add_object(self.font_object())
+        forms = {}
+        for index, page in enumerate(writer.pages):
+            box = page_box(page)
+            xobjects = []
+            if self.watermark:
+                if box not in forms:
+                    forms[box] = add_object(self.watermark_form(box, font))
+                xobjects.append((WATERMARK_NAME, forms[box]))
+            after = add_object(make_stream(self.page_content(index, box)))
+            overlay_page(page, save, after, xobjects, [(FONT_NAME, font)])
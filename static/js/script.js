@@ -13,7 +13,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const themeToggle = document.getElementById('theme-toggle');
     const progressContainer = document.getElementById('progressContainer');
     const progressBar = document.getElementById('progressBar');
+    const progressStatus = document.getElementById('progressStatus');
+    const progressText = document.getElementById('progressText');
+    const cancelMergeBtn = document.getElementById('cancelMergeBtn');
     const outputInfo = document.getElementById('outputInfo');
+    const outputPath = document.getElementById('outputPath');
     const downloadBtn = document.getElementById('downloadBtn');
     const editSection = document.getElementById('editSection');
     const pageNumber = document.getElementById('pageNumber');
@@ -32,6 +36,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // State
     let uploadedFiles = [];
     let mergedFilePath = '';
+    let mergeCancelUrl = '';
     
     // Event Listeners
     selectFilesBtn.addEventListener('click', () => fileInput.click());
@@ -41,6 +46,7 @@ document.addEventListener('DOMContentLoaded', function() {
     removeSelectedBtn.addEventListener('click', removeSelectedFiles);
     clearAllBtn.addEventListener('click', clearAllFiles);
     mergeBtn.addEventListener('click', mergePDFs);
+    cancelMergeBtn.addEventListener('click', cancelMerge);
     themeToggle.addEventListener('click', toggleTheme);
     downloadBtn.addEventListener('click', downloadMergedPDF);
     removePageBtn.addEventListener('click', removePage);
@@ -94,22 +100,19 @@ document.addEventListener('DOMContentLoaded', function() {
         [...files].forEach(uploadFile);
     }
     
+    // Files larger than this are sent in resumable chunks
+    const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+    const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024;
+    const UPLOAD_RETRIES = 3;
+    
     function uploadFile(file) {
         if (file.type !== 'application/pdf') {
             alert('Please select only PDF files.');
             return;
         }
         
-        // Create FormData for file upload
-        const formData = new FormData();
-        formData.append('files[]', file);
-        
-        // Upload file via AJAX
-        fetch('/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => response.json())
+        const upload = file.size > CHUNKED_UPLOAD_THRESHOLD ? uploadInChunks(file) : uploadWhole(file);
+        upload
         .then(data => {
             if (data.error) {
                 alert(data.error);
@@ -131,6 +134,62 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function uploadWhole(file) {
+        // Create FormData for file upload
+        const formData = new FormData();
+        formData.append('files[]', file);
+        
+        return fetch('/upload', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json());
+    }
+    
+    async function uploadInChunks(file) {
+        const start = await fetch('/uploads', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ name: file.name, size: file.size })
+        }).then(response => response.json());
+        if (start.error) {
+            return start;
+        }
+        
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + UPLOAD_CHUNK_SIZE);
+            try {
+                const response = await fetch(`${start.upload_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    body: chunk
+                });
+                const data = await response.json();
+                if (response.status === 413) {
+                    return data;
+                }
+                // On a conflict the server reports where to continue from
+                offset = data.offset;
+                retries = 0;
+            } catch (error) {
+                if (++retries > UPLOAD_RETRIES) {
+                    throw error;
+                }
+                // Resume from whatever the server actually received
+                const status = await fetch(start.upload_url).then(response => response.json());
+                offset = status.offset;
+            }
+        }
+        
+        return fetch(`${start.upload_url}/complete`, {
+            method: 'POST'
+        })
+        .then(response => response.json());
+    }
+    
     function renderFileList() {
         filesList.innerHTML = '';
         
@@ -138,11 +197,12 @@ document.addEventListener('DOMContentLoaded', function() {
             const li = document.createElement('li');
             li.className = 'file-item';
             li.dataset.index = index;
+            li.dataset.path = file.path;
             
             li.innerHTML = `
                 <input type="checkbox" data-index="${index}">
                 <span class="file-name">${file.name}</span>
-                <span class="file-pages">(loading...)</span>
+                <span class="file-pages">${formatPageCount(file)}</span>
             `;
             
             li.addEventListener('click', function(e) {
@@ -154,31 +214,77 @@ document.addEventListener('DOMContentLoaded', function() {
             });
             
             filesList.appendChild(li);
-            
-            // Get page count for the file
-            getPageCount(file.path, index);
         });
+        
+        // Fetch page counts for files that don't have them yet
+        fetchMetadata();
     }
     
-    function getPageCount(filePath, index) {
-        // In a real implementation, we would get this from the server
-        // For now, we'll simulate it
-        setTimeout(() => {
-            const fileItems = document.querySelectorAll('.file-item');
-            if (fileItems[index]) {
-                const pagesSpan = fileItems[index].querySelector('.file-pages');
-                // Simulate getting page count (in a real app, this would come from server)
-                const pageCount = Math.floor(Math.random() * 10) + 1;
-                pagesSpan.textContent = `(${pageCount} pages)`;
-                updateFileStats();
+    function formatPageCount(file) {
+        if (file.page_count === undefined) {
+            return file.metadata_failed ? '(page count unavailable)' : '(loading...)';
+        }
+        return `(${file.page_count} pages)`;
+    }
+    
+    function fetchMetadata() {
+        // Ask the server for all missing page counts in one request
+        const missing = uploadedFiles.filter(file => file.page_count === undefined);
+        if (missing.length === 0) {
+            updateFileStats();
+            return;
+        }
+        
+        missing.forEach(file => {
+            file.metadata_failed = false;
+        });
+        
+        fetch('/metadata', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ paths: missing.map(file => file.path) })
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Metadata request failed with status ${response.status}`);
             }
-        }, 500);
+            return response.json();
+        })
+        .then(data => {
+            // The list may have changed while the request was running,
+            // so files and rows are matched by path rather than by position
+            uploadedFiles.forEach(file => {
+                const metadata = data.files[file.path];
+                if (metadata) {
+                    file.page_count = metadata.page_count || 0;
+                    updatePageCount(file);
+                }
+            });
+            updateFileStats();
+        })
+        .catch(error => {
+            console.error('Error fetching metadata:', error);
+            missing.forEach(file => {
+                file.metadata_failed = true;
+                updatePageCount(file);
+            });
+        });
+    }
+    
+    function updatePageCount(file) {
+        // Identical uploads share a path, so every matching row is updated
+        filesList.querySelectorAll('.file-item').forEach(li => {
+            if (li.dataset.path === file.path) {
+                li.querySelector('.file-pages').textContent = formatPageCount(file);
+            }
+        });
     }
     
     function updateFileStats() {
         const totalFiles = uploadedFiles.length;
-        // In a real implementation, we would calculate actual page count
-        const totalPages = totalFiles * 5; // Simulated
+        const totalPages = uploadedFiles.reduce((sum, file) => sum + (file.page_count || 0), 0);
         fileStats.textContent = `Total files: ${totalFiles} | Total pages: ${totalPages}`;
     }
     
@@ -311,9 +417,13 @@ document.addEventListener('DOMContentLoaded', function() {
     function mergePDFs() {
         // Show progress
         progressContainer.style.display = 'block';
-        progressBar.style.width = '30%';
+        progressBar.style.width = '0%';
+        progressText.textContent = 'Waiting to start...';
+        progressStatus.style.display = 'flex';
+        cancelMergeBtn.disabled = false;
+        mergeBtn.disabled = true;
         
-        // Send merge request
+        // Queue the merge job
         fetch('/merge', {
             method: 'POST',
             headers: {
@@ -321,44 +431,143 @@ document.addEventListener('DOMContentLoaded', function() {
             },
             body: JSON.stringify({ files: uploadedFiles })
         })
-        .then(response => {
-            progressBar.style.width = '70%';
-            return response.json();
-        })
+        .then(response => response.json())
         .then(data => {
-            progressBar.style.width = '100%';
-            
             if (data.error) {
                 alert('Merge error: ' + data.error);
-                progressContainer.style.display = 'none';
+                hideMergeProgress();
                 return;
             }
             
-            // Store merged file path
-            mergedFilePath = data.output_path;
-            
-            // Show success message
-            setTimeout(() => {
-                progressContainer.style.display = 'none';
-                outputInfo.style.display = 'block';
-                downloadBtn.style.display = 'inline-block';
-                
-                // Show edit section
-                editSection.style.display = 'block';
-                
-                alert(`PDFs merged successfully!\nTotal pages: ${data.total_pages}`);
-            }, 500);
+            mergeCancelUrl = data.cancel_url;
+            watchMergeJob(data.events_url, data.status_url);
         })
         .catch(error => {
             console.error('Error:', error);
-            progressContainer.style.display = 'none';
+            hideMergeProgress();
             alert('Error merging PDFs.');
         });
     }
     
+    function hideMergeProgress() {
+        progressContainer.style.display = 'none';
+        progressStatus.style.display = 'none';
+        mergeBtn.disabled = uploadedFiles.length === 0;
+    }
+    
+    function isRunning(data) {
+        return data.state === 'queued' || data.state === 'running';
+    }
+    
+    function showMergeProgress(data) {
+        if (data.state === 'queued') {
+            progressText.textContent = 'Waiting to start...';
+            return;
+        }
+        if (data.fraction === undefined) {
+            return;
+        }
+        progressBar.style.width = `${100 * data.fraction}%`;
+        let text = `${data.files_done} of ${data.total_files} files, ${data.pages_processed} pages`;
+        if (data.eta !== null) {
+            text += `, about ${Math.ceil(data.eta)}s left`;
+        }
+        progressText.textContent = text;
+    }
+    
+    function watchMergeJob(eventsUrl, statusUrl) {
+        // Server-sent events push every change; polling is the fallback
+        if (!window.EventSource) {
+            pollMergeJob(statusUrl);
+            return;
+        }
+        const events = new EventSource(eventsUrl);
+        let finished = false;
+        events.onmessage = event => {
+            const data = JSON.parse(event.data);
+            if (isRunning(data)) {
+                showMergeProgress(data);
+                return;
+            }
+            finished = true;
+            events.close();
+            finishMergeJob(data);
+        };
+        events.onerror = () => {
+            events.close();
+            if (!finished) {
+                pollMergeJob(statusUrl);
+            }
+        };
+    }
+    
+    function pollMergeJob(statusUrl) {
+        fetch(statusUrl)
+        .then(response => response.json())
+        .then(data => {
+            if (isRunning(data)) {
+                showMergeProgress(data);
+                setTimeout(() => pollMergeJob(statusUrl), 500);
+                return;
+            }
+            finishMergeJob(data);
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            hideMergeProgress();
+            alert('Error checking merge status.');
+        });
+    }
+    
+    function cancelMerge() {
+        if (!mergeCancelUrl) {
+            return;
+        }
+        cancelMergeBtn.disabled = true;
+        progressText.textContent = 'Cancelling...';
+        fetch(mergeCancelUrl, { method: 'POST' })
+        .catch(error => {
+            console.error('Error cancelling merge:', error);
+        });
+    }
+    
+    function finishMergeJob(data) {
+        mergeCancelUrl = '';
+        progressBar.style.width = '100%';
+        
+        if (data.state === 'cancelled') {
+            hideMergeProgress();
+            return;
+        }
+        
+        if (data.state === 'failed' || data.error) {
+            alert('Merge error: ' + data.error);
+            hideMergeProgress();
+            return;
+        }
+        
+        // Store merged file path
+        mergedFilePath = data.result.output_path;
+        outputPath.textContent = mergedFilePath.split('/').pop().split('\\').pop();
+        
+        // Show success message
+        setTimeout(() => {
+            hideMergeProgress();
+            outputInfo.style.display = 'block';
+            downloadBtn.style.display = 'inline-block';
+            
+            // Show edit section
+            editSection.style.display = 'block';
+            
+            alert(`PDFs merged successfully!\nTotal pages: ${data.result.total_pages}`);
+        }, 500);
+    }
+    
     function downloadMergedPDF() {
+        // Each merge result has its own file name
+        const filename = mergedFilePath.split('/').pop().split('\\').pop();
         // Redirect to download endpoint
-        window.location.href = '/download/merged.pdf';
+        window.location.href = `/download/${filename}`;
     }
     
     function removePage() {
@@ -0,0 +1,562 @@
+"""Incremental PDF writer that flushes objects to the output as pages are added"""
+import hashlib
+import io
+from array import array
+from collections import OrderedDict
+
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    StreamObject,
+)
+
+from pdf_optimizer import (
+    DEFAULT_LEVEL,
+    OBJECTS_PER_STREAM,
+    check_level,
+    compress_stream,
+    compresses,
+    object_stream,
+    packs,
+    serialize,
+    xref_stream,
+)
+from stamper import FONT_NAME, WATERMARK_NAME, make_stream, overlay_page, page_box
+
+# Object numbers reserved for the page tree root and the catalog
+PAGES_OBJECT = 1
+CATALOG_OBJECT = 2
+
+# Local number that fragments use to refer to the output page tree root
+LOCAL_PAGES = 0
+
+# Default cap on bytes buffered in memory before flushing and trimming caches
+DEFAULT_MEMORY_LIMIT = 32 * 1024 * 1024
+# Approximate bytes one remembered digest costs; memory_limit divided by
+# this is how many written objects deduplication remembers
+DEDUPE_ENTRY_BYTES = 256
+
+
+class OutputError(Exception):
+    """Raised when the output stream cannot be written"""
+
+
+class LocalReference(IndirectObject):
+    """Reference to a fragment-local object number
+
+    Nothing is written for the reference itself; its position is recorded
+    so the final "N 0 R" can be inserted once the fragment is numbered.
+    """
+
+    def __init__(self, number, refs):
+        super().__init__(number, 0, None)
+        self.refs = refs
+
+    def write_to_stream(self, stream, encryption_key):
+        self.refs.append((stream.tell(), self.idnum))
+
+
+class PdfFragment:
+    """Serialized objects copied from one source, numbered from 1 locally
+
+    Fragments hold only bytes and integers so they can be produced in a
+    worker process and sent back to the writer.
+    """
+
+    def __init__(self):
+        # (local number, object body, [(offset, local target), ...]); stamp
+        # objects the writer fills in are (local number, None, spec)
+        self.objects = []
+        # Local numbers of the copied pages, in order
+        self.pages = []
+        # Local numbers of objects that must not be merged with identical
+        # ones (pages and their annotations)
+        self.unique = set()
+        # Local numbers of stream objects, which cannot go in object streams
+        self.streams = set()
+        # Number of local object numbers used so far
+        self.object_count = 0
+        self.size = 0
+        # Images recompressed for this fragment and the bytes that saved
+        self.images_optimized = 0
+        self.image_bytes_saved = 0
+
+    def take_objects(self):
+        """Remove and return the serialized objects collected so far"""
+        objects = self.objects
+        self.objects = []
+        self.size = 0
+        return objects
+
+
+class _Pending(list):
+    """Objects waiting to be serialized, plus the current reference log"""
+
+    def __init__(self):
+        super().__init__()
+        self.refs = []
+
+
+class FragmentBuilder:
+    """Serialize pages of a single reader into a PdfFragment"""
+
+    def __init__(self, reader, memory_limit=DEFAULT_MEMORY_LIMIT, stamp=None, compress=False,
+                 replacements=None):
+        self.reader = reader
+        self.memory_limit = memory_limit
+        # Optional stamper.Stamp; pages then refer to placeholder objects
+        self.stamp = stamp
+        # Deflate unfiltered streams while serializing
+        self.compress = compress
+        # Objects written instead of reader objects, by (generation, idnum),
+        # e.g. recompressed images
+        self.replacements = replacements or {}
+        self.fragment = PdfFragment()
+        # Maps (generation, idnum) in the reader to local numbers
+        self.translated = {}
+        # Local numbers of shared stamp placeholders, by spec
+        self.placeholders = {}
+        self.bytes_since_trim = 0
+
+    def _allocate(self):
+        self.fragment.object_count += 1
+        return self.fragment.object_count
+
+    def _reference(self, ref, pending):
+        """Translate a source reference, queueing the object if unseen"""
+        if ref.pdf is None:
+            # Already local, e.g. the /Parent of a copied page
+            return LocalReference(ref.idnum, pending.refs)
+        key = (ref.generation, ref.idnum)
+        if key not in self.translated:
+            obj = self.replacements.get(key) or ref.get_object()
+            # Never follow links into other parts of the source page tree
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Page", "/Pages"):
+                return NullObject()
+            self.translated[key] = self._allocate()
+            pending.append((self.translated[key], obj))
+        return LocalReference(self.translated[key], pending.refs)
+
+    def _translate(self, obj, pending):
+        """Return a copy of obj that refers to local object numbers"""
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj, pending)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for key, value in obj.items():
+                copy[NameObject(key)] = self._translate(value, pending)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self._translate(value, pending)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._translate(value, pending) for value in obj)
+        return obj
+
+    def _serialize(self, number, obj, pending):
+        pending.refs = []
+        copy = self._translate(obj, pending)
+        if isinstance(copy, StreamObject):
+            self.fragment.streams.add(number)
+            if self.compress:
+                copy = compress_stream(copy)
+        data = serialize(copy)
+        self.fragment.objects.append((number, data, pending.refs))
+        self.fragment.size += len(data)
+        self.bytes_since_trim += len(data)
+
+    def _placeholder(self, spec):
+        """Reference an object the writer generates from spec"""
+        if spec in self.placeholders:
+            number = self.placeholders[spec]
+        else:
+            number = self._allocate()
+            self.fragment.objects.append((number, None, spec))
+            # Per-page stamps are never shared
+            if spec[0] != "page":
+                self.placeholders[spec] = number
+        return IndirectObject(number, 0, None)
+
+    def _stamp_page(self, copy, page):
+        """Point a copied page at the shared stamp font, watermark and its own stamp"""
+        box = page_box(page)
+        fonts = [(FONT_NAME, self._placeholder(("font",)))]
+        xobjects = []
+        if self.stamp.watermark:
+            xobjects.append((WATERMARK_NAME, self._placeholder(("watermark", box))))
+        after = self._placeholder(("page", len(self.fragment.pages), box))
+        overlay_page(copy, self._placeholder(("save",)), after, xobjects, fonts)
+
+    def add_page(self, page):
+        """Serialize a page and every object it references"""
+        pending = _Pending()
+        if page.indirect_reference is not None:
+            key = (page.indirect_reference.generation, page.indirect_reference.idnum)
+            if key not in self.translated:
+                self.translated[key] = self._allocate()
+            number = self.translated[key]
+            if number in self.fragment.unique:
+                # The same page selected twice becomes two page objects
+                number = self._allocate()
+        else:
+            number = self._allocate()
+
+        copy = DictionaryObject()
+        for key, value in page.items():
+            if key != "/Parent":
+                copy[NameObject(key)] = value
+        copy[NameObject("/Parent")] = IndirectObject(LOCAL_PAGES, 0, None)
+        if self.stamp is not None:
+            self._stamp_page(copy, page)
+        self._serialize(number, copy, pending)
+
+        while pending:
+            ref_number, obj = pending.pop()
+            self._serialize(ref_number, obj, pending)
+
+        self.fragment.pages.append(number)
+        self.fragment.unique.add(number)
+        # Each annotation belongs to exactly one page
+        annotations = page.get("/Annots")
+        if isinstance(annotations, ArrayObject):
+            for annotation in annotations:
+                if isinstance(annotation, IndirectObject):
+                    key = (annotation.generation, annotation.idnum)
+                    if key in self.translated:
+                        self.fragment.unique.add(self.translated[key])
+
+        # Drop parsed objects of large sources once enough has been written
+        if self.bytes_since_trim >= self.memory_limit:
+            self.reader.resolved_objects.clear()
+            self.bytes_since_trim = 0
+        return number
+
+    def release(self):
+        """Free the parsed objects of the reader"""
+        # Pages and the reader refer to each other; break the cycle so
+        # the parsed objects are freed now rather than at the next GC
+        self.reader.resolved_objects.clear()
+        self.reader.flattened_pages = None
+        self.translated = {}
+        self.placeholders = {}
+
+
+def build_fragment(reader, pages, memory_limit=DEFAULT_MEMORY_LIMIT, stamp=None, compress=False,
+                   replacements=None):
+    """Serialize the given pages of a reader into one complete fragment"""
+    builder = FragmentBuilder(
+        reader, memory_limit=memory_limit, stamp=stamp, compress=compress, replacements=replacements
+    )
+    try:
+        for page in pages:
+            builder.add_page(page)
+    finally:
+        builder.release()
+    return builder.fragment
+
+
+class StreamingPdfWriter:
+    """Write a PDF one source at a time without keeping copied objects in memory
+
+    Objects are written as soon as they are serialized; only object
+    offsets and page numbers are kept until close(). optimize is a
+    pdf_optimizer level; with object streams, non-stream objects are packed
+    as each source completes and close() writes a cross-reference stream.
+    """
+
+    def __init__(self, stream, memory_limit=DEFAULT_MEMORY_LIMIT, stamp=None, dedupe=True,
+                 optimize=DEFAULT_LEVEL, images=None):
+        self.stream = stream
+        self.memory_limit = memory_limit
+        self.stamp = stamp
+        # Optional image_optimizer.ImageOptimizer run on each source's pages
+        self.images = images
+        # Output numbers of stamp objects shared by all pages, by spec
+        self.shared = {}
+        # Output numbers of the current fragment's placeholders and
+        # deduplicated objects, by local number
+        self.numbers = {}
+        # When set, objects identical to one already written are replaced
+        # by references to it; seen maps content digests to object numbers
+        # for the most recently used objects, so it stays within memory_limit
+        self.dedupe = dedupe
+        self.seen = OrderedDict()
+        self.max_seen = max(1, memory_limit // DEDUPE_ENTRY_BYTES)
+        self.objects_deduplicated = 0
+        self.bytes_saved = 0
+        check_level(optimize)
+        self.compress = compresses(optimize)
+        self.pack = packs(optimize)
+        # (number, body) of objects waiting for an object stream
+        self.packed = []
+        self.buffer = io.BytesIO()
+        # Bytes written before the current buffer
+        self.flushed = 0
+        # Byte offset of every written object, indexed by number (0 = free);
+        # compact arrays keep bookkeeping small for very large jobs
+        self.offsets = array('q', [0] * (CATALOG_OBJECT + 1))
+        # Object stream holding each packed object (0 = not packed); offsets
+        # then holds the index within that stream
+        self.containers = array('q', [0] * (CATALOG_OBJECT + 1))
+        self.next_number = CATALOG_OBJECT + 1
+        self.page_numbers = array('q')
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.memory_limit:
+            self.flush()
+
+    def _position(self):
+        return self.flushed + self.buffer.tell()
+
+    def flush(self):
+        """Move buffered bytes to the output stream"""
+        data = self.buffer.getvalue()
+        if data:
+            try:
+                self.stream.write(data)
+            except Exception as e:
+                raise OutputError(str(e)) from e
+            self.flushed += len(data)
+        self.buffer = io.BytesIO()
+
+    def _locate(self, number, offset, container=0):
+        if number >= len(self.offsets):
+            grow = [0] * (number + 1 - len(self.offsets))
+            self.offsets.extend(grow)
+            self.containers.extend(grow)
+        self.offsets[number] = offset
+        self.containers[number] = container
+
+    def _emit(self, number, body, stream):
+        """Write a serialized object, or queue it for an object stream"""
+        if self.pack and not stream:
+            self.packed.append((number, body))
+            return
+        self._locate(number, self._position())
+        self._write(f"{number} 0 obj\n".encode())
+        self._write(body)
+        self._write(b"\nendobj\n")
+
+    def _write_object(self, number, obj):
+        if self.compress:
+            obj = compress_stream(obj)
+        self._emit(number, serialize(obj), isinstance(obj, StreamObject))
+
+    def _flush_packed(self, allocate=None):
+        """Write queued objects as object streams numbered by allocate()
+
+        By default numbers are taken from next_number, which is only valid
+        between sources.
+        """
+        while self.packed:
+            bodies = self.packed[:OBJECTS_PER_STREAM]
+            del self.packed[:OBJECTS_PER_STREAM]
+            if allocate is None:
+                number = self.next_number
+                self.next_number += 1
+            else:
+                number = allocate()
+            for index, (packed, _) in enumerate(bodies):
+                self._locate(packed, index, number)
+            self._emit(number, serialize(object_stream(bodies)), True)
+
+    def _write_placeholder(self, local, spec, base):
+        """Generate the stamp object a fragment placeholder stands for"""
+        kind = spec[0]
+        if kind != "page" and spec in self.shared:
+            self.numbers[local] = self.shared[spec]
+            return
+        number = self.numbers[local] = base + local
+        if kind == "page":
+            # Pages before this fragment are already committed
+            obj = make_stream(self.stamp.page_content(len(self.page_numbers) + spec[1], spec[2]))
+        else:
+            self.shared[spec] = number
+            if kind == "font":
+                obj = self.stamp.font_object()
+            elif kind == "save":
+                obj = make_stream(b"q\n")
+            else:
+                obj = self.stamp.watermark_form(spec[1], IndirectObject(self.shared[("font",)], 0, None))
+        self._write_object(number, obj)
+
+    def _target(self, target, base):
+        if target == LOCAL_PAGES:
+            return PAGES_OBJECT
+        return self.numbers.get(target, base + target)
+
+    def _write_resolved(self, local, data, refs, base, unique, stream):
+        """Write one fragment object, or reuse an identical written object"""
+        parts = []
+        start = 0
+        for offset, target in refs:
+            parts.append(data[start:offset])
+            parts.append(f"{self._target(target, base)} 0 R".encode())
+            start = offset
+        parts.append(data[start:])
+        body = b"".join(parts)
+
+        number = base + local
+        if self.dedupe and not unique:
+            digest = hashlib.sha256(body).digest()
+            existing = self.seen.get(digest)
+            if existing is not None:
+                self.seen.move_to_end(digest)
+                self.numbers[local] = existing
+                self.objects_deduplicated += 1
+                self.bytes_saved += len(body)
+                return
+            self.seen[digest] = number
+            if len(self.seen) > self.max_seen:
+                self.seen.popitem(last=False)
+        self._emit(number, body, stream)
+
+    def _write_fragment_objects(self, objects, base, unique=(), streams=()):
+        """Write serialized fragment objects renumbered from base
+
+        Objects are written after the objects they refer to, so identical
+        resources (fonts, images, ICC profiles) resolve to identical bytes
+        and are written only once. Objects in reference cycles are always
+        written.
+        """
+        pending = {}
+        for local, data, refs in objects:
+            if data is None:
+                self._write_placeholder(local, refs, base)
+            else:
+                pending[local] = (data, refs)
+
+        expanded = set()
+        cyclic = set()
+        for root in list(pending):
+            stack = [(root, False)]
+            while stack:
+                local, ready = stack.pop()
+                if local not in pending:
+                    continue
+                if ready:
+                    data, refs = pending.pop(local)
+                    self._write_resolved(
+                        local, data, refs, base, local in unique or local in cyclic, local in streams
+                    )
+                    continue
+                if local in expanded:
+                    continue
+                expanded.add(local)
+                stack.append((local, True))
+                for _, target in pending[local][1]:
+                    if target not in pending:
+                        continue
+                    if target in expanded:
+                        # Still pending after expansion: an ancestor on this path
+                        cyclic.add(target)
+                    else:
+                        stack.append((target, False))
+
+    def add_fragment(self, fragment):
+        """Write a complete fragment and add its pages to the page tree"""
+        base = self.next_number - 1
+        self.numbers = {}
+        self._write_fragment_objects(fragment.take_objects(), base, fragment.unique, fragment.streams)
+        self.next_number = base + fragment.object_count + 1
+        self.page_numbers.extend(base + page for page in fragment.pages)
+        self._flush_packed()
+        self.flush()
+        return len(fragment.pages)
+
+    def add_pages(self, reader, pages):
+        """Copy pages of a reader, flushing whenever memory_limit is reached
+
+        The pages join the page tree only if every one of them was copied.
+        """
+        base = self.next_number - 1
+        self.numbers = {}
+        replacements = self.images.optimize_pages(pages) if self.images is not None else None
+        builder = FragmentBuilder(
+            reader, memory_limit=self.memory_limit, stamp=self.stamp, compress=self.compress,
+            replacements=replacements
+        )
+        fragment = builder.fragment
+        try:
+            for page in pages:
+                builder.add_page(page)
+                if fragment.size >= self.memory_limit:
+                    self._write_fragment_objects(fragment.take_objects(), base, fragment.unique, fragment.streams)
+                    # Object streams take numbers from the fragment's range
+                    self._flush_packed(lambda: base + builder._allocate())
+            self._write_fragment_objects(fragment.take_objects(), base, fragment.unique, fragment.streams)
+            self.page_numbers.extend(base + page for page in fragment.pages)
+        finally:
+            # Numbers used by a failed source stay allocated (and unreferenced)
+            self.next_number = base + fragment.object_count + 1
+            builder.release()
+            self._flush_packed()
+            self.flush()
+        return len(fragment.pages)
+
+    def _write_xref_stream(self):
+        """Write a cross-reference stream indexing every object"""
+        self._flush_packed()
+        number = self.next_number
+        self.next_number += 1
+        position = self._position()
+        self._locate(number, position)
+
+        def entries():
+            yield (0, 0, 65535)
+            for n in range(1, self.next_number):
+                if n < len(self.offsets) and self.containers[n]:
+                    yield (2, self.containers[n], self.offsets[n])
+                elif n < len(self.offsets) and self.offsets[n]:
+                    yield (1, self.offsets[n], 0)
+                else:
+                    yield (0, 0, 65535)
+
+        trailer = {"/Root": IndirectObject(CATALOG_OBJECT, 0, None)}
+        self._emit(number, serialize(xref_stream(entries(), self.next_number, position, trailer)), True)
+        self._write(f"startxref\n{position}\n%%EOF\n".encode())
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer"""
+        # Serialized directly, so no object is built per page
+        kids = io.BytesIO()
+        for number in self.page_numbers:
+            kids.write(b"%d 0 R " % number)
+        self._emit(
+            PAGES_OBJECT,
+            b"<<\n/Type /Pages\n/Kids [ " + kids.getvalue() + b"]\n/Count %d\n>>" % len(self.page_numbers),
+            False
+        )
+
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = IndirectObject(PAGES_OBJECT, 0, None)
+        self._write_object(CATALOG_OBJECT, catalog)
+
+        if self.pack:
+            self._write_xref_stream()
+            self.flush()
+            return
+
+        xref_position = self._position()
+        self._write(f"xref\n0 {self.next_number}\n".encode())
+        self._write(b"0000000000 65535 f \n")
+        for number in range(1, self.next_number):
+            # Numbers allocated for objects that were never written are free
+            if number < len(self.offsets) and self.offsets[number]:
+                self._write(f"{self.offsets[number]:010} 00000 n \n".encode())
+            else:
+                self._write(b"0000000000 65535 f \n")
+        self._write(
+            f"trailer\n<< /Size {self.next_number} /Root {CATALOG_OBJECT} 0 R >>\n"
+            f"startxref\n{xref_position}\n%%EOF\n".encode()
+        )
+        self.flush()
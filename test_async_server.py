@@ -0,0 +1,132 @@
+import asyncio
+import http.client
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PyPDF2 import PdfReader
+
+import web_pdf_merger
+from async_server import HttpServer, create_app
+from test_web_api import TEST_DIR, make_client
+
+
+class ServerThread:
+    """Run the asyncio server on a free port in a background thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = HttpServer(create_app(threads=8, cpu_workers=1), port=0)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=30)
+
+
+def post_json(conn, url, data):
+    conn.request('POST', url, json.dumps(data), {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def upload(conn, *names):
+    """Upload test PDFs as multipart form data"""
+    boundary = 'test-boundary'
+    body = b''
+    for name in names:
+        with open(os.path.join(TEST_DIR, name), 'rb') as f:
+            content = f.read()
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="files[]"; filename="{name}"\r\n'
+                 f'Content-Type: application/pdf\r\n\r\n').encode() + content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    conn.request('POST', '/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    response = conn.getresponse()
+    assert response.status == 200, f"Upload failed with status {response.status}"
+    return json.loads(response.read())['files']
+
+
+def test_async_server():
+    """Test serving the web app through the ASGI adapter and asyncio server"""
+    print("Testing async server...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_client(tmp)
+        with ServerThread() as server:
+            conn = server.connect()
+            conn.request('GET', '/')
+            response = conn.getresponse()
+            assert response.status == 200 and b'<html' in response.read().lower()
+
+            # The connection is kept alive between requests
+            uploaded = upload(conn, "test1.pdf", "test2.pdf")
+            assert [f['page_count'] for f in uploaded] == [1, 1]
+
+            # A streamed merge is sent chunked as it is written
+            conn.request('POST', '/merge', json.dumps({'files': uploaded, 'stream': True}),
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            assert response.getheader('Transfer-Encoding') == 'chunked'
+            assert len(PdfReader(io.BytesIO(response.read())).pages) == 2
+
+            # A client that sends its body slowly does not hold up others
+            slow = socket.create_connection(('127.0.0.1', server.server.port))
+            slow.sendall(b'POST /upload HTTP/1.1\r\nHost: test\r\nContent-Length: 1000\r\n'
+                         b'Content-Type: multipart/form-data; boundary=x\r\n\r\n--x')
+            other = server.connect()
+            start = time.time()
+            response, _ = post_json(other, '/metadata', {'paths': [uploaded[0]['path']]})
+            assert response.status == 200 and time.time() - start < 5
+            slow.close()
+
+            # A malformed or negative Content-Length is rejected
+            for length in (b'abc', b'-5'):
+                bad = socket.create_connection(('127.0.0.1', server.server.port), timeout=10)
+                bad.sendall(b'POST /metadata HTTP/1.1\r\nHost: test\r\nContent-Length: ' + length + b'\r\n\r\n')
+                assert bad.recv(1024).startswith(b'HTTP/1.1 400'), f"Content-Length {length} not rejected"
+                bad.close()
+
+            # Edits and merges run in the CPU pool
+            assert web_pdf_merger.cpu_pool is not None
+            response, body = post_json(conn, '/edit/rotate_page', {'pdf_path': uploaded[0]['path'], 'page_num': 0})
+            output_path = json.loads(body)['output_path']
+            assert response.status == 200 and PdfReader(output_path).pages[0].rotation == 90
+
+            response, body = post_json(conn, '/merge', {'files': uploaded, 'stamp': {'bates_prefix': 'POOL'}})
+            status_url = json.loads(body)['status_url']
+            deadline = time.time() + 60
+            while True:
+                conn.request('GET', status_url)
+                data = json.loads(conn.getresponse().read())
+                if data['state'] not in ('queued', 'running') or time.time() > deadline:
+                    break
+                time.sleep(0.05)
+            assert data['state'] == 'done', f"Merge in the CPU pool failed: {data}"
+            assert data['pages_processed'] == 2 and data['fraction'] == 1.0, "Worker progress not reported"
+            assert "POOL000002" in PdfReader(data['result']['output_path']).pages[1].extract_text()
+            conn.close()
+            other.close()
+
+        assert web_pdf_merger.cpu_pool is None, "Shutdown should close the CPU pool"
+
+    print("Async server test PASSED")
+
+
+if __name__ == "__main__":
+    test_async_server()
+    print("ALL ASYNC SERVER TESTS PASSED!")
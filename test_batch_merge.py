@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PyPDF2 import PdfReader
+
+import batch_merge
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_arguments_and_globs():
+    """Test a single job given on the command line with a glob pattern"""
+    print("Testing batch CLI arguments...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out.pdf")
+        pattern = os.path.join(TEST_DIR, "test[12].pdf")
+        status = batch_merge.main(["-o", output, pattern, os.path.join(TEST_DIR, "test1.pdf")], {})
+        assert status == batch_merge.EXIT_OK, f"Unexpected exit status {status}"
+        texts = [page.extract_text().strip() for page in PdfReader(output).pages]
+        assert texts == ["Test PDF 1", "Test PDF 2", "Test PDF 1"], f"Unexpected pages {texts}"
+
+        # Page ranges survive glob expansion
+        status = batch_merge.main(["-o", output, pattern + ":1", os.path.join(TEST_DIR, "test1.pdf:-1")], {})
+        assert status == batch_merge.EXIT_OK and len(PdfReader(output).pages) == 3
+        assert batch_merge.main(["-o", output, os.path.join(TEST_DIR, "test1.pdf:0")], {}) == batch_merge.EXIT_USAGE
+
+        # Neither inputs nor a manifest is a usage error
+        assert batch_merge.main([], {}) == batch_merge.EXIT_USAGE
+
+    print("Batch CLI arguments test PASSED")
+
+
+def test_manifest_exit_codes():
+    """Test that manifest jobs run concurrently and set the exit status"""
+    print("Testing batch CLI manifest...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = os.path.join(tmp, "jobs.jsonl")
+        good = [os.path.join(TEST_DIR, "test1.pdf"), os.path.join(TEST_DIR, "test2.pdf")]
+        jobs = [
+            {"output": os.path.join(tmp, "a.pdf"), "inputs": good},
+            {"output": os.path.join(tmp, "b.pdf"), "inputs": good, "strategy": "stream", "optimize": "full"},
+            {"output": os.path.join(tmp, "c.pdf"), "inputs": good + ["missing.pdf"]},
+        ]
+        with open(manifest, 'w') as f:
+            f.write("# merge jobs\n")
+            f.writelines(json.dumps(job) + "\n" for job in jobs)
+
+        status = batch_merge.main(["--manifest", manifest, "--jobs", "2"], {})
+        assert status == batch_merge.EXIT_PARTIAL, f"Skipped inputs should give status 1, got {status}"
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            assert len(PdfReader(os.path.join(tmp, name)).pages) == 2, f"{name} has wrong page count"
+
+        # --strict turns the partial job into a failed one
+        status = batch_merge.main(["--manifest", manifest, "--strict"], {})
+        assert status == batch_merge.EXIT_FAILED, f"Failed jobs should give status 3, got {status}"
+
+        with open(manifest, 'a') as f:
+            f.write('{"output": "x.pdf", "inputs": ["a.pdf"], "strategy": "bogus"}\n')
+        assert batch_merge.main(["--manifest", manifest], {}) == batch_merge.EXIT_USAGE
+
+    print("Batch CLI manifest test PASSED")
+
+
+def test_command_line_entry_point():
+    """Test that pdf_merger.py --cli with arguments exits with the job status"""
+    print("Testing pdf_merger.py --cli entry point...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out.pdf")
+        process = subprocess.run(
+            [sys.executable, "pdf_merger.py", "--cli", "-o", output, "test1.pdf", "missing.pdf"],
+            cwd=TEST_DIR, capture_output=True, text=True
+        )
+        assert process.returncode == batch_merge.EXIT_PARTIAL, process.stdout + process.stderr
+        assert "[partial]" in process.stdout and "missing.pdf" in process.stdout
+        assert len(PdfReader(output).pages) == 1
+
+    print("Command-line entry point test PASSED")
+
+
+if __name__ == "__main__":
+    test_arguments_and_globs()
+    test_manifest_exit_codes()
+    test_command_line_entry_point()
+    print("ALL BATCH CLI TESTS PASSED!")
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from file_list import UNKNOWN, UNREADABLE, FileListModel
+
+
+def make_model(names):
+    model = FileListModel()
+    model.extend(names)
+    return model
+
+
+def test_bulk_operations():
+    """Test moving, sorting and removing many entries at once"""
+    print("Testing file list operations...")
+
+    model = make_model(["a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"])
+    assert model.move([0, 2, 3], -1) == [0, 1, 2], "Blocked entries should stay put"
+    assert model.entries == ["a.pdf", "c.pdf", "d.pdf", "b.pdf", "e.pdf"]
+    assert model.move([2, 4], 1) == [3, 4]
+    assert model.entries == ["a.pdf", "c.pdf", "b.pdf", "d.pdf", "e.pdf"]
+
+    assert model.sort("name", [1]) == [2], "Selection should follow the sort"
+    assert model.entries == ["a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"]
+
+    model.set_pages([1], "1-2")
+    model.remove([0, 3])
+    assert model.entries == ["b.pdf:1-2", "c.pdf", "e.pdf"]
+    assert model.paths() == {"b.pdf", "c.pdf", "e.pdf"}
+
+    print("File list operations test PASSED")
+
+
+def test_page_counts():
+    """Test that counts follow metadata, page ranges and removals"""
+    print("Testing file list page counts...")
+
+    model = make_model(["a.pdf", "b.pdf:2,-1", "b.pdf", "bad.pdf"])
+    assert model.totals() == (0, 4)
+    assert model.row_text(0) == "a.pdf   (reading...)"
+
+    model.update_info({"a.pdf": {"page_count": 1}, "b.pdf": {"page_count": 10}})
+    assert list(model.counts) == [1, 2, 10, UNKNOWN]
+    assert model.totals() == (13, 1)
+    assert model.row_text(0) == "a.pdf   (1 page)" and model.row_text(1) == "b.pdf:2,-1   (2 pages)"
+
+    model.update_info({"bad.pdf": {"page_count": 0, "error": "broken"}})
+    assert model.counts[3] == UNREADABLE and model.totals() == (13, 0)
+    assert model.row_text(3) == "bad.pdf   (unreadable)"
+
+    # Ranges beyond the document count as no pages
+    model.set_pages([0], "5")
+    assert model.counts[0] == 0
+    assert model.sort("pages") == [] and model.entries[0] == "bad.pdf"
+
+    model.remove([model.entries.index("b.pdf")])
+    assert "b.pdf" in model.info, "Files still listed with another range keep their metadata"
+    model.remove([model.entries.index("b.pdf:2,-1")])
+    assert "b.pdf" not in model.info
+
+    print("File list page counts test PASSED")
+
+
+def test_large_list():
+    """Test that bulk operations on 50,000 entries stay fast"""
+    print("Testing large file list...")
+
+    count = 50000
+    model = make_model([f"dir/file{i:05}.pdf" for i in range(count)])
+    model.update_info({f"dir/file{i:05}.pdf": {"page_count": 2} for i in range(count)})
+    selection = list(range(1, count, 2))
+
+    started = time.perf_counter()
+    moved = model.move(selection, -1)
+    moved = model.move(moved, 1)
+    model.sort("name")
+    model.remove(selection)
+    assert model.totals() == (count, 0)
+    seconds = time.perf_counter() - started
+    assert moved == selection and len(model) == count // 2
+    assert seconds < 5, f"Bulk operations took {seconds:.2f}s"
+
+    print(f"Large file list test PASSED ({seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    test_bulk_operations()
+    test_page_counts()
+    test_large_list()
+    print("ALL FILE LIST TESTS PASSED!")
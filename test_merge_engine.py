@@ -0,0 +1,498 @@
+import os
+import sys
+import io
+import shutil
+import tempfile
+import threading
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from PyPDF2 import PdfReader
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from benchmark import create_page_tree
+import image_optimizer
+from image_optimizer import ImageOptimizer, ImageOptions, worker_optimizer
+from input_source import is_mapped, open_input
+import merge_engine
+from merge_engine import MergeCancelled, MergeJob, MergeSource, STRATEGIES, merge, options_from_config
+from page_index import PageIndex
+from page_ranges import parse_ranges, resolve_ranges, split_spec
+from pdf_metadata import metadata_from_stream
+from pdf_optimizer import LEVELS
+from stamper import Stamp
+from stream_writer import StreamingPdfWriter
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES = [os.path.join(TEST_DIR, "test1.pdf"), os.path.join(TEST_DIR, "test2.pdf")]
+
+
+def test_strategies_merge_all_pages():
+    """Test that every registered strategy merges all pages in order"""
+    print("Testing merge strategies...")
+
+    for name in STRATEGIES:
+        output = io.BytesIO()
+        result = merge(TEST_FILES, output, strategy=name)
+
+        assert result.written, f"{name}: output was not written"
+        assert not result.error_files, f"{name}: unexpected errors {result.error_files}"
+        assert result.total_pages == 2, f"{name}: expected 2 pages, got {result.total_pages}"
+
+        output.seek(0)
+        assert len(PdfReader(output).pages) == 2, f"{name}: merged file has wrong page count"
+        print(f"Strategy '{name}' PASSED")
+
+
+def test_error_collection():
+    """Test that bad files are reported and strict mode skips the output"""
+    print("Testing error collection...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bad_file = os.path.join(tmp, "bad.pdf")
+        with open(bad_file, 'wb') as f:
+            f.write(b"not a pdf")
+
+        sources = TEST_FILES + [MergeSource(bad_file, name="bad.pdf")]
+
+        output_path = os.path.join(tmp, "lenient.pdf")
+        result = MergeJob(sources, output_path).run()
+        assert result.written and os.path.exists(output_path), "Lenient merge should write output"
+        assert [name for name, _ in result.error_files] == ["bad.pdf"], "Bad file not reported"
+
+        output_path = os.path.join(tmp, "strict.pdf")
+        result = MergeJob(sources, output_path, strict=True).run()
+        assert not result.written and not os.path.exists(output_path), "Strict merge should not write"
+
+        output_path = os.path.join(tmp, "all_failed.pdf")
+        result = MergeJob([bad_file], output_path).run()
+        assert not result.written, "Nothing should be written when every file fails"
+
+    print("Error collection test PASSED")
+
+
+def test_parallel_preserves_order():
+    """Test that the process pool keeps input order and per-file errors"""
+    print("Testing parallel merge order...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bad_file = os.path.join(tmp, "bad.pdf")
+        with open(bad_file, 'wb') as f:
+            f.write(b"not a pdf")
+
+        sources = [TEST_FILES[1], bad_file, TEST_FILES[0], bad_file]
+        output = io.BytesIO()
+        result = merge(sources, output, strategy="parallel", workers=2)
+
+        assert result.written and result.total_pages == 2, "Parallel merge failed"
+        assert [name for name, _ in result.error_files] == [bad_file, bad_file], "Errors not collected"
+
+        output.seek(0)
+        texts = [page.extract_text() for page in PdfReader(output).pages]
+        assert "Test PDF 2" in texts[0] and "Test PDF 1" in texts[1], "Pages merged out of order"
+
+    print("Parallel merge order test PASSED")
+
+
+def test_stamping_all_strategies():
+    """Test that every strategy adds the watermark and sequential Bates numbers"""
+    print("Testing merge stamping...")
+
+    stamp = Stamp(watermark="CONFIDENTIAL", bates_prefix="ABC", bates_start=7)
+    sources = TEST_FILES + [TEST_FILES[0]]
+    for name in STRATEGIES:
+        output = io.BytesIO()
+        result = merge(sources, output, strategy=name, stamp=stamp)
+        assert result.written and result.total_pages == 3, f"{name}: merge failed"
+
+        data = output.getvalue()
+        texts = [page.extract_text() for page in PdfReader(io.BytesIO(data)).pages]
+        for index, text in enumerate(texts):
+            assert "CONFIDENTIAL" in text, f"{name}: watermark missing on page {index}"
+            assert f"ABC{7 + index:06d}" in text, f"{name}: wrong Bates number on page {index}"
+        assert "Test PDF 2" in texts[1], f"{name}: pages out of order"
+        # One font and one watermark form serve every page
+        assert data.count(b"/PdfStampWatermark Do") == 3
+        assert data.count(b"/Subtype /Form") == 1, f"{name}: watermark should be shared"
+        print(f"Strategy '{name}' stamping PASSED")
+
+    options = options_from_config({"merge_stamp": {"bates_prefix": "X", "bates_digits": 3}})
+    assert options["stamp"].bates_label(0) == "X001"
+    assert "stamp" not in options_from_config({"merge_stamp": {"font_size": 8}})
+
+    print("Merge stamping test PASSED")
+
+
+def create_statement(path, pages=10, title="Statement"):
+    """Create a text-heavy multi-page PDF"""
+    c = canvas.Canvas(path)
+    for page in range(pages):
+        for line in range(60):
+            c.drawString(50, 800 - line * 12, f"{title} line {line} on page {page} " * 3)
+        c.showPage()
+    c.save()
+
+
+def test_dedupe_shared_resources():
+    """Test that identical resources across inputs are written once"""
+    print("Testing shared-resource deduplication...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "statement.pdf")
+        create_statement(source, pages=2)
+        # The same template merged several times, including identical pages
+        sources = [source] * 5
+
+        for name in STRATEGIES:
+            sizes = {}
+            for dedupe in (False, True):
+                output = io.BytesIO()
+                result = merge(sources, output, strategy=name, dedupe=dedupe)
+                sizes[dedupe] = len(output.getvalue())
+
+                reader = PdfReader(io.BytesIO(output.getvalue()))
+                assert len(reader.pages) == 10, f"{name}: wrong page count"
+                kids = [ref.idnum for ref in reader.trailer['/Root']['/Pages']['/Kids']]
+                assert len(set(kids)) == 10, f"{name}: identical pages must stay separate objects"
+                assert "page 1" in reader.pages[9].extract_text(), f"{name}: page content lost"
+
+            assert result.objects_deduplicated > 0, f"{name}: nothing was deduplicated"
+            assert sizes[True] < sizes[False], f"{name}: output did not shrink"
+            assert result.bytes_saved > 0
+            print(f"Strategy '{name}': {result.objects_deduplicated} objects, "
+                  f"{result.bytes_saved} bytes saved")
+
+    print("Shared-resource deduplication test PASSED")
+
+
+def test_optimization_levels():
+    """Test that every strategy writes valid, smaller files at each level"""
+    print("Testing output optimization levels...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "uncompressed.pdf")
+        c = canvas.Canvas(source, pageCompression=0)
+        for page in range(3):
+            for line in range(40):
+                c.drawString(50, 800 - line * 18, f"Uncompressed line {line} on page {page}")
+            c.showPage()
+        c.save()
+
+        for name in STRATEGIES:
+            sizes = {}
+            for level in LEVELS:
+                output = io.BytesIO()
+                result = merge([source] * 3, output, strategy=name, optimize=level)
+                data = output.getvalue()
+                sizes[level] = len(data)
+
+                reader = PdfReader(io.BytesIO(data), strict=True)
+                assert result.total_pages == len(reader.pages) == 9, f"{name}/{level}: wrong page count"
+                assert "line 39 on page 2" in reader.pages[8].extract_text(), f"{name}/{level}: content lost"
+                packed = level in ("objstm", "full")
+                assert (b"/ObjStm" in data) == packed, f"{name}/{level}: object streams"
+                assert (b"/XRef" in data) == packed, f"{name}/{level}: xref stream"
+
+            assert sizes["compress"] < sizes["none"], f"{name}: compression did not shrink output"
+            assert sizes["objstm"] < sizes["none"], f"{name}: object streams did not shrink output"
+            assert sizes["full"] < min(sizes["compress"], sizes["objstm"]), f"{name}: full is not smallest"
+            print(f"Strategy '{name}': " + ", ".join(f"{level} {sizes[level]}" for level in LEVELS))
+
+        try:
+            merge([source], io.BytesIO(), optimize="maximum")
+            assert False, "Unknown level was accepted"
+        except ValueError:
+            pass
+
+    print("Output optimization test PASSED")
+
+
+def test_image_downsampling():
+    """Test that oversized images are downsampled once and shared images reused"""
+    print("Testing image downsampling...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "scan.pdf")
+        c = canvas.Canvas(source)
+        # 1200 pixels drawn 144 points (2 inches) wide is 600 DPI
+        c.drawImage(ImageReader(Image.effect_noise((1200, 1200), 40).convert("RGB")), 72, 72, 144, 144)
+        c.drawString(72, 400, "Scanned page")
+        c.showPage()
+        c.save()
+
+        for name in STRATEGIES:
+            output = io.BytesIO()
+            result = merge([source] * 3, output, strategy=name,
+                           images=ImageOptions(target_dpi=150, quality=70))
+            reader = PdfReader(io.BytesIO(output.getvalue()))
+            assert len(reader.pages) == 3 and "Scanned page" in reader.pages[2].extract_text()
+            for page in reader.pages:
+                image = list(page['/Resources']['/XObject'].values())[0].get_object()
+                assert (image['/Width'], image['/Height']) == (300, 300), f"{name}: image not downsampled"
+                assert image['/Filter'] == '/DCTDecode'
+            assert len(output.getvalue()) < os.path.getsize(source), f"{name}: output did not shrink"
+            assert result.image_bytes_saved > 0
+            if name != "parallel":
+                # The image is shared by every input but processed once
+                assert result.images_optimized == 1, f"{name}: {result.images_optimized} images processed"
+            print(f"Strategy '{name}': {result.image_bytes_saved} image bytes saved")
+
+        # Results past the cache limit are dropped and processed again
+        pages = PdfReader(source).pages
+        with ImageOptimizer(ImageOptions(), workers=0, max_cache_bytes=1) as optimizer:
+            assert len(optimizer.optimize_pages(pages)) == 1
+            assert len(optimizer.optimize_pages(pages)) == 1
+            assert optimizer.images_optimized == 2 and not optimizer.cache and optimizer.cache_bytes == 0
+
+        # Merge workers keep optimizers for a few option sets only
+        for quality in range(10, 90, 10):
+            assert worker_optimizer(ImageOptions(quality=quality)).options.quality == quality
+        assert len(image_optimizer._worker_optimizers) == image_optimizer.MAX_WORKER_OPTIMIZERS
+
+    print("Image downsampling test PASSED")
+
+
+def test_page_ranges():
+    """Test page-range specs and that only the selected pages are looked up"""
+    print("Testing page-range selection...")
+
+    assert resolve_ranges("1-3,10,-1", 12) == [0, 1, 2, 9, 11]
+    assert resolve_ranges("11-", 12) == [10, 11] and resolve_ranges("3-1", 5) == [2, 1, 0]
+    assert split_spec("dir/file.pdf:1-3,-1") == ("dir/file.pdf", "1-3,-1")
+    assert split_spec("C:\\scans\\file.pdf") == ("C:\\scans\\file.pdf", None)
+    for spec in ("0", "1-x", "2--"):
+        try:
+            parse_ranges(spec)
+            raise AssertionError(f"{spec} should be rejected")
+        except ValueError:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "statement.pdf")
+        create_statement(source, pages=12)
+
+        reader = PdfReader(source)
+        pages = MergeSource(source, pages="2,-1").select_pages(reader)
+        assert reader.flattened_pages is None, "Selecting pages should not load the whole page tree"
+        # create_statement numbers its pages from 0
+        assert "on page 1 " in pages[0].extract_text() and "on page 11 " in pages[1].extract_text()
+
+        for name in STRATEGIES:
+            output = io.BytesIO()
+            result = merge([f"{source}:1-3,10,-1", f"{source}:2,2", f"{source}:20"], output, strategy=name)
+            reader = PdfReader(io.BytesIO(output.getvalue()))
+            texts = [page.extract_text() for page in reader.pages]
+            expected = [0, 1, 2, 9, 11, 1, 1]
+            assert len(texts) == result.total_pages == len(expected), f"{name}: wrong page count"
+            for text, number in zip(texts, expected):
+                assert f"on page {number} " in text, f"{name}: expected page {number}"
+            assert len(result.error_files) == 1 and "out of range" in result.error_files[0][1]
+            kids = [ref.idnum for ref in reader.trailer['/Root']['/Pages']['/Kids']]
+            assert len(set(kids)) == len(kids), f"{name}: repeated pages must be separate objects"
+
+    print("Page-range selection test PASSED")
+
+
+def test_lazy_page_index():
+    """Test that PageIndex matches reader.pages on a nested page tree without flattening it"""
+    print("Testing lazy page index...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "tree.pdf")
+        create_page_tree(source, 23, fanout=3)
+
+        reader = PdfReader(source)
+        index = PageIndex(reader)
+        assert len(index) == 23 and reader.flattened_pages is None, "Counting should not flatten the tree"
+        last = index[-1]
+        assert reader.flattened_pages is None, "Page lookup should not flatten the tree"
+        # Resources and the media box are inherited from the root
+        assert '/F1' in last['/Resources']['/Font'] and float(last.mediabox.width) == 612
+        lazy = [page.indirect_reference.idnum for page in index]
+        assert reader.flattened_pages is None, "Iterating should not flatten the tree"
+        assert lazy == [page.indirect_reference.idnum for page in PdfReader(source).pages]
+        assert [index[i].indirect_reference.idnum for i in range(23)] == lazy
+        # Tree nodes are remembered by reference, so objects the reader resolves again still match
+        assert all(isinstance(key, tuple) for key in index._nodes)
+        reader.resolved_objects.clear()
+        assert [index[i].indirect_reference.idnum for i in range(23)] == lazy
+        try:
+            index[23]
+            raise AssertionError("Index past the last page should fail")
+        except IndexError:
+            pass
+
+        output = io.BytesIO()
+        result = merge([source, f"{source}:-2-"], output, strategy="stream")
+        assert result.total_pages == len(PdfReader(io.BytesIO(output.getvalue())).pages) == 25
+
+    print("Lazy page index test PASSED")
+
+
+def test_mapped_input():
+    """Test memory-mapped inputs, their fallback and merging into one of the inputs"""
+    print("Testing memory-mapped input...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "statement.pdf")
+        create_statement(source, pages=3)
+        with open_input(source) as stream:
+            assert is_mapped(stream), "Regular files should be mapped"
+            assert len(PdfReader(stream).pages) == 3
+        empty = os.path.join(tmp, "empty.pdf")
+        open(empty, 'wb').close()
+        with open_input(empty) as stream:
+            assert not is_mapped(stream) and stream.read() == b"", "Empty files cannot be mapped"
+
+        # The output replaces one of its inputs, first or later in the order
+        for name in STRATEGIES:
+            for position in (0, 1):
+                target = os.path.join(tmp, f"{name}{position}.pdf")
+                shutil.copyfile(source, target)
+                sources = [source, source]
+                sources[position] = target
+                result = MergeJob(sources, target, strategy=name).run()
+                assert result.written and not result.error_files, f"{name}: {result.error_files}"
+                assert len(PdfReader(target).pages) == 6, f"{name}: output lost pages of its input"
+                assert not [f for f in os.listdir(tmp) if f.endswith(".tmp")], f"{name}: temporary output left behind"
+
+        # Concurrent jobs writing the same output each write their own temporary file
+        shared = os.path.join(tmp, "shared.pdf")
+        results = []
+        threads = [threading.Thread(target=lambda count=count: results.append(merge([source] * count, shared)))
+                   for count in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 8 and all(result.written for result in results), "Concurrent merges failed"
+        assert len(PdfReader(shared).pages) % 3 == 0
+        assert not [f for f in os.listdir(tmp) if f.endswith(".tmp")], "Temporary output left behind"
+
+        with open_input(source) as stream:
+            assert metadata_from_stream(stream)['page_count'] == 3
+
+    print("Memory-mapped input test PASSED")
+
+
+def test_progress_and_cancel():
+    """Test byte-based progress and cancelling every strategy mid-merge"""
+    print("Testing merge progress and cancellation...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "statement.pdf")
+        create_statement(source, pages=30)
+
+        for name in ("pages", "append"):
+            fractions = []
+            job = MergeJob([source, source], io.BytesIO(), strategy=name,
+                           on_progress=lambda p: fractions.append(p.fraction))
+            job.run()
+            assert fractions == sorted(fractions), f"{name}: progress should never move back"
+            assert len(fractions) > 2 and fractions[0] < 0.5, f"{name}: progress should move within a source"
+            assert job.progress.fraction == 1.0 and job.progress.eta == 0
+            info = job.progress.to_dict()
+            assert info['files_done'] == 2 and info['pages_processed'] == 60 and info['fraction'] == 1.0
+
+        for name in STRATEGIES:
+            output_path = os.path.join(tmp, f"{name}.pdf")
+            job = MergeJob([source] * 3, output_path, strategy=name, on_progress=lambda p: job.cancel())
+            try:
+                job.run()
+                raise AssertionError(f"{name}: cancelled merge should raise")
+            except MergeCancelled:
+                pass
+            assert job.result.cancelled and not job.result.written
+            # Parallel workers report back once per source; the others stop within one
+            assert job.progress.files_done < (3 if name == "parallel" else 1), f"{name}: merge ran on"
+            assert not os.path.exists(output_path), f"{name}: partial output left behind"
+
+        # A shared cancel event also stops the final write
+        class CancellingStream(io.BytesIO):
+            def write(self, data):
+                cancel.set()
+                return super().write(data)
+
+        cancel = threading.Event()
+        check_bytes = merge_engine.CANCEL_CHECK_BYTES
+        merge_engine.CANCEL_CHECK_BYTES = 1
+        try:
+            job = MergeJob([source], CancellingStream(), cancel_event=cancel)
+            try:
+                job.run()
+                raise AssertionError("Merge cancelled while writing should raise")
+            except MergeCancelled:
+                pass
+            assert job.cancelled and job.progress.files_done == 1
+        finally:
+            merge_engine.CANCEL_CHECK_BYTES = check_bytes
+
+        # A job cancelled before it starts never opens its output
+        job = MergeJob([source], os.path.join(tmp, "never.pdf"))
+        job.cancel()
+        try:
+            job.run()
+            raise AssertionError("Cancelled merge should raise")
+        except MergeCancelled:
+            pass
+        assert not os.path.exists(os.path.join(tmp, "never.pdf"))
+
+    print("Merge progress and cancellation test PASSED")
+
+
+def test_streaming_memory_stays_flat():
+    """Test that streaming merge memory does not grow with input count"""
+    print("Testing streaming merge memory...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Distinct inputs, so every content stream is new to deduplication
+        sources = []
+        for index in range(40):
+            sources.append(os.path.join(tmp, f"statement{index}.pdf"))
+            create_statement(sources[-1], title=f"Statement {index}")
+        output_path = os.path.join(tmp, "merged.pdf")
+
+        # Warm up first, so one-time allocations do not count towards the smaller merge
+        merge(sources[:10], output_path, strategy="stream", memory_limit=64 * 1024)
+        peaks = {}
+        for count in (10, 40):
+            tracemalloc.start()
+            result = merge(sources[:count], output_path, strategy="stream", memory_limit=64 * 1024)
+            peaks[count] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            assert result.written and result.total_pages == count * 10, "Streaming merge failed"
+            assert len(PdfReader(output_path).pages) == count * 10, "Merged file has wrong page count"
+
+        print(f"Peak memory: 10 files {peaks[10]} bytes, 40 files {peaks[40]} bytes")
+        assert peaks[40] < peaks[10] * 2, "Peak memory grew with the number of inputs"
+
+        # Deduplication only remembers as many objects as memory_limit allows
+        writer = StreamingPdfWriter(io.BytesIO(), memory_limit=64 * 1024)
+        for source in sources:
+            with open_input(source) as f:
+                reader = PdfReader(f)
+                writer.add_pages(reader, reader.pages)
+        writer.close()
+        assert writer.next_number > writer.max_seen * 2, "Too few objects to fill the digest map"
+        assert len(writer.seen) <= writer.max_seen, "Digest map grew past its bound"
+
+    print("Streaming memory test PASSED")
+
+
+if __name__ == "__main__":
+    test_strategies_merge_all_pages()
+    test_error_collection()
+    test_parallel_preserves_order()
+    test_stamping_all_strategies()
+    test_dedupe_shared_resources()
+    test_optimization_levels()
+    test_image_downsampling()
+    test_page_ranges()
+    test_lazy_page_index()
+    test_mapped_input()
+    test_progress_and_cancel()
+    test_streaming_memory_stays_flat()
+    print("ALL MERGE ENGINE TESTS PASSED!")
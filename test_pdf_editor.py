@@ -0,0 +1,177 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PyPDF2 import PdfReader
+
+from overlay_renderer import OverlayRenderer
+from page_ranges import resolve_ranges
+from pdf_editor import EditError, PdfEditor, edit_pdf, resolve_pages
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def page_summary(data):
+    """Return (first text line, rotation) for every page of a PDF"""
+    reader = PdfReader(io.BytesIO(data))
+    return [(page.extract_text().splitlines()[0], page.get('/Rotate', 0)) for page in reader.pages]
+
+
+def test_batch_operations():
+    """Test that an ordered list of operations is applied in one save"""
+    print("Testing batch page edits...")
+
+    editor = PdfEditor(os.path.join(TEST_DIR, "merged.pdf"))
+    editor.apply([
+        {'op': 'insert', 'at': 1, 'path': os.path.join(TEST_DIR, "test2.pdf")},
+        {'op': 'rotate', 'pages': '2-3', 'degrees': 90},
+        {'op': 'rotate', 'pages': -1, 'degrees': 180},
+        {'op': 'text', 'text': 'Stamped', 'pages': [0]},
+        {'op': 'reorder', 'order': [2, 0, 1]},
+        {'op': 'remove', 'pages': 2},
+    ])
+    output = io.BytesIO()
+    assert editor.save(output) == 2, "Wrong page count"
+
+    pages = page_summary(output.getvalue())
+    assert pages == [("Test PDF 2", 270), ("Test PDF 1", 0)], f"Unexpected pages {pages}"
+    assert "Stamped" in PdfReader(output).pages[1].extract_text(), "Text overlay missing"
+
+    print("Batch page edit test PASSED")
+
+
+def test_incremental_save():
+    """Test that page-preserving edits are appended to the original bytes"""
+    print("Testing incremental save...")
+
+    source = os.path.join(TEST_DIR, "merged.pdf")
+    with open(source, 'rb') as f:
+        original = f.read()
+
+    output = io.BytesIO()
+    editor = PdfEditor(source)
+    editor.apply([
+        {'op': 'rotate', 'pages': 1, 'degrees': 90},
+        {'op': 'text', 'text': 'Stamped', 'pages': [0, 1]},
+    ])
+    editor.save(output, incremental=True)
+    data = output.getvalue()
+    assert data.startswith(original), "Original bytes should be kept unchanged"
+    assert data.count(b"%%EOF") == original.count(b"%%EOF") + 1, "Expected one update section"
+    assert page_summary(data) == [("Test PDF 1", 0), ("Test PDF 2", 90)]
+    assert all("Stamped" in page.extract_text() for page in PdfReader(io.BytesIO(data)).pages)
+
+    # Edits that change the page tree fall back to a full rewrite
+    output = io.BytesIO()
+    editor = PdfEditor(source)
+    editor.apply([{'op': 'remove', 'pages': 0}])
+    assert editor.save(output, incremental=True) == 1
+    assert not output.getvalue().startswith(original)
+
+    print("Incremental save test PASSED")
+
+
+def test_overlay_reuse():
+    """Test that one rendered overlay is shared by every page and document"""
+    print("Testing overlay reuse...")
+
+    renderer = OverlayRenderer()
+    for incremental in (False, True):
+        editor = PdfEditor(os.path.join(TEST_DIR, "merged.pdf"), renderer=renderer)
+        editor.apply([{'op': 'text', 'text': 'CONFIDENTIAL', 'x': 50, 'y': 50}])
+        output = io.BytesIO()
+        editor.save(output, incremental=incremental)
+
+        data = output.getvalue()
+        assert data.count(b"/Subtype /Form") == 1, "Pages should share one overlay object"
+        assert all("CONFIDENTIAL" in page.extract_text() for page in PdfReader(io.BytesIO(data)).pages)
+
+    # Both pages have the same box, so the overlay was rendered only once
+    assert (renderer.misses, renderer.hits) == (1, 3), f"{renderer.misses} misses, {renderer.hits} hits"
+
+    print("Overlay reuse test PASSED")
+
+
+def test_optimized_save():
+    """Test that edits can be saved with object streams and compression"""
+    print("Testing optimized edit saves...")
+
+    source = os.path.join(TEST_DIR, "merged.pdf")
+    operations = [{'op': 'rotate', 'pages': 0, 'degrees': 90}, {'op': 'text', 'text': 'Packed'}]
+    output = io.BytesIO()
+    editor = PdfEditor(source)
+    editor.apply(operations)
+    editor.save(output, optimize='full')
+    data = output.getvalue()
+    assert b"/ObjStm" in data and b"/XRef" in data, "Expected object and xref streams"
+    assert page_summary(data) == [("Test PDF 1", 90), ("Test PDF 2", 0)]
+    assert all("Packed" in page.extract_text() for page in PdfReader(io.BytesIO(data), strict=True).pages)
+
+    # Incremental updates keep the original xref format
+    with open(source, 'rb') as f:
+        original = f.read()
+    output = io.BytesIO()
+    editor = PdfEditor(source)
+    editor.apply(operations)
+    editor.save(output, incremental=True, optimize='full')
+    assert output.getvalue().startswith(original) and b"/ObjStm" not in output.getvalue()
+
+    try:
+        editor.save(io.BytesIO(), optimize='maximum')
+        raise AssertionError("Unknown optimization level should be rejected")
+    except EditError:
+        pass
+
+    print("Optimized edit save test PASSED")
+
+
+def test_in_place_save():
+    """Test that a mapped input can be overwritten by its own edit"""
+    print("Testing in-place edit saves...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "merged.pdf")
+        shutil.copyfile(os.path.join(TEST_DIR, "merged.pdf"), path)
+        assert edit_pdf(path, [{'op': 'rotate', 'pages': 1, 'degrees': 90}], path, incremental=True) == 2
+        assert edit_pdf(path, [{'op': 'remove', 'pages': 0}], path) == 1
+        with open(path, 'rb') as f:
+            assert page_summary(f.read()) == [("Test PDF 2", 90)]
+        assert os.listdir(tmp) == ["merged.pdf"], "Temporary output left behind"
+
+    print("In-place edit save test PASSED")
+
+
+def test_invalid_operations():
+    """Test that bad operations raise EditError"""
+    print("Testing invalid edit operations...")
+
+    # Strings are 1-based page-range specs, as for merge inputs; numbers are indices
+    assert resolve_pages(["1-2", -1], 3) == [0, 1, 2]
+    assert resolve_pages("3,1-2", 3) == resolve_ranges("3,1-2", 3) == [2, 0, 1]
+    assert resolve_pages("-1", 3) == [2] and resolve_pages(0, 3) == [0]
+    editor = PdfEditor(os.path.join(TEST_DIR, "merged.pdf"))
+    for operation in ({'op': 'explode'}, {'op': 'remove', 'pages': 5}, {'op': 'remove', 'pages': '0-1'},
+                      {'op': 'rotate', 'degrees': 45}, {'op': 'reorder', 'order': [0, 0]},
+                      {'op': 'insert', 'path': 'missing.pdf'},
+                      {'op': 'text', 'text': 'Bad', 'font': 'NoSuchFont'},
+                      {'op': 'text', 'text': 'Bad', 'size': 'large'}):
+        try:
+            editor.apply([operation])
+        except EditError:
+            continue
+        raise AssertionError(f"{operation} should be rejected")
+
+    print("Invalid edit operation test PASSED")
+
+
+if __name__ == "__main__":
+    test_batch_operations()
+    test_incremental_save()
+    test_overlay_reuse()
+    test_optimized_save()
+    test_in_place_save()
+    test_invalid_operations()
+    print("ALL EDITOR TESTS PASSED!")
@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import create_page_tree
+from metadata_loader import MetadataLoader
+from pdf_metadata import MAX_PAGE_SIZES, MetadataCache, read_metadata
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_read_metadata():
+    """Test that metadata is read from a PDF"""
+    print("Testing metadata extraction...")
+
+    metadata = read_metadata(os.path.join(TEST_DIR, "test1.pdf"))
+    assert metadata['page_count'] == 1, "Wrong page count"
+    assert len(metadata['page_sizes']) == 1, "Wrong number of page sizes"
+    assert metadata['encrypted'] is False, "File should not be encrypted"
+    assert metadata['pdf_version'] == "1.3", f"Wrong PDF version {metadata['pdf_version']}"
+
+    # Long documents are counted from the page tree root without reading every page
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "long.pdf")
+        create_page_tree(pdf_path, 5000)
+        metadata = read_metadata(pdf_path)
+        assert metadata['page_count'] == 5000, "Wrong page count"
+        assert len(metadata['page_sizes']) == MAX_PAGE_SIZES, "Page sizes should be capped"
+
+    print("Metadata extraction test PASSED")
+
+
+def test_cache_hits_and_persistence():
+    """Test that unchanged files are served from the cache, also after reload"""
+    print("Testing metadata cache...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "doc.pdf")
+        shutil.copy(os.path.join(TEST_DIR, "test1.pdf"), pdf_path)
+        store_path = os.path.join(tmp, "cache.json")
+
+        cache = MetadataCache(store_path)
+        assert cache.page_count(pdf_path) == 1
+        assert cache.page_count(pdf_path) == 1
+        assert (cache.hits, cache.misses) == (1, 1), "Second lookup should be a cache hit"
+        cache.save()
+
+        reloaded = MetadataCache(store_path)
+        assert reloaded.page_count(pdf_path) == 1
+        assert (reloaded.hits, reloaded.misses) == (1, 0), "Cache was not persisted"
+
+        # Saves from several threads each leave a complete file behind
+        def store_and_save(index):
+            cache.store(os.path.join(tmp, f"other{index}.pdf"), {'page_count': index}, signature=[index, 0])
+            cache.save()
+
+        threads = [threading.Thread(target=store_and_save, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(store_path) as f:
+            assert len(json.load(f)) == 9, "Concurrent saves lost entries"
+        assert sorted(os.listdir(tmp)) == ["cache.json", "doc.pdf"], "Temporary cache file left behind"
+
+        # Replacing the file invalidates its entry
+        shutil.copy(os.path.join(TEST_DIR, "merged.pdf"), pdf_path)
+        assert reloaded.page_count(pdf_path) == 2, "Stale entry was used"
+        assert reloaded.misses == 1
+
+    print("Metadata cache test PASSED")
+
+
+def test_cache_eviction_and_errors():
+    """Test LRU eviction and caching of unreadable files"""
+    print("Testing metadata cache eviction...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(3):
+            path = os.path.join(tmp, f"doc{i}.pdf")
+            shutil.copy(os.path.join(TEST_DIR, "test1.pdf"), path)
+            paths.append(path)
+        bad_path = os.path.join(tmp, "bad.pdf")
+        with open(bad_path, 'wb') as f:
+            f.write(b"not a pdf")
+
+        cache = MetadataCache(max_entries=2)
+        for path in paths:
+            cache.get(path)
+        assert cache.lookup(paths[0]) is None, "Least recently used entry should be evicted"
+        assert cache.lookup(paths[2]) is not None
+
+        assert cache.page_count(bad_path) == 0
+        assert 'error' in cache.get(bad_path), "Unreadable file should be cached with its error"
+        assert cache.hits == 1
+
+    print("Metadata cache eviction test PASSED")
+
+
+def run_event_loop(scheduled, timeout=30):
+    """Run callbacks queued by a fake root.after until none are left"""
+    deadline = time.monotonic() + timeout
+    while scheduled:
+        assert time.monotonic() < deadline, "Loader never became idle"
+        delay, callback = scheduled.pop(0)
+        time.sleep(delay / 1000)
+        callback()
+
+
+def test_background_loader():
+    """Test that the loader reads files off the event loop and drops cancelled work"""
+    print("Testing background metadata loader...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(4):
+            paths.append(os.path.join(tmp, f"doc{i}.pdf"))
+            shutil.copyfile(os.path.join(TEST_DIR, "merged.pdf" if i % 2 else "test1.pdf"), paths[-1])
+        missing = os.path.join(tmp, "missing.pdf")
+
+        cache = MetadataCache()
+        scheduled = []
+        batches = []
+        idle = []
+        loader = MetadataLoader(
+            cache, lambda delay, callback: scheduled.append((delay, callback)),
+            batches.append, lambda: idle.append(True), workers=2
+        )
+        try:
+            loader.request(paths + [missing])
+            # Nothing is delivered before the event loop runs
+            assert batches == [] and loader.busy
+            loader.cancel([paths[3]])
+            run_event_loop(scheduled)
+
+            results = {}
+            for batch in batches:
+                results.update(batch)
+            assert sorted(results) == sorted(paths[:3] + [missing]), "Cancelled file was delivered"
+            assert [results[path]['page_count'] for path in paths[:3]] == [1, 2, 1]
+            assert 'error' in results[missing]
+            assert idle and not loader.busy
+            assert cache.lookup(paths[1])['page_count'] == 2, "Results should be cached"
+            assert cache.lookup(missing) is None, "Missing files are not cached"
+
+            # Cached files are answered without the pool
+            batches.clear()
+            loader.request(paths[:2])
+            run_event_loop(scheduled)
+            assert batches == [{paths[0]: results[paths[0]], paths[1]: results[paths[1]]}]
+        finally:
+            loader.close()
+
+    print("Background metadata loader test PASSED")
+
+
+if __name__ == "__main__":
+    test_read_metadata()
+    test_cache_hits_and_persistence()
+    test_cache_eviction_and_errors()
+    test_background_loader()
+    print("ALL METADATA TESTS PASSED!")
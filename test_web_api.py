@@ -0,0 +1,473 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PyPDF2 import PdfReader
+
+import web_pdf_merger
+from input_source import memory_pools
+from job_queue import CANCELLED, DONE, JobQueue
+from memory_pool import MemoryPool
+from response_pipe import PipeClosed, PipeError, ResponsePipe
+from pdf_metadata import MetadataCache
+from result_store import ResultStore
+from upload_store import UploadStore
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_client(tmp):
+    """Create a test client that stores files under tmp"""
+    for key, folder in (('UPLOAD_FOLDER', 'uploads'), ('MERGED_FOLDER', 'merged'), ('EDITED_FOLDER', 'edited')):
+        path = os.path.join(tmp, folder)
+        os.makedirs(path, exist_ok=True)
+        web_pdf_merger.app.config[key] = path
+    web_pdf_merger.metadata_cache = MetadataCache()
+    web_pdf_merger.result_store = ResultStore(web_pdf_merger.app.config['MERGED_FOLDER'])
+    web_pdf_merger.upload_store = UploadStore(web_pdf_merger.app.config['UPLOAD_FOLDER'])
+    return web_pdf_merger.app.test_client()
+
+
+def upload(client, *names):
+    """Upload test PDFs from the repository directory"""
+    files = [(open(os.path.join(TEST_DIR, name), 'rb'), name) for name in names]
+    try:
+        response = client.post('/upload', data={'files[]': files}, content_type='multipart/form-data')
+    finally:
+        for f, _ in files:
+            f.close()
+    assert response.status_code == 200, f"Upload failed with status {response.status_code}"
+    return response.get_json()['files']
+
+
+def test_upload_and_metadata():
+    """Test that uploads report page counts and /metadata answers in one batch"""
+    print("Testing metadata endpoint...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        uploaded = upload(client, "test1.pdf", "merged.pdf")
+        assert [f['page_count'] for f in uploaded] == [1, 2], "Upload should report page counts"
+
+        paths = [f['path'] for f in uploaded] + ['missing.pdf']
+        response = client.post('/metadata', json={'paths': paths})
+        data = response.get_json()
+        assert response.status_code == 200
+        assert data['total_pages'] == 3, "Wrong total page count"
+        assert data['files'][uploaded[1]['path']]['page_sizes'][0][0] > 0, "Page sizes missing"
+        assert data['files'][uploaded[0]['path']]['encrypted'] is False
+        assert 'error' in data['files']['missing.pdf'], "Missing file should report an error"
+
+        # Metadata was read while uploading, so no file was parsed again
+        assert web_pdf_merger.metadata_cache.misses == 0
+
+    print("Metadata endpoint test PASSED")
+
+
+def test_upload_dedup_and_chunks():
+    """Test that identical uploads share one blob and chunked uploads resume"""
+    print("Testing upload deduplication and chunked uploads...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        first, second = upload(client, "test1.pdf", "test1.pdf")
+        assert first['path'] == second['path'], "Identical uploads should share a blob"
+        assert len(first['sha256']) == 64
+        assert len(os.listdir(web_pdf_merger.upload_store.blob_folder)) == 1
+
+        # The blob survives until every entry using it is deleted
+        client.post('/delete_file', json={'path': first['path']})
+        assert os.path.exists(first['path'])
+        client.post('/delete_file', json={'path': second['path']})
+        assert not os.path.exists(first['path'])
+
+        with open(os.path.join(TEST_DIR, "merged.pdf"), 'rb') as f:
+            content = f.read()
+        response = client.post('/uploads', json={'name': 'merged.pdf', 'size': len(content)})
+        assert response.status_code == 201
+        upload_url = response.get_json()['upload_url']
+
+        half = len(content) // 2
+        assert client.put(f'{upload_url}?offset=0', data=content[:half]).get_json()['offset'] == half
+        # A chunk at the wrong offset is rejected with the offset to resume from
+        response = client.put(f'{upload_url}?offset=0', data=content[half:])
+        assert response.status_code == 409 and response.get_json()['offset'] == half
+        assert client.get(upload_url).get_json()['offset'] == half
+        client.put(f'{upload_url}?offset={half}', data=content[half:])
+
+        files = client.post(f'{upload_url}/complete').get_json()['files']
+        assert files[0]['name'] == 'merged.pdf' and files[0]['page_count'] == 2
+        assert files[0]['sha256'] == upload(client, "merged.pdf")[0]['sha256']
+
+        # Uploads over the size cap are refused
+        web_pdf_merger.upload_store.max_bytes = 100
+        response = client.post('/uploads', json={'name': 'big.pdf', 'size': 101})
+        assert response.status_code == 413
+        files = [(open(os.path.join(TEST_DIR, "test1.pdf"), 'rb'), "test1.pdf")]
+        response = client.post('/upload', data={'files[]': files}, content_type='multipart/form-data')
+        files[0][0].close()
+        assert response.status_code == 413
+        assert not [name for name in os.listdir(web_pdf_merger.upload_store.blob_folder) if name.endswith('.tmp')]
+
+    print("Upload deduplication and chunked upload test PASSED")
+
+
+def test_upload_refs_and_expiry():
+    """Test that blob references survive a restart and idle chunked uploads expire"""
+    print("Testing upload reference persistence and expiry...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UploadStore(tmp)
+        with open(os.path.join(TEST_DIR, "test1.pdf"), 'rb') as f:
+            content = f.read()
+        path = store.save_stream(io.BytesIO(content)).path
+        store.save_stream(io.BytesIO(content))
+
+        # A restarted server still knows the blob is shared
+        store = UploadStore(tmp)
+        assert store.release(path) is False and os.path.exists(path)
+        store = UploadStore(tmp)
+        assert store.release(path) is True and not os.path.exists(path)
+
+        session = store.start_session("part.pdf")
+        store.append_chunk(session, 0, io.BytesIO(content[:100]))
+        orphan = os.path.join(store.partial_folder, "orphan.part")
+        open(orphan, 'wb').close()
+        store.session_ttl = 3600
+        assert store.expire_sessions() == 0, "Fresh uploads should be kept"
+        session.updated -= 7200
+        os.utime(session.part_path, (session.updated, session.updated))
+        os.utime(orphan, (session.updated, session.updated))
+        assert store.expire_sessions() == 2
+        assert store.get_session(session.id) is None and not os.listdir(store.partial_folder)
+
+    print("Upload reference persistence and expiry test PASSED")
+
+
+def wait_for_job(client, status_url, timeout=30):
+    """Poll a job until it finishes and return its final status"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(status_url).get_json()
+        if data['state'] in ('done', 'failed', 'cancelled'):
+            return data
+        time.sleep(0.05)
+    raise AssertionError("Job did not finish in time")
+
+
+def test_merge_job_queue():
+    """Test that /merge queues a job and /jobs reports its outcome"""
+    print("Testing merge job queue...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        uploaded = upload(client, "test1.pdf", "test2.pdf")
+
+        response = client.post('/merge', json={'files': uploaded})
+        assert response.status_code == 202, f"Merge should be queued, got {response.status_code}"
+        data = wait_for_job(client, response.get_json()['status_url'])
+        assert data['state'] == 'done', f"Merge job failed: {data}"
+        assert data['result']['total_pages'] == 2
+        assert data['pages_processed'] == 2 and data['bytes_written'] > 0, "Progress not reported"
+        assert os.path.exists(data['result']['output_path'])
+        assert data['result']['cached'] is False
+
+        # The same request is served from the result store
+        response = client.post('/merge', json={'files': uploaded})
+        cached = wait_for_job(client, response.get_json()['status_url'])
+        assert cached['result']['cached'] is True, "Identical merge should reuse the stored result"
+        assert cached['result']['output_path'] == data['result']['output_path']
+        assert cached['result']['total_pages'] == 2
+
+        # Stamping is part of the request, so it gets its own result
+        response = client.post('/merge', json={'files': uploaded, 'stamp': {'bates_prefix': 'DOC'}})
+        stamped = wait_for_job(client, response.get_json()['status_url'])
+        assert stamped['result']['cached'] is False
+        assert "DOC000002" in PdfReader(stamped['result']['output_path']).pages[1].extract_text()
+
+        # A different order is a different result
+        response = client.post('/merge', json={'files': uploaded[::-1]})
+        reordered = wait_for_job(client, response.get_json()['status_url'])
+        assert reordered['result']['output_path'] != data['result']['output_path']
+
+        # Page ranges select pages per file and are part of the result key
+        ranged = [dict(uploaded[0], pages="1,1"), uploaded[1]]
+        response = client.post('/merge', json={'files': ranged})
+        selected = wait_for_job(client, response.get_json()['status_url'])
+        assert selected['result']['cached'] is False and selected['result']['total_pages'] == 3
+        response = client.post('/merge', json={'files': [dict(uploaded[0], pages="1-x")]})
+        assert response.status_code == 400, "Malformed page ranges should be rejected"
+
+        response = client.post('/merge', json={'files': [{'path': 'missing.pdf', 'name': 'missing.pdf'}]})
+        data = wait_for_job(client, response.get_json()['status_url'])
+        assert data['state'] == 'failed' and 'missing.pdf' in data['error'], "Bad file should fail the job"
+
+        assert client.get('/jobs/unknown').status_code == 404
+
+    print("Merge job queue test PASSED")
+
+
+def test_job_events_and_cancel():
+    """Test the job event stream and cancelling queued and running jobs"""
+    print("Testing job events and cancellation...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        uploaded = upload(client, "test1.pdf", "test2.pdf")
+
+        job = client.post('/merge', json={'files': uploaded}).get_json()
+        response = client.get(job['events_url'])
+        assert response.mimetype == 'text/event-stream'
+        events = response.get_data(as_text=True).split("\n\n")
+        assert events[-2] == "event: done\ndata: {}", "Stream should end with a done event"
+        assert '"state": "done"' in events[-3] and '"fraction": 1.0' in events[-3]
+
+        response = client.post(job['cancel_url'])
+        assert response.status_code == 409, "Finished jobs cannot be cancelled"
+        assert client.post('/jobs/unknown/cancel').status_code == 404
+        assert client.get('/jobs/unknown/events').status_code == 404
+
+    # One worker: the first job runs until cancelled while the second waits
+    jobs = JobQueue(workers=1)
+    started = threading.Event()
+
+    def blocking(job):
+        stop = threading.Event()
+        job.on_cancel = stop.set
+        started.set()
+        if not stop.wait(10):
+            return "finished"
+        raise RuntimeError("stopped")
+
+    running = jobs.submit(blocking)
+    waiting = jobs.submit(lambda job: "ran")
+    assert started.wait(10)
+    assert waiting.cancel() and running.cancel()
+    jobs.pending.join()
+    assert running.state == CANCELLED and running.error is None
+    assert waiting.state == CANCELLED and waiting.result is None
+    assert not running.cancel(), "Cancelled jobs stay cancelled"
+    later = jobs.submit(lambda job: "ran")
+    jobs.pending.join()
+    assert later.state == DONE and later.result == "ran"
+
+    print("Job events and cancellation test PASSED")
+
+
+def test_streamed_merge_and_download():
+    """Test streaming a merge into the response and resuming its download"""
+    print("Testing streamed merge and ranged download...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        uploaded = upload(client, "test1.pdf", "test2.pdf")
+
+        response = client.post('/merge', json={'files': uploaded, 'stream': True})
+        assert response.status_code == 200 and response.mimetype == 'application/pdf'
+        body = response.get_data()
+        assert len(PdfReader(io.BytesIO(body)).pages) == 2, "Streamed PDF is incomplete"
+        download_url = response.headers['X-Download-Url']
+
+        # The streamed bytes were stored, so the download can be resumed
+        response = client.get(download_url, headers={'Range': 'bytes=100-'})
+        assert response.status_code == 206 and response.get_data() == body[100:]
+        etag = response.headers['ETag']
+        response = client.get(download_url, headers={'If-None-Match': etag})
+        assert response.status_code == 304, "Unchanged results should not be sent again"
+
+        # Repeating the request sends the stored result with its length
+        response = client.post('/merge', json={'files': uploaded, 'stream': True})
+        assert response.get_data() == body and response.content_length == len(body)
+        assert response.headers['ETag'] == etag, "Reusing a result must not change its ETag"
+
+        # A queued merge of the same files finds the streamed result too
+        response = client.post('/merge', json={'files': uploaded})
+        cached = wait_for_job(client, response.get_json()['status_url'])
+        assert cached['result']['cached'] is True, "Streaming should not change the result key"
+
+        response = client.post('/merge', json={'files': [{'path': 'missing.pdf', 'name': 'missing.pdf'}], 'stream': True})
+        assert response.status_code == 500 and 'missing.pdf' in response.get_json()['error']
+
+    # A reader that goes away stops the writer
+    pipe = ResponsePipe(chunk_size=4)
+    chunks = pipe.chunks()
+    pipe.write(b"12345")
+    assert next(chunks) == b"12345"
+    chunks.close()
+    try:
+        pipe.write(b"more")
+        raise AssertionError("Writing to an abandoned pipe should fail")
+    except PipeClosed:
+        pass
+
+    # A writer that fails, or never starts, is reported to the reader
+    for pipe, alive in ((ResponsePipe(), lambda: True), (ResponsePipe(), lambda: False)):
+        if alive():
+            pipe.finish("broken")
+        try:
+            list(pipe.chunks(alive))
+            raise AssertionError("A failed writer should be reported")
+        except PipeError:
+            pass
+
+    print("Streamed merge and ranged download test PASSED")
+
+
+def test_in_memory_merge():
+    """Test uploads, merges, downloads and edits held in the memory pool"""
+    print("Testing in-memory merge path...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        pool = MemoryPool(max_bytes=1024 * 1024, spill_bytes=1024 * 1024)
+        web_pdf_merger.memory_pool = pool
+        web_pdf_merger.upload_store.memory = pool
+        web_pdf_merger.result_store.memory = pool
+        memory_pools.append(pool)
+        try:
+            uploaded = upload(client, "test1.pdf", "test2.pdf")
+            blob_folder = web_pdf_merger.upload_store.blob_folder
+            assert not os.listdir(blob_folder), "Small uploads should stay in memory"
+            assert all(info['path'] in pool and info['page_count'] == 1 for info in uploaded)
+            response = client.post('/metadata', json={'paths': [info['path'] for info in uploaded]})
+            assert response.get_json()['total_pages'] == 2
+
+            # Incremental edits copy the original from memory too
+            response = client.post('/edit/rotate_page', json={'pdf_path': uploaded[0]['path'], 'page_num': 0})
+            assert response.status_code == 200, response.get_json()
+            assert PdfReader(response.get_json()['output_path']).pages[0].rotation == 90
+            response = client.post('/edit/add_text', json={
+                'pdf_path': uploaded[1]['path'], 'page_num': 0, 'text': 'POOLED', 'x': 100, 'y': 100
+            })
+            assert response.status_code == 200, response.get_json()
+            assert "POOLED" in PdfReader(response.get_json()['output_path']).pages[0].extract_text()
+
+            response = client.post('/merge', json={'files': uploaded})
+            data = wait_for_job(client, response.get_json()['status_url'])
+            assert data['state'] == 'done', f"In-memory merge failed: {data}"
+            output_path = data['result']['output_path']
+            assert output_path in pool and not os.path.exists(output_path), "Result should stay in memory"
+
+            download_url = f"/download/{os.path.basename(output_path)}"
+            body = client.get(download_url).get_data()
+            assert len(PdfReader(io.BytesIO(body)).pages) == 2
+            response = client.get(download_url, headers={'Range': 'bytes=0-9'})
+            assert response.status_code == 206 and response.get_data() == body[:10]
+            etag = response.headers['ETag']
+
+            # Pooled files switch a parallel merge to streaming; streamed and
+            # queued requests still share one stored result
+            load_config = web_pdf_merger.load_config
+            web_pdf_merger.load_config = lambda: {'merge_strategy': 'parallel'}
+            try:
+                streamed = client.post('/merge', json={'files': uploaded, 'stream': True}).get_data()
+                response = client.post('/merge', json={'files': uploaded})
+                data = wait_for_job(client, response.get_json()['status_url'])
+                assert data['result']['cached'] is True, "Pooling should not change the result key"
+                assert client.get(f"/download/{os.path.basename(data['result']['output_path'])}").get_data() == streamed
+            finally:
+                web_pdf_merger.load_config = load_config
+
+            response = client.post('/edit/remove_page', json={'pdf_path': output_path, 'page_num': 0})
+            assert response.get_json()['total_pages'] == 1, "Edits should read results from memory"
+
+            # Outgrowing the pool writes the least recently used files to disk
+            pool.max_bytes = pool.total
+            pool.put(os.path.join(tmp, "extra.pdf"), b"x" * 100)
+            assert pool.spilled >= 1 and pool.total <= pool.max_bytes
+            assert os.listdir(blob_folder), "Spilled uploads should be on disk"
+            response = client.get(download_url, headers={'If-None-Match': etag})
+            assert response.status_code == 304, "Spilling must not change the ETag"
+            response = client.post('/merge', json={'files': uploaded[::-1]})
+            assert wait_for_job(client, response.get_json()['status_url'])['state'] == 'done'
+
+            # Uploads above the spill size go straight to disk
+            pool.spill_bytes = 100
+            big = upload(client, "test1.pdf")[0]
+            assert big['path'] not in pool and os.path.exists(big['path'])
+        finally:
+            memory_pools.remove(pool)
+            web_pdf_merger.memory_pool = None
+
+    print("In-memory merge path test PASSED")
+
+
+def test_batch_edit():
+    """Test that /edit/batch applies several operations and rejects bad ones"""
+    print("Testing batch edit endpoint...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(tmp)
+        uploaded = upload(client, "merged.pdf")[0]
+
+        response = client.post('/edit/batch', json={'pdf_path': uploaded['path'], 'operations': [
+            {'op': 'rotate', 'pages': 0, 'degrees': 90},
+            {'op': 'remove', 'pages': 1},
+        ]})
+        data = response.get_json()
+        assert response.status_code == 200 and data['total_pages'] == 1, f"Batch edit failed: {data}"
+        assert os.path.dirname(data['output_path']) == web_pdf_merger.app.config['EDITED_FOLDER']
+
+        response = client.post('/edit/batch', json={'pdf_path': uploaded['path'], 'operations': [{'op': 'explode'}]})
+        assert response.status_code == 400, "Unknown operations should be rejected"
+        response = client.post('/edit/batch', json={'pdf_path': uploaded['path'], 'operations': [
+            {'op': 'text', 'text': 'Bad', 'font': 'NoSuchFont'}]})
+        assert response.status_code == 400, "Invalid text options should be rejected"
+
+        response = client.post('/edit/batch', json={
+            'pdf_path': uploaded['path'], 'operations': [{'op': 'remove', 'pages': 0}], 'optimize': 'full'
+        })
+        with open(response.get_json()['output_path'], 'rb') as f:
+            assert b"/ObjStm" in f.read(), "Optimized edit should use object streams"
+        response = client.post('/edit/batch', json={
+            'pdf_path': uploaded['path'], 'operations': [], 'optimize': 'maximum'
+        })
+        assert response.status_code == 400, "Unknown optimization levels should be rejected"
+
+        response = client.post('/edit/add_text', json={'pdf_path': uploaded['path'], 'text': 'Approved', 'page_num': 1})
+        assert response.status_code == 200
+        reader = PdfReader(response.get_json()['output_path'])
+        assert "Approved" in reader.pages[1].extract_text(), "Text was not added"
+        assert "Approved" not in reader.pages[0].extract_text()
+
+    print("Batch edit endpoint test PASSED")
+
+
+def test_result_store_eviction():
+    """Test that the result store evicts least recently used results by size"""
+    print("Testing result store eviction...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ResultStore(tmp, max_bytes=2500)
+        paths = []
+        for i in range(3):
+            temp_path = store.temp_path(f"job{i}")
+            with open(temp_path, 'wb') as f:
+                f.write(b"x" * 1000)
+            # Give each result a distinct, increasing last-use time
+            paths.append(store.put(f"key{i}", temp_path))
+            os.utime(paths[-1], (i, i))
+        store.evict()
+
+        assert not os.path.exists(paths[0]), "Oldest result should be evicted"
+        assert store.lookup("key0") is None
+        assert store.lookup("key2") == paths[2]
+
+    print("Result store eviction test PASSED")
+
+
+if __name__ == "__main__":
+    test_upload_and_metadata()
+    test_upload_dedup_and_chunks()
+    test_upload_refs_and_expiry()
+    test_merge_job_queue()
+    test_job_events_and_cancel()
+    test_streamed_merge_and_download()
+    test_in_memory_merge()
+    test_batch_edit()
+    test_result_store_eviction()
+    print("ALL WEB API TESTS PASSED!")
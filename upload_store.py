@@ -0,0 +1,322 @@
+"""Content-addressed storage for uploaded PDFs with resumable chunked uploads"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from pdf_metadata import metadata_from_stream
+
+# Default largest accepted upload
+DEFAULT_MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# Seconds a chunked upload may sit idle before it is discarded
+DEFAULT_SESSION_TTL = 24 * 60 * 60
+# Least seconds between sweeps for expired uploads
+SWEEP_INTERVAL = 60 * 60
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the size cap"""
+
+
+class UploadConflict(Exception):
+    """Raised when a chunk does not start where the upload left off"""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class StoredUpload:
+    """An upload stored as a content-addressed blob"""
+
+    def __init__(self, path, sha256, size, metadata):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.metadata = metadata
+
+
+class UploadSession:
+    """State of an in-progress chunked upload"""
+
+    def __init__(self, upload_id, name, size, part_path):
+        self.id = upload_id
+        self.name = name
+        # Declared total size (None if unknown)
+        self.size = size
+        self.part_path = part_path
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.lock = threading.Lock()
+        # Last time a chunk arrived, for expiring abandoned uploads
+        self.updated = time.time()
+
+
+class UploadStore:
+    """Store uploads once per distinct content
+
+    Bytes are hashed while they are written, identical uploads share one
+    blob named by its SHA-256, and PDF metadata is read from the still
+    open file before it is moved into place. Blobs are reference counted
+    so deleting one list entry does not break another that shares it;
+    the counts are kept in refs.json so they survive restarts. Chunked
+    uploads left idle for session_ttl seconds are discarded.
+
+    With a memory_pool.MemoryPool, uploads small enough for the pool are
+    kept there under their blob path and never written to disk unless
+    the pool spills them.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_UPLOAD_BYTES, memory=None,
+                 session_ttl=DEFAULT_SESSION_TTL):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.memory = memory
+        self.session_ttl = session_ttl
+        self.sessions = {}
+        self.refs = {}
+        self.lock = threading.Lock()
+        self.last_sweep = 0
+        self.load_refs()
+
+    @property
+    def blob_folder(self):
+        return os.path.join(self.folder, 'blobs')
+
+    @property
+    def partial_folder(self):
+        return os.path.join(self.folder, 'partial')
+
+    @property
+    def refs_path(self):
+        return os.path.join(self.folder, 'refs.json')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_folder, f'{sha256}.pdf')
+
+    def load_refs(self):
+        """Load reference counts saved by an earlier run
+
+        Blobs that no longer exist (such as uploads that were only held
+        in memory) are dropped.
+        """
+        try:
+            with open(self.refs_path, 'r') as f:
+                counts = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        with self.lock:
+            self.refs = {
+                self.blob_path(os.path.splitext(name)[0]): count for name, count in counts.items()
+                if os.path.exists(os.path.join(self.blob_folder, name))
+            }
+
+    def _save_refs(self):
+        # Called with self.lock held
+        counts = {os.path.basename(path): count for path, count in self.refs.items()}
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f'{self.refs_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(counts, f)
+        os.replace(temp_path, self.refs_path)
+
+    def _finalize(self, handle, temp_path, sha256, size):
+        """Read metadata from the open temp file and move it to its blob"""
+        handle.seek(0)
+        try:
+            metadata = metadata_from_stream(handle)
+        except Exception as e:
+            metadata = {'page_count': 0, 'error': str(e)}
+        handle.close()
+
+        metadata['sha256'] = sha256
+        path = self.blob_path(sha256)
+        with self.lock:
+            if os.path.exists(path):
+                # Identical content is already stored
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+            self.refs[path] = self.refs.get(path, 0) + 1
+            self._save_refs()
+        return StoredUpload(path, sha256, size, metadata)
+
+    def _finalize_in_memory(self, buffer, sha256, size):
+        """Read metadata from an upload held in memory and keep it in the pool"""
+        buffer.seek(0)
+        try:
+            metadata = metadata_from_stream(buffer)
+        except Exception as e:
+            metadata = {'page_count': 0, 'error': str(e)}
+
+        metadata['sha256'] = sha256
+        path = self.blob_path(sha256)
+        with self.lock:
+            if path not in self.memory and not os.path.exists(path):
+                self.memory.put(path, buffer.getvalue())
+            self.refs[path] = self.refs.get(path, 0) + 1
+            self._save_refs()
+        return StoredUpload(path, sha256, size, metadata)
+
+    def save_stream(self, stream):
+        """Store a readable binary stream and return a StoredUpload
+
+        With a memory pool, the upload is buffered in memory until it
+        outgrows the pool's spill size and only then written to disk.
+        """
+        os.makedirs(self.blob_folder, exist_ok=True)
+        temp_path = os.path.join(self.blob_folder, f'{uuid.uuid4().hex}.tmp')
+        hasher = hashlib.sha256()
+        size = 0
+        buffer = io.BytesIO() if self.memory is not None else None
+        handle = None if buffer is not None else open(temp_path, 'w+b')
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise UploadTooLarge(f'File exceeds the {self.max_bytes} byte upload limit')
+                hasher.update(chunk)
+                if handle is None and not self.memory.accepts(size):
+                    # Too large for memory: continue on disk
+                    handle = open(temp_path, 'w+b')
+                    handle.write(buffer.getbuffer())
+                    buffer = None
+                if handle is None:
+                    buffer.write(chunk)
+                else:
+                    handle.write(chunk)
+            if handle is None:
+                return self._finalize_in_memory(buffer, hasher.hexdigest(), size)
+            return self._finalize(handle, temp_path, hasher.hexdigest(), size)
+        except BaseException:
+            if handle is not None:
+                handle.close()
+                os.remove(temp_path)
+            raise
+
+    def release(self, path):
+        """Drop one reference to a blob, deleting it when unused
+
+        Returns True if the file was removed.
+        """
+        with self.lock:
+            count = self.refs.get(path, 1) - 1
+            if count > 0:
+                self.refs[path] = count
+                self._save_refs()
+                return False
+            self.refs.pop(path, None)
+            self._save_refs()
+        if self.memory is not None and self.memory.discard(path):
+            return True
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def clear(self):
+        """Forget all reference counts and sessions, and drop uploads held in memory"""
+        with self.lock:
+            self.refs = {}
+            self.sessions = {}
+            self._save_refs()
+        if self.memory is not None:
+            self.memory.clear()
+
+    def start_session(self, name, size=None):
+        """Begin a resumable upload and return its session"""
+        if size is not None and size > self.max_bytes:
+            raise UploadTooLarge(f'File exceeds the {self.max_bytes} byte upload limit')
+        if time.time() - self.last_sweep >= SWEEP_INTERVAL:
+            self.expire_sessions()
+        os.makedirs(self.partial_folder, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        session = UploadSession(
+            upload_id, name, size, os.path.join(self.partial_folder, f'{upload_id}.part')
+        )
+        open(session.part_path, 'wb').close()
+        with self.lock:
+            self.sessions[upload_id] = session
+        return session
+
+    def get_session(self, upload_id):
+        with self.lock:
+            return self.sessions.get(upload_id)
+
+    def append_chunk(self, session, offset, stream):
+        """Append a chunk that starts at offset and return the new offset"""
+        with session.lock:
+            if offset != session.offset:
+                raise UploadConflict('Chunk does not continue the upload', session.offset)
+            with open(session.part_path, 'ab') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    if session.offset + len(chunk) > self.max_bytes:
+                        # Drop the partial chunk so the upload can be resumed
+                        f.truncate(offset)
+                        session.offset = offset
+                        session.hasher = self._rehash(session.part_path)
+                        raise UploadTooLarge(f'File exceeds the {self.max_bytes} byte upload limit')
+                    session.hasher.update(chunk)
+                    f.write(chunk)
+                    session.offset += len(chunk)
+            session.updated = time.time()
+            return session.offset
+
+    def expire_sessions(self):
+        """Discard uploads idle for longer than session_ttl
+
+        Also removes partial files no session owns that are as old, such
+        as those of uploads interrupted by a restart. Returns the number
+        of partial files removed.
+        """
+        self.last_sweep = now = time.time()
+        with self.lock:
+            expired = [session for session in self.sessions.values()
+                       if now - session.updated > self.session_ttl]
+        for session in expired:
+            # Skip uploads that are receiving a chunk right now
+            if not session.lock.acquire(blocking=False):
+                continue
+            with self.lock:
+                self.sessions.pop(session.id, None)
+            session.lock.release()
+
+        removed = 0
+        try:
+            names = os.listdir(self.partial_folder)
+        except FileNotFoundError:
+            return removed
+        with self.lock:
+            live = {os.path.basename(session.part_path) for session in self.sessions.values()}
+        for name in names:
+            path = os.path.join(self.partial_folder, name)
+            try:
+                if name not in live and now - os.path.getmtime(path) > self.session_ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    @staticmethod
+    def _rehash(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher
+
+    def finish_session(self, session):
+        """Complete a chunked upload and return its StoredUpload"""
+        with session.lock:
+            if session.size is not None and session.offset != session.size:
+                raise UploadConflict('Upload is incomplete', session.offset)
+            handle = open(session.part_path, 'r+b')
+            stored = self._finalize(handle, session.part_path, session.hasher.hexdigest(), session.offset)
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        return stored
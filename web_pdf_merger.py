@@ -1,10 +1,26 @@
 import os
 import json
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, send_file, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import PyPDF2
-from PyPDF2 import PdfWriter, PdfReader
 import io
+import time
+import uuid
+from contextlib import ExitStack
+
+from pdf_editor import EditError, edit_pdf
+from merge_engine import (
+    MergeJob, MergeSource, ParallelStrategy, StreamingStrategy, format_errors, options_from_config
+)
+from image_optimizer import ImageOptions
+from pdf_optimizer import DEFAULT_LEVEL, LEVELS
+from stamper import Stamp
+from pdf_metadata import MetadataCache
+from input_source import input_exists, memory_file, memory_pools
+from job_queue import DEFAULT_MAX_QUEUED, DEFAULT_WORKERS, JobQueue, QueueFull
+from memory_pool import DEFAULT_SPILL_BYTES, MemoryPool
+from response_pipe import DEFAULT_CHUNK_SIZE, PipeError, ResponsePipe
+from result_store import DEFAULT_MAX_BYTES, ResultStore
+from upload_store import DEFAULT_MAX_UPLOAD_BYTES, DEFAULT_SESSION_TTL, UploadConflict, UploadStore, UploadTooLarge
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
@@ -12,6 +28,7 @@ MERGED_FOLDER = 'merged'
 EDITED_FOLDER = 'edited'
 ALLOWED_EXTENSIONS = {'pdf'}
 CONFIG_FILE = 'web_config.json'
+METADATA_CACHE_FILE = 'web_metadata_cache.json'
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -24,6 +41,9 @@ app.config['MERGED_FOLDER'] = MERGED_FOLDER
 app.config['EDITED_FOLDER'] = EDITED_FOLDER
 app.secret_key = 'pdf_merger_secret_key_2023'
 
+# Page counts and metadata of uploaded files, computed once at upload time
+metadata_cache = MetadataCache(METADATA_CACHE_FILE)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
@@ -45,6 +65,98 @@ def save_config(config):
     except Exception as e:
         print(f"Could not save config: {e}")
 
+# Background merge jobs; concurrency comes from the optional job_workers
+# and max_queued_jobs keys in web_config.json
+_startup_config = load_config()
+merge_queue = JobQueue(
+    workers=_startup_config.get("job_workers", DEFAULT_WORKERS),
+    max_queued=_startup_config.get("max_queued_jobs", DEFAULT_MAX_QUEUED)
+)
+
+# Seconds between progress checks of a job event stream
+JOB_EVENT_INTERVAL = 0.25
+
+# Strategies that write each file out as soon as it is read; a streamed
+# merge uses one of them so the response starts with the first file
+STREAMING_STRATEGIES = (StreamingStrategy.name, ParallelStrategy.name)
+
+# Optional in-memory mode, enabled by memory_pool_bytes in web_config.json:
+# uploads and merge results up to memory_spill_bytes are kept in a shared
+# pool instead of uploads/ and merged/, and small merges run in memory
+memory_pool = None
+if _startup_config.get("memory_pool_bytes"):
+    memory_pool = MemoryPool(
+        _startup_config["memory_pool_bytes"],
+        spill_bytes=_startup_config.get("memory_spill_bytes", DEFAULT_SPILL_BYTES)
+    )
+    memory_pools.append(memory_pool)
+
+# Merge results keyed by their inputs, so repeated requests reuse the output
+result_store = ResultStore(
+    MERGED_FOLDER,
+    max_bytes=_startup_config.get("result_store_max_bytes", DEFAULT_MAX_BYTES),
+    memory=memory_pool
+)
+
+# Uploaded files, stored once per distinct content under uploads/blobs
+upload_store = UploadStore(
+    UPLOAD_FOLDER,
+    max_bytes=_startup_config.get("max_upload_bytes", DEFAULT_MAX_UPLOAD_BYTES),
+    memory=memory_pool,
+    session_ttl=_startup_config.get("upload_session_ttl", DEFAULT_SESSION_TTL)
+)
+
+# Worker processes for PDF work, set by the async server (async_server.py);
+# without it, edits run in the request thread and merges in the job thread
+cpu_pool = None
+
+def run_edit(pdf_path, operations, output_path, **options):
+    """Apply edits with pdf_editor.edit_pdf, in the CPU pool when there is one
+
+    Inputs held in the memory pool are edited in-process, where they live.
+    """
+    if cpu_pool is None or memory_file(pdf_path) is not None:
+        return edit_pdf(pdf_path, operations, output_path, **options)
+    return cpu_pool.call(edit_pdf, pdf_path, operations, output_path, **options)
+
+def unique_output_name(prefix, pdf_path):
+    """Build a per-request output file name so requests never overwrite each other"""
+    return f'{prefix}{uuid.uuid4().hex[:12]}_{os.path.basename(pdf_path)}'
+
+def edited_output_path(pdf_path):
+    """Return a fresh path in the edited folder for an edit of pdf_path"""
+    return os.path.join(app.config['EDITED_FOLDER'], unique_output_name('edited_', pdf_path))
+
+def edit_optimization(data):
+    """Return the requested output optimization level for an edit
+
+    Defaults to the optional edit_optimize key in web_config.json.
+    """
+    return data.get('optimize', load_config().get('edit_optimize', DEFAULT_LEVEL))
+
+def stored_file_response(path, download_name):
+    """Send a stored output with Content-Length, Range and ETag support
+
+    Output names are unique per content (result keys hash the inputs and
+    options of a deterministic merge; edits get fresh names), while the
+    result store touches modification times on every reuse and the memory
+    pool may move a file to disk. So the ETag comes from the name and size
+    rather than Flask's default, which includes the mtime.
+    """
+    data = memory_file(path)
+    size = len(data) if data is not None else os.path.getsize(path)
+    etag = f"{os.path.splitext(os.path.basename(path))[0]}-{size:x}"
+    if data is None:
+        return send_file(
+            os.path.abspath(path), as_attachment=True, download_name=download_name, conditional=True, etag=etag
+        )
+    
+    response = Response(data, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
 @app.route('/')
 def index():
     """Main page"""
@@ -63,15 +175,106 @@ def upload_files():
     for file in files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            uploaded_files.append({
-                'name': filename,
-                'path': filepath
-            })
+            try:
+                # Hashed, deduplicated and inspected while it is written
+                stored = upload_store.save_stream(file.stream)
+            except UploadTooLarge as e:
+                metadata_cache.save()
+                return jsonify({'error': f'{filename}: {str(e)}', 'files': uploaded_files}), 413
+            uploaded_files.append(uploaded_file_info(filename, stored))
+    metadata_cache.save()
     
     return jsonify({'files': uploaded_files})
 
+def uploaded_file_info(filename, stored):
+    """Describe a stored upload and seed the metadata cache with it"""
+    metadata_cache.store(stored.path, stored.metadata)
+    return {
+        'name': filename,
+        'path': stored.path,
+        'page_count': stored.metadata.get('page_count', 0),
+        'sha256': stored.sha256
+    }
+
+@app.route('/uploads', methods=['POST'])
+def start_chunked_upload():
+    """Begin a resumable upload sent in chunks"""
+    data = request.get_json()
+    filename = secure_filename(data.get('name', ''))
+    if not allowed_file(filename):
+        return jsonify({'error': 'Only PDF files are allowed'}), 400
+    
+    try:
+        session = upload_store.start_session(filename, size=data.get('size'))
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    
+    return jsonify({
+        'upload_id': session.id,
+        'offset': session.offset,
+        'upload_url': url_for('upload_chunk', upload_id=session.id)
+    }), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Report how many bytes of an upload were received, for resuming"""
+    session = upload_store.get_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'upload_id': session.id, 'offset': session.offset, 'size': session.size})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append the request body at the given offset of an upload"""
+    session = upload_store.get_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    offset = request.args.get('offset', 0, type=int)
+    try:
+        new_offset = upload_store.append_chunk(session, offset, request.stream)
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e), 'offset': session.offset}), 413
+    
+    return jsonify({'upload_id': session.id, 'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Finish an upload and add it to the file list"""
+    session = upload_store.get_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    try:
+        stored = upload_store.finish_session(session)
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    file_info = uploaded_file_info(session.name, stored)
+    metadata_cache.save()
+    
+    return jsonify({'files': [file_info]})
+
+@app.route('/metadata', methods=['POST'])
+def file_metadata():
+    """Return page counts, page sizes and encryption status for many files"""
+    data = request.get_json()
+    paths = data.get('paths', [])
+    
+    results = {}
+    total_pages = 0
+    for filepath in paths:
+        if not input_exists(filepath) or not allowed_file(filepath):
+            results[filepath] = {'error': 'File not found'}
+            continue
+        metadata = metadata_cache.get(filepath)
+        results[filepath] = metadata
+        total_pages += metadata.get('page_count', 0)
+    metadata_cache.save()
+    
+    return jsonify({'files': results, 'total_pages': total_pages})
+
 @app.route('/reorder', methods=['POST'])
 def reorder_files():
     """Reorder files"""
@@ -82,7 +285,7 @@ def reorder_files():
     valid_files = []
     for file_info in file_order:
         filepath = file_info.get('path', '')
-        if os.path.exists(filepath) and allowed_file(filepath):
+        if input_exists(filepath) and allowed_file(filepath):
             valid_files.append(file_info)
     
     return jsonify({'files': valid_files})
@@ -96,49 +299,239 @@ def merge_pdfs():
     if not file_order:
         return jsonify({'error': 'No files selected'}), 400
     
-    # Create PDF writer
-    writer = PdfWriter()
-    total_pages = 0
-    error_files = []
+    try:
+        # Each file may carry a page-range spec such as "1-3,10,-1"
+        sources = [
+            MergeSource(file_info.get('path', ''), name=file_info.get('name', ''),
+                        pages=file_info.get('pages') or None)
+            for file_info in file_order
+        ]
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid page ranges: {str(e)}'}), 400
+    options = options_from_config(load_config())
+    if 'stamp' in data:
+        # Per-request watermark / Bates numbering replaces the configured one
+        options.pop('stamp', None)
+        try:
+            stamp = Stamp.from_dict(data['stamp'])
+        except TypeError as e:
+            return jsonify({'error': f'Invalid stamp: {str(e)}'}), 400
+        if stamp is not None:
+            options['stamp'] = stamp
+    if 'images' in data:
+        # Per-request image downsampling replaces the configured settings
+        options.pop('images', None)
+        try:
+            images = ImageOptions.from_dict(data['images'])
+        except TypeError as e:
+            return jsonify({'error': f'Invalid image options: {str(e)}'}), 400
+        if images is not None:
+            options['images'] = images
+    if 'optimize' in data:
+        if data['optimize'] not in LEVELS:
+            return jsonify({'error': f"Invalid optimization level: {data['optimize']}"}), 400
+        options['optimize'] = data['optimize']
     
-    # Process each file in order
-    for file_info in file_order:
-        filepath = file_info.get('path', '')
-        filename = file_info.get('name', '')
+    # Identical inputs and options map to the same stored result. The key
+    # uses the options as requested, before streaming or pooling switch the
+    # strategy; the write buffer size and worker count do not change the output
+    key_options = {name: value for name, value in options.items() if name not in ('memory_limit', 'workers')}
+    key_options['pages'] = [source.pages for source in sources]
+    if 'stamp' in options:
+        key_options['stamp'] = options['stamp'].to_dict()
+    if 'images' in options:
+        key_options['images'] = options['images'].to_dict()
+    
+    def result_key():
+        try:
+            input_hashes = [metadata_cache.content_hash(source.path) for source in sources]
+            return result_store.key_for(input_hashes, key_options)
+        except OSError:
+            # Missing inputs; let the merge report them
+            return None
+    
+    # With "stream", the merged PDF is the response body itself
+    pipe = ResponsePipe() if data.get('stream') else None
+    key = None
+    if pipe is not None:
+        key = result_key()
+        cached_path = result_store.lookup(key) if key is not None else None
+        if cached_path is not None:
+            return stored_file_response(cached_path, 'merged.pdf')
+        # Stream writers emit each file as soon as it is read
+        if options['strategy'] not in STREAMING_STRATEGIES:
+            options['strategy'] = StreamingStrategy.name
+        # Flush in chunk-sized pieces unless a limit is configured
+        options.setdefault('memory_limit', DEFAULT_CHUNK_SIZE)
+    
+    # Small merges read and write only memory when the pool is enabled
+    in_memory = memory_pool is not None and memory_pool.accepts(sum(source.size() for source in sources))
+    # Worker processes cannot see files held in this process's memory
+    pooled = memory_pool is not None and any(source.path in memory_pool for source in sources)
+    if pooled and options['strategy'] == ParallelStrategy.name:
+        options['strategy'] = StreamingStrategy.name
+    # Merges from disk to disk can run in the CPU pool
+    offload = cpu_pool is not None and pipe is None and not in_memory and not pooled
+    
+    def run_merge(job):
+        try:
+            result = merge_into_store(job)
+        except Exception as e:
+            if pipe is not None:
+                pipe.finish(str(e))
+            raise
+        if pipe is not None:
+            pipe.finish()
+        return result
+    
+    def merge_into_store(job):
+        merge_key = key if pipe is not None else result_key()
+        if merge_key is not None and pipe is None:
+            cached_path = result_store.lookup(merge_key)
+            if cached_path is not None:
+                return {
+                    'success': True,
+                    'output_path': cached_path,
+                    'total_pages': metadata_cache.page_count(cached_path),
+                    'cached': True
+                }
         
+        # Merge through the shared engine into a job-scoped path (or a
+        # buffer, in memory); nothing is written if any file fails. A
+        # streamed merge writes the same bytes to the response and the
+        # path, so the result is stored either way.
+        temp_path = result_store.temp_path(job.id)
+        buffer = io.BytesIO() if in_memory else None
         try:
-            with open(filepath, 'rb') as f:
-                reader = PdfReader(f)
-                # Add all pages to writer
-                for page in reader.pages:
-                    writer.add_page(page)
-                total_pages += len(reader.pages)
+            if offload:
+                result = cpu_pool.merge(job, sources, temp_path, dict(options, strict=True))
+            else:
+                with ExitStack() as stack:
+                    output = temp_path if buffer is None else buffer
+                    if pipe is not None:
+                        pipe.copy = stack.enter_context(open(temp_path, 'wb')) if buffer is None else buffer
+                        output = pipe
+                    merge_job = MergeJob(sources, output, strict=True, **options)
+                    job.progress = merge_job.progress
+                    job.on_cancel = merge_job.cancel
+                    if job.cancel_requested:
+                        merge_job.cancel()
+                    result = merge_job.run()
         except Exception as e:
-            error_files.append((filename, str(e)))
-    
-    # Check for errors
-    if error_files:
-        error_msg = "Errors occurred with the following files:\n"
-        for filename, error in error_files[:3]:  # Show first 3 errors
-            error_msg += f"{filename}: {error}\n"
-        if len(error_files) > 3:
-            error_msg += f"\n... and {len(error_files) - 3} more files."
+            result_store.discard(temp_path)
+            raise RuntimeError(f'Failed to save merged PDF: {str(e)}')
         
-        return jsonify({'error': error_msg}), 400
-    
-    # Write merged PDF
-    output_path = os.path.join(app.config['MERGED_FOLDER'], 'merged.pdf')
-    try:
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        # Check for errors
+        if result.error_files:
+            result_store.discard(temp_path)
+            raise RuntimeError(format_errors(
+                result.error_files, header="Errors occurred with the following files:\n"
+            ))
         
-        return jsonify({
+        if buffer is None:
+            output_path = result_store.put(merge_key or job.id, temp_path)
+        else:
+            output_path = result_store.put_data(merge_key or job.id, buffer.getvalue())
+        return {
             'success': True,
             'output_path': output_path,
-            'total_pages': total_pages
-        })
-    except Exception as e:
-        return jsonify({'error': f'Failed to save merged PDF: {str(e)}'}), 500
+            'total_pages': result.total_pages,
+            'objects_deduplicated': result.objects_deduplicated,
+            'bytes_saved': result.bytes_saved,
+            'images_optimized': result.images_optimized,
+            'image_bytes_saved': result.image_bytes_saved,
+            'cached': False
+        }
+    
+    try:
+        job = merge_queue.submit(run_merge)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    if pipe is not None:
+        return streamed_merge_response(job, pipe, key)
+    
+    return jsonify({
+        'job_id': job.id,
+        'state': job.state,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+        'cancel_url': url_for('cancel_job', job_id=job.id)
+    }), 202
+
+def streamed_merge_response(job, pipe, key):
+    """Send the output of a merge job as it is written (chunked, length unknown)
+
+    Errors before the first byte are reported as JSON. A merge that fails
+    later ends the response early, so the client sees a truncated
+    transfer. A client that disconnects cancels the merge.
+    """
+    chunks = pipe.chunks(alive=lambda: not job.done)
+    try:
+        first = next(chunks, b'')
+    except PipeError as e:
+        return jsonify({'error': str(e), 'job_id': job.id}), 500
+    
+    def body():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            if not job.done:
+                job.cancel()
+    
+    response = Response(body(), mimetype='application/pdf')
+    response.headers['Content-Disposition'] = 'attachment; filename=merged.pdf'
+    response.headers['X-Job-Id'] = job.id
+    # Where the stored result can be downloaded again (with Range) later
+    response.headers['X-Download-Url'] = url_for('download_file', filename=f'{key or job.id}.pdf')
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the state and progress of a background job"""
+    job = merge_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's state and progress as server-sent events until it finishes"""
+    job = merge_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def events():
+        last = None
+        while True:
+            done = job.done
+            info = job.to_dict()
+            # elapsed changes constantly; only send real progress
+            state = dict(info, elapsed=None)
+            if state != last:
+                last = state
+                yield f"data: {json.dumps(info)}\n\n"
+            if done:
+                yield "event: done\ndata: {}\n\n"
+                return
+            time.sleep(JOB_EVENT_INTERVAL)
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job; its partial output is removed"""
+    job = merge_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.cancel():
+        return jsonify({'error': 'Job already finished', 'state': job.state}), 409
+    return jsonify({'job_id': job.id, 'state': job.state, 'cancel_requested': True}), 202
 
 @app.route('/edit/add_text', methods=['POST'])
 def add_text_to_pdf():
@@ -150,33 +543,23 @@ def add_text_to_pdf():
     x = data.get('x', 100)
     y = data.get('y', 750)
     
-    if not os.path.exists(pdf_path):
+    if not input_exists(pdf_path):
         return jsonify({'error': 'PDF file not found'}), 404
     
     try:
-        # Read the PDF
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Copy all pages to the writer
-        for i, page in enumerate(reader.pages):
-            if i == page_num:
-                # For simplicity, we'll create a new PDF with the text using reportlab
-                # In a real implementation, we would overlay text on the existing page
-                pass
-            writer.add_page(page)
-        
-        # Save edited PDF
-        output_filename = f'edited_{os.path.basename(pdf_path)}'
-        output_path = os.path.join(app.config['EDITED_FOLDER'], output_filename)
-        
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        # Overlays are rendered once and cached, then appended incrementally
+        output_path = edited_output_path(pdf_path)
+        run_edit(pdf_path, [{
+            'op': 'text', 'text': text, 'pages': page_num, 'x': x, 'y': y,
+            'font': data.get('font', 'Helvetica'), 'size': data.get('size', 12)
+        }], output_path, incremental=True, optimize=edit_optimization(data))
         
         return jsonify({
             'success': True,
             'output_path': output_path
         })
+    except EditError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to add text to PDF: {str(e)}'}), 500
 
@@ -187,31 +570,23 @@ def remove_page_from_pdf():
     pdf_path = data.get('pdf_path', '')
     page_num = data.get('page_num', 0)
     
-    if not os.path.exists(pdf_path):
+    if not input_exists(pdf_path):
         return jsonify({'error': 'PDF file not found'}), 404
     
     try:
-        # Read the PDF
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Copy all pages except the one to remove
-        for i, page in enumerate(reader.pages):
-            if i != page_num:
-                writer.add_page(page)
-        
-        # Save edited PDF
-        output_filename = f'edited_{os.path.basename(pdf_path)}'
-        output_path = os.path.join(app.config['EDITED_FOLDER'], output_filename)
-        
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        output_path = edited_output_path(pdf_path)
+        total_pages = run_edit(
+            pdf_path, [{'op': 'remove', 'pages': page_num}], output_path,
+            optimize=edit_optimization(data)
+        )
         
         return jsonify({
             'success': True,
             'output_path': output_path,
-            'total_pages': len(writer.pages)
+            'total_pages': total_pages
         })
+    except EditError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to remove page from PDF: {str(e)}'}), 500
 
@@ -223,35 +598,54 @@ def rotate_page_in_pdf():
     page_num = data.get('page_num', 0)
     rotation = data.get('rotation', 90)  # 90, 180, or 270 degrees
     
-    if not os.path.exists(pdf_path):
+    if not input_exists(pdf_path):
         return jsonify({'error': 'PDF file not found'}), 404
     
     try:
-        # Read the PDF
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
-        
-        # Copy all pages, rotating the specified one
-        for i, page in enumerate(reader.pages):
-            if i == page_num:
-                # Rotate the page
-                page.rotate(rotation)
-            writer.add_page(page)
-        
-        # Save edited PDF
-        output_filename = f'edited_{os.path.basename(pdf_path)}'
-        output_path = os.path.join(app.config['EDITED_FOLDER'], output_filename)
-        
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+        output_path = edited_output_path(pdf_path)
+        # Only the rotated page is appended to a copy of the original
+        run_edit(
+            pdf_path, [{'op': 'rotate', 'pages': page_num, 'degrees': rotation}], output_path,
+            incremental=True, optimize=edit_optimization(data)
+        )
         
         return jsonify({
             'success': True,
             'output_path': output_path
         })
+    except EditError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to rotate page in PDF: {str(e)}'}), 500
 
+@app.route('/edit/batch', methods=['POST'])
+def batch_edit_pdf():
+    """Apply an ordered list of page operations in a single pass"""
+    data = request.get_json()
+    pdf_path = data.get('pdf_path', '')
+    operations = data.get('operations', [])
+    incremental = data.get('incremental', True)
+    
+    if not input_exists(pdf_path):
+        return jsonify({'error': 'PDF file not found'}), 404
+    
+    try:
+        output_path = edited_output_path(pdf_path)
+        total_pages = run_edit(
+            pdf_path, operations, output_path, incremental=incremental,
+            optimize=edit_optimization(data)
+        )
+        
+        return jsonify({
+            'success': True,
+            'output_path': output_path,
+            'total_pages': total_pages
+        })
+    except EditError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Failed to edit PDF: {str(e)}'}), 500
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download merged file"""
@@ -260,10 +654,10 @@ def download_file(filename):
     else:
         output_path = os.path.join(app.config['MERGED_FOLDER'], filename)
     
-    if not os.path.exists(output_path):
+    if not input_exists(output_path):
         return jsonify({'error': 'File not found'}), 404
     
-    return send_file(output_path, as_attachment=True)
+    return stored_file_response(output_path, filename)
 
 @app.route('/delete_file', methods=['POST'])
 def delete_file():
@@ -271,9 +665,10 @@ def delete_file():
     data = request.get_json()
     filepath = data.get('path', '')
     
-    if os.path.exists(filepath):
+    if input_exists(filepath):
         try:
-            os.remove(filepath)
+            # Shared uploads are only removed once no list entry uses them
+            upload_store.release(filepath)
             return jsonify({'success': True})
         except Exception as e:
             return jsonify({'error': f'Failed to delete file: {str(e)}'}), 500
@@ -289,6 +684,11 @@ def clear_all():
                 filepath = os.path.join(folder, filename)
                 if os.path.isfile(filepath):
                     os.remove(filepath)
+        for folder in [upload_store.blob_folder, upload_store.partial_folder]:
+            if os.path.isdir(folder):
+                for filename in os.listdir(folder):
+                    os.remove(os.path.join(folder, filename))
+        upload_store.clear()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': f'Failed to clear files: {str(e)}'}), 500